@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+
+if TYPE_CHECKING:   # the api session is heavy to import, the app builds it after the first frame
+    from api_session import AsyncApiSession
+
+MAX_CONCURRENT_CHECKS = 8
+# all an alert needs of the current weather
+ALERT_VARIABLES = ["temperature_2m"]
+
+
+@dataclass(frozen=True)
+class TemperatureAlert:
+    city_name: str
+    min_temp: float
+    max_temp: float
+    latitude: float | None = None   # stored coords skip geocoding
+    longitude: float | None = None
+
+    @property
+    def is_located(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+
+
+@dataclass(frozen=True)
+class AlertResult:
+    alert: TemperatureAlert
+    current_temp: float
+    latitude: float     # where the city was found, worth storing if the alert wasn't located yet
+    longitude: float
+
+    @property
+    def messages(self) -> list[str]:
+        messages = []
+        if self.current_temp < self.alert.min_temp:
+            messages.append(f"The temperature for {self.alert.city_name} has dropped below {self.alert.min_temp}°C")
+        if self.current_temp > self.alert.max_temp:
+            messages.append(f"The temperature for {self.alert.city_name} has raised above {self.alert.max_temp}°C")
+        return messages
+
+    @property
+    def triggered(self) -> bool:
+        return bool(self.messages)
+
+
+async def locate_city(city_name: str) -> tuple[float, float]:
+    """Geocoding is blocking, keep it off the event loop."""
+    from geocoder import Location
+
+    return await asyncio.to_thread(Location(city_prompt=city_name).to_coords)
+
+
+class AlertEngine:
+    """
+    Evaluates all the alerts concurrently: every city is located and checked only once
+    (no matter how many alerts it has), at most `max_concurrency` cities at a time.
+    Alerts with stored coords are not geocoded at all.
+    """
+    def __init__(
+        self,
+        api: "AsyncApiSession",
+        locate: Callable[[str], Awaitable[tuple[float, float]]] = locate_city,
+        max_concurrency: int = MAX_CONCURRENT_CHECKS,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("At least one check must be allowed to run.")
+        self.api = api
+        self.locate = locate
+        self.max_concurrency = max_concurrency
+
+    async def evaluate(self, alerts: list[TemperatureAlert]) -> AsyncIterator[AlertResult]:
+        """
+        Yield results as soon as the weather for their city arrives (not in the order of `alerts`).
+        Cities that couldn't be checked are logged and skipped.
+        """
+        alerts_by_city: dict[str, list[TemperatureAlert]] = {}
+        for alert in alerts:
+            alerts_by_city.setdefault(alert.city_name, []).append(alert)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def check_city(city_name: str) -> tuple[str, tuple[float, float], float | None]:
+            located = [alert for alert in alerts_by_city[city_name] if alert.is_located]
+            async with semaphore:
+                try:
+                    if located:
+                        latitude, longitude = located[0].latitude, located[0].longitude
+                    else:
+                        latitude, longitude = await self.locate(city_name)
+                    weather = await self.api.get_current_weather(latitude, longitude, variables=ALERT_VARIABLES)
+                except Exception as e:     # one broken city must not hide alerts for the others
+                    logging.warning(f"Couldn't check alerts for {city_name}: {e}")
+                    return city_name, (None, None), None
+                return city_name, (latitude, longitude), weather.temperature_2m
+
+        tasks = [asyncio.create_task(check_city(city_name)) for city_name in alerts_by_city]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                city_name, (latitude, longitude), current_temp = await next_done
+                if current_temp is None:
+                    continue
+                for alert in alerts_by_city[city_name]:
+                    yield AlertResult(alert, current_temp, latitude, longitude)
+        finally:
+            for task in tasks:  # the consumer stopped early (e.g. screen was left)
+                task.cancel()
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from alert_engine import AlertEngine, AlertResult, TemperatureAlert
+
+CITIES = {"Warszawa": (52.2297, 21.0122), "Rome": (41.8919, 12.5113), "Paris": (48.8566, 2.3522)}
+TEMPERATURES = {(52.2297, 21.0122): -10.0, (41.8919, 12.5113): 35.0, (48.8566, 2.3522): 20.0}
+
+
+class FakeAsyncApi:
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def get_current_weather(self, latitude, longitude, variables=None):
+        assert variables == ["temperature_2m"]     # nothing else is downloaded
+        self.calls.append((latitude, longitude))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return SimpleNamespace(temperature_2m=TEMPERATURES[(latitude, longitude)])
+
+
+async def fake_locate(city_name):
+    if city_name not in CITIES:
+        raise ValueError(f"Unknown city {city_name}")
+    return CITIES[city_name]
+
+
+async def collect(engine, alerts):
+    return [result async for result in engine.evaluate(alerts)]
+
+
+def test_alerts_are_deduplicated_by_city():
+    api = FakeAsyncApi()
+    engine = AlertEngine(api, locate=fake_locate)
+    alerts = [
+        TemperatureAlert("Warszawa", -5, 30),
+        TemperatureAlert("Warszawa", -20, 30),
+        TemperatureAlert("Rome", -5, 30),
+        TemperatureAlert("Paris", -5, 30),
+    ]
+    results = asyncio.run(collect(engine, alerts))
+    assert len(api.calls) == 3
+    assert len(results) == 4
+    triggered = sorted(message for result in results for message in result.messages)
+    assert triggered == [
+        "The temperature for Rome has raised above 30°C",
+        "The temperature for Warszawa has dropped below -5°C",
+    ]
+
+def test_concurrency_is_bounded():
+    api = FakeAsyncApi()
+    engine = AlertEngine(api, locate=fake_locate, max_concurrency=2)
+    alerts = [TemperatureAlert(city, -5, 30) for city in CITIES]
+    asyncio.run(collect(engine, alerts))
+    assert api.max_running == 2
+
+def test_broken_city_does_not_hide_other_alerts():
+    engine = AlertEngine(FakeAsyncApi(), locate=fake_locate)
+    alerts = [TemperatureAlert("sdffffsdfsda", -5, 30), TemperatureAlert("Rome", -5, 30)]
+    results = asyncio.run(collect(engine, alerts))
+    assert [result.alert.city_name for result in results] == ["Rome"]
+
+def test_stored_coords_skip_geocoding():
+    async def failing_locate(city_name):
+        raise AssertionError("should not geocode")
+
+    engine = AlertEngine(FakeAsyncApi(), locate=failing_locate)
+    alerts = [TemperatureAlert("Warsaw, Poland", -5, 30, 52.2297, 21.0122)]
+    results = asyncio.run(collect(engine, alerts))
+    assert results[0].current_temp == -10.0
+    assert (results[0].latitude, results[0].longitude) == (52.2297, 21.0122)
+
+def test_alert_result_messages():
+    assert AlertResult(TemperatureAlert("Rome", -5, 30), 20.0, 41.8919, 12.5113).triggered is False
+    with pytest.raises(ValueError):
+        AlertEngine(FakeAsyncApi(), max_concurrency=0)
@@ -1,14 +1,29 @@
 import datetime as dt
 import logging
+import os
 import random
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Sequence
 
+import niquests
+import numpy as np
 import openmeteo_requests
 import pandas as pd
 import requests_cache
-from openmeteo_requests.Client import WeatherApiResponse
+from openmeteo_requests.Client import OpenMeteoRequestsError, WeatherApiResponse
 from retry_requests import retry
 
+from forecast_cache import (
+    FORECAST_TTL_SECONDS,
+    GRID_RESOLUTION,
+    STALE_FORECAST_MAX_AGE_SECONDS,
+    ForecastCache,
+    to_grid_cell,
+)
+from forecast_schema import is_variable_name, section_schema
+from request_scheduler import SingleFlight
+from tracing import tracer
+
 # https://open-meteo.com/en/docs
 # a dictionary of some major cities for random selection
 cities = {
@@ -25,10 +40,81 @@ cities = {
     "Warszawa": (52.2297, 21.0122),
 }
 
-class ApiSession:
-    def __init__(self, latitude: float = None, longitude: float = None):
+# Open-Meteo accepts comma separated lists of coordinates in a single request.
+# Keep the chunks small enough for the URL to stay well under server limits.
+BATCH_CHUNK_SIZE = 50
+
+# Another server speaking the same API can be used instead, e.g. the local stand-in (`stub_server.py`)
+OPEN_METEO_URL = os.environ.get("OPEN_METEO_URL", "https://api.open-meteo.com")
+
+# Sections of a forecast and the variables sessions request in each of them, unless a call asks for fewer
+SECTIONS = ("current", "hourly", "daily")
+DEFAULT_VARIABLES = {
+    "daily": (
+        "temperature_2m_max",
+        "temperature_2m_min",
+        "apparent_temperature_max",
+        "apparent_temperature_min",
+        "sunrise",
+        "sunset",
+        "daylight_duration",
+        "precipitation_hours",
+        "precipitation_sum",
+    ),
+    "hourly": (
+        "temperature_2m",
+        "apparent_temperature",
+        "relative_humidity_2m",
+    ),
+    "current": (
+        "temperature_2m",
+        "relative_humidity_2m",
+        "apparent_temperature",
+        "is_day",
+        "wind_speed_10m",
+        "wind_direction_10m",
+        "precipitation",
+        "cloud_cover",
+        "surface_pressure",
+    ),
+}
+
+RETRIES = 5
+BACKOFF_FACTOR = 0.2
+STATUS_TO_RETRY = (500, 502, 504)
+
+
+class BaseApiSession:
+    """
+    Everything shared by the blocking `ApiSession` and the asyncio based `AsyncApiSession`:
+    default location, request params, grid cells and the in-memory forecast cache.
+
+    Sessions are thread-safe: every request gets its own params (`_request_params()`), `params` itself
+    is never written to while fetching, and the forecast cache is locked. One `ApiSession`, with its one
+    HTTP connection pool, can serve a whole `ThreadPoolExecutor`. Change `params` before sharing the session.
+
+    Every call asks only for the section it returns (e.g. `get_hourly_forecast()` - only "hourly"),
+    with `variables=[...]` only for some of its variables. Cached responses are kept per section
+    with the variables they have, a response with more variables answers calls for fewer.
+
+    Misses of one grid cell at the same time (threads, coroutines, revalidations) share one request
+    through `SingleFlight`, across all the sessions given the same `single_flight`.
+    """
+    def __init__(
+        self,
+        latitude: float = None,
+        longitude: float = None,
+        grid_resolution: float = GRID_RESOLUTION,
+        forecast_cache: ForecastCache = None,
+        base_url: str = OPEN_METEO_URL,
+        single_flight: SingleFlight = None,
+    ):
         """
-        Initialize API session with provided coordinates (randomly chosen if not provided)
+        Initialize API session with provided coordinates (randomly chosen if not provided).
+        Requested coords are snapped to `grid_resolution` degrees, so nearby places share cached forecasts.
+        Pass the same `forecast_cache` to several sessions to let them share parsed responses,
+        and the same `single_flight` to let their concurrent misses of a grid cell share one request.
+        `base_url` is where the `/v1/forecast` endpoint is, Open-Meteo's server by default.
         """
         if not latitude or not longitude:  # coords wasn't provided, pick a random city
             random_city = random.choice(list(cities.keys()))
@@ -37,129 +123,482 @@ class ApiSession:
             raise ValueError("Latitude and Longitude must be float values.")
         logging.debug(f"Default city for API session: ({latitude}, {longitude})")
         self.change_default_location(latitude, longitude)
+        to_grid_cell(latitude, longitude, grid_resolution)  # validate resolution early
+        self.grid_resolution = grid_resolution
 
-        # Setup the Open-Meteo API client with cache and retry on error
-        self.__cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-        self.__retry_session = retry(self.__cache_session, retries=5, backoff_factor=0.2)
-        self.__openmeteo = openmeteo_requests.Client(session=self.__retry_session)
-
-        self.__url = "https://api.open-meteo.com/v1/forecast"
+        self._url = f"{base_url.rstrip('/')}/v1/forecast"
+        # What can be requested (the variables of every section), the coords are set per request
         self.__params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "daily": [
-                "temperature_2m_max",
-                "temperature_2m_min",
-                "apparent_temperature_max",
-                "apparent_temperature_min",
-                "sunrise",
-                "sunset",
-                "daylight_duration",
-                "precipitation_hours",
-                "precipitation_sum",
-            ],
-            "hourly": [
-                "temperature_2m",
-                "apparent_temperature",
-                "relative_humidity_2m",
-            ],
-            "current": [
-                "temperature_2m",
-                "relative_humidity_2m",
-                "apparent_temperature",
-                "is_day",
-                "wind_speed_10m",
-                "wind_direction_10m",
-                "precipitation",
-                "cloud_cover",
-                "surface_pressure",
-            ],
+            **{section: list(variables) for section, variables in DEFAULT_VARIABLES.items()},
             "timezone": "auto",
         }
 
-        self._last_response: WeatherApiResponse | None = None # типо атрибут если у тебя ласт респонса нет, то мы идем к следующему блоку, а если есть то мы его чекаем параметрами которыми ты написал
+        # Recently requested grid cells, per section:
+        # ((lat, lon), "hourly") -> {"response": ..., "variables": ("temperature_2m", ...), "forecast": ...}
+        self._forecast_cache = forecast_cache if forecast_cache is not None else \
+            ForecastCache(ttl=FORECAST_TTL_SECONDS, max_stale=STALE_FORECAST_MAX_AGE_SECONDS)    # like the app's
+        # Requests for a grid cell in flight (the key is the cell), misses and revalidations of it wait for them
+        self._single_flight = single_flight if single_flight is not None else SingleFlight()
 
     @property
-    def params(self):
+    def params(self) -> dict:
+        """The variables requested, `timezone`... (no coords, they are different for every request)."""
         return self.__params
 
+    @property
+    def cache_stats(self) -> dict[str, int]:
+        """Forecast cache counters, plus `fetches` (requests made on misses) and `coalesced` (misses that waited for one)."""
+        return {
+            **self._forecast_cache.stats,
+            "fetches": self._single_flight.calls,
+            "coalesced": self._single_flight.coalesced,
+        }
+
     def change_default_location(self, latitude: float, longitude: float):
         if not isinstance(latitude, float) or not isinstance(longitude, float):
             raise ValueError("Latitude and Longitude must be float values.")
-        self.__default_lat = latitude
-        self.__default_lon = longitude
+        self.__default_coords = (latitude, longitude)    # one assignment, other threads never see half of it
 
-    def __change_target_location(self, latitude: float, longitude: float):
+    def _to_grid_cell(self, latitude: float = None, longitude: float = None) -> tuple[float, float]:
+        """
+        Grid cell for provided coords. If coords are not provided, default coords will be used.
+        Requesting the grid cell instead of exact coords makes all the caches (in-memory and HTTP) key on it.
+        """
+        if not latitude or not longitude:
+            latitude, longitude = self.__default_coords
         if not isinstance(latitude, float) or not isinstance(longitude, float):
             raise ValueError("Latitude and Longitude must be float values.")
-        self.__params["latitude"] = latitude
-        self.__params["longitude"] = longitude
+        return to_grid_cell(latitude, longitude, self.grid_resolution)
 
-    def _make_api_call(self, latitude: float = None, longitude: float = None) -> WeatherApiResponse:
+    def _to_grid_cells(self, coords: list[tuple[float, float]]) -> list[tuple[float, float]]:
+        for latitude, longitude in coords:  # no fallback to default coords here
+            if not isinstance(latitude, float) or not isinstance(longitude, float):
+                raise ValueError("Latitude and Longitude must be float values.")
+        return [self._to_grid_cell(latitude, longitude) for latitude, longitude in coords]
+
+    def _selection(self, variables: dict[str, Sequence[str] | None]) -> tuple[tuple[str, tuple[str, ...]], ...]:
         """
-        Make a single call (only one city/result) for provided coords.
-        If coords are not provided, default coords will be used (set during initialization).
+        What a call asks for, hashable. `None` stands for all the variables of the section in `params`.
+        Example: `{"current": ["temperature_2m"], "hourly": None}`
+            -> `(("current", ("temperature_2m",)), ("hourly", ("temperature_2m", "apparent_temperature", ...)))`
         """
-        # Update self.__params if args are provided else use default values
-        if not latitude or not longitude:
-            latitude = self.__default_lat
-            longitude = self.__default_lon
-        self.__change_target_location(latitude, longitude)
+        if not variables or any(section not in SECTIONS for section in variables):
+            raise ValueError(f"Sections must be some of {SECTIONS}, got {list(variables or [])}.")
+        selection = []
+        for section in SECTIONS:
+            if section not in variables:
+                continue
+            names = variables[section]
+            names = tuple(dict.fromkeys(self.__params[section] if names is None else names))  # no duplicates
+            if not names or not all(isinstance(name, str) for name in names):
+                raise ValueError(f"Variables of {section} must be a non-empty list of names, got {names}.")
+            selection.append((section, names))
+        return tuple(selection)
+
+    def _request_params(self, cell: tuple[float, float], selection: tuple) -> dict:
+        """A new dict for every request, nothing shared with other requests (or threads) is changed."""
+        params = {key: value for key, value in self.__params.items() if key not in SECTIONS}
+        params.update({section: list(names) for section, names in selection})
+        return {"latitude": cell[0], "longitude": cell[1], **params}
+
+    def _batch_params(self, cells: list[tuple[float, float]], selection: tuple) -> dict:
+        params = self._request_params(cells[0], selection)
+        params["latitude"] = ",".join(str(latitude) for latitude, _ in cells)
+        params["longitude"] = ",".join(str(longitude) for _, longitude in cells)
+        return params
 
-        # А вот это если у нас уже есть ласт респонс то мы его просто реюзаем
-        if self._last_response:
-            resp_lat = self._last_response.Latitude()
-            resp_lon = self._last_response.Longitude()
-            if resp_lat == latitude and resp_lon == longitude:
-                return self._last_response
+    @staticmethod
+    def _covers(entry: dict | None, names: tuple[str, ...]) -> bool:
+        return entry is not None and set(names) <= set(entry["variables"])
 
-        # Process first location. Add a for-loop for multiple locations or weather models
-        responses = self.__openmeteo.weather_api(self.__url, params=self.__params)
-        self._last_response = responses[0]
-        return self._last_response
+    def _cached_entries(self, cell: tuple[float, float], selection: tuple) -> dict[str, dict] | None:
+        """
+        Cached entries of every selected section (section -> entry), if all of them have the selected variables.
+        Sections selected together must come from one response, `_make_api_call()` returns just one.
+        """
+        entries = {section: self._forecast_cache.get((cell, section)) for section, _ in selection}
+        found = all(self._covers(entries[section], names) for section, names in selection) \
+            and len({id(entry["response"]) for entry in entries.values()}) == 1
+        return entries if found else None
+
+    def _covered(self, entries: dict[str, dict], selection: tuple) -> dict[str, dict] | None:
+        """Entries of the selected sections, if a request (maybe made for another call) brought all of them."""
+        if all(self._covers(entries.get(section), names) for section, names in selection):
+            return {section: entries[section] for section, _ in selection}
+        return None
+
+    def _lookup(self, cell: tuple[float, float], selection: tuple) -> dict[str, dict] | None:
+        """`_cached_entries()`, counted as a hit or a miss of the forecast cache."""
+        entries = self._cached_entries(cell, selection)
+        tracer.count("forecast_cache.miss" if entries is None else "forecast_cache.hit")
+        return entries
+
+    def _cache_responses(
+        self, cells: list[tuple[float, float]], responses: list[WeatherApiResponse], selection: tuple, age: float = 0.0
+    ) -> list[dict[str, dict]]:
+        if len(responses) != len(cells):
+            raise ValueError(f"Expected {len(cells)} responses, got {len(responses)}.")
+        cached = []
+        for cell, response in zip(cells, responses):
+            entries = {section: {"response": response, "variables": names} for section, names in selection}
+            for section, entry in entries.items():
+                self._forecast_cache.put((cell, section), entry, age)
+            cached.append(entries)
+        return cached
 
-        # здесь реюзаем ласт респонс в случае если его нет ты делаешь новый колл
+    @staticmethod
+    def _parse(entry: dict, kind: str) -> "WeatherForecast":
+        """
+        Parse the cached response into `kind` ("current", "hourly" or "daily") forecast only once.
+        Threads parsing the same entry at once all get the forecast stored first.
+        """
+        if "forecast" not in entry:
+            create = getattr(WeatherForecastFactory, f"create_{kind}_weather_forecast")
+            with tracer.span("parse"):
+                forecast = create(entry["response"], entry["variables"])
+            return entry.setdefault("forecast", forecast)    # atomic
+        return entry["forecast"]
+
+
+class ApiSession(BaseApiSession):
+    def __init__(
+        self,
+        latitude: float = None,
+        longitude: float = None,
+        grid_resolution: float = GRID_RESOLUTION,
+        forecast_cache: ForecastCache = None,
+        base_url: str = OPEN_METEO_URL,
+        single_flight: SingleFlight = None,
+    ):
+        super().__init__(latitude, longitude, grid_resolution, forecast_cache, base_url, single_flight)
+
+        # Setup the Open-Meteo API client with cache and retry on error.
+        # Expired responses are kept for a while: shown while revalidating, or when the network is down.
+        self.__cache_session = requests_cache.CachedSession(
+            ".cache", expire_after=FORECAST_TTL_SECONDS, stale_if_error=STALE_FORECAST_MAX_AGE_SECONDS
+        )
+        self.__retry_session = retry(
+            self.__cache_session, retries=RETRIES, backoff_factor=BACKOFF_FACTOR, status_to_retry=STATUS_TO_RETRY
+        )
+        self.__openmeteo = openmeteo_requests.Client(session=self.__retry_session)
+
+    def __get_cache_entries(
+        self, selection: tuple, latitude: float = None, longitude: float = None
+    ) -> dict[str, dict]:
+        """
+        Return cached entries (section -> entry) for provided coords, calling the API on a miss.
+        If coords are not provided, default coords will be used (set during initialization).
+        """
+        cell = self._to_grid_cell(latitude, longitude)
+        entries = self._lookup(cell, selection)
+        while entries is None:  # the request in flight for the cell may have been for other sections or variables
+            fetched, _ = self._single_flight.do(cell, lambda: self.__fetch_entries(cell, selection))
+            entries = self._covered(fetched, selection)
+        return entries
+
+    def __fetch_entries(
+        self, cell: tuple[float, float], selection: tuple, force_refresh: bool = False
+    ) -> tuple[dict[str, dict], float]:
+        """Entries (section -> entry) and their age, see `__fetch()`."""
+        # a request for the cell may have finished between the cache miss and becoming the leader
+        if not force_refresh and (entries := self._cached_entries(cell, selection)) is not None:
+            return entries, 0.0
+        # Process first location. Use _make_api_call_many() for multiple locations
+        options = {"force_refresh": True} if force_refresh else {}
+        responses, age = self.__fetch(self._request_params(cell, selection), **options)
+        return self._cache_responses([cell], responses[:1], selection, age)[0], age
+
+    def __fetch(self, params: dict, **kwargs) -> tuple[list[WeatherApiResponse], float]:
+        """
+        Every request of the session goes through here: timed, and counted as answered by `requests_cache` or not.
+        Returns the responses and their age in seconds, not 0 if `requests_cache` answered. E.g. with the network down
+        an expired response is served (`stale_if_error`), it must not be cached in memory as a fresh one.
+        """
+        # the hooks may run more than once per call (a fresh response is dispatched again once cached), the last one counts
+        seen = []
+        hooks = kwargs.pop("hooks", {}).get("response", [])
+        kwargs["hooks"] = {"response": [*(hooks if isinstance(hooks, list) else [hooks]), lambda response, **_: seen.append(response)]}
+        try:
+            with tracer.span("http"):
+                responses = self.__openmeteo.weather_api(self._url, params=params, **kwargs)
+        finally:
+            if seen:
+                tracer.count("requests_cache.hit" if getattr(seen[-1], "from_cache", False) else "requests_cache.miss")
+        return responses, self.__response_age(seen[-1]) if seen else 0.0
+
+    @staticmethod
+    def __response_age(response) -> float:
+        created_at = getattr(response, "created_at", None)
+        if not getattr(response, "from_cache", False) or created_at is None:
+            return 0.0
+        return max(0.0, (dt.datetime.now(dt.timezone.utc) - created_at.replace(tzinfo=dt.timezone.utc)).total_seconds())
+
+    def _make_api_call(
+        self, latitude: float = None, longitude: float = None, variables: dict[str, Sequence[str] | None] = None
+    ) -> WeatherApiResponse:
+        """
+        Make a single call (only one city/result) for provided coords.
+        If coords are not provided, default coords will be used (set during initialization).
+        `variables` - section -> variable names (None for all of them), every section with all its variables by default.
+        """
+        selection = self._selection(variables or dict.fromkeys(SECTIONS))
+        return next(iter(self.__get_cache_entries(selection, latitude, longitude).values()))["response"]
+
+    def __get_cache_entries_many(
+        self, coords: list[tuple[float, float]], selection: tuple, chunk_size: int = BATCH_CHUNK_SIZE
+    ) -> list[dict[str, dict]]:
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be a positive integer.")
+        cells = self._to_grid_cells(coords)
+
+        # Only the locations that are not cached yet go over the network
+        entries = {cell: self._lookup(cell, selection) for cell in cells}
+        missing = [cell for cell, entry in entries.items() if entry is None]
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            responses, age = self.__fetch(self._batch_params(chunk, selection))
+            entries.update(zip(chunk, self._cache_responses(chunk, responses, selection, age)))
+        return [entries[cell] for cell in cells]
+
+    def _make_api_call_many(
+        self,
+        coords: list[tuple[float, float]],
+        chunk_size: int = BATCH_CHUNK_SIZE,
+        variables: dict[str, Sequence[str] | None] = None,
+    ) -> list[WeatherApiResponse]:
+        """
+        Make calls for many cities at once, one response per provided coords (same order).
+        Coords are sent as comma separated lists, so N cities cost about N/chunk_size round trips.
+        """
+        selection = self._selection(variables or dict.fromkeys(SECTIONS))
+        return [
+            next(iter(entries.values()))["response"]
+            for entries in self.__get_cache_entries_many(coords, selection, chunk_size)
+        ]
+
+    def get_stale_forecast(
+        self, kind: str, latitude: float = None, longitude: float = None, variables: Sequence[str] = None
+    ) -> tuple["WeatherForecast", float] | None:
+        """
+        Last known `kind` ("current", "hourly" or "daily") forecast for provided coords and its age in seconds,
+        possibly expired already. None if there is none. Never goes over the network:
+        the in-memory cache is asked first, then the HTTP cache on disk (it survives restarts).
+        """
+        cell = self._to_grid_cell(latitude, longitude)
+        selection = self._selection({kind: variables})
+        if (stale := self._forecast_cache.get_stale((cell, kind))) is not None and self._covers(stale[0], selection[0][1]):
+            entry, age = stale
+            return self._parse(entry, kind), age
+
+        try:
+            responses, age = self.__fetch(self._batch_params([cell], selection), only_if_cached=True)
+        except OpenMeteoRequestsError:  # 504 - not in the HTTP cache
+            return None
+        entries = self._cache_responses([cell], responses[:1], selection, age)[0]
+        return self._parse(entries[kind], kind), age
+
+    def revalidate_forecast(
+        self, kind: str, latitude: float = None, longitude: float = None, variables: Sequence[str] = None
+    ) -> "WeatherForecast":
+        """
+        Fetch a fresh `kind` forecast for provided coords, bypassing both caches (and updating them).
+        A request for the cell in flight already (a miss, another revalidation) is waited for instead.
+        Raises if there is no fresh one (e.g. the network is down), the stale one is what the caller has already.
+        """
+        cell = self._to_grid_cell(latitude, longitude)
+        selection = self._selection({kind: variables})
+        entries = None
+        while entries is None:
+            fetched, age = self._single_flight.do(cell, lambda: self.__fetch_entries(cell, selection, force_refresh=True))
+            entries = self._covered(fetched, selection)
+        if age >= self._forecast_cache.ttl:
+            raise OpenMeteoRequestsError(f"Couldn't revalidate the forecast, got a {age:.0f} s old one from the cache.")
+        return self._parse(entries[kind], kind)
+
+    def __get_forecast(self, kind: str, latitude: float, longitude: float, variables: Sequence[str], verbose: bool):
+        entries = self.__get_cache_entries(self._selection({kind: variables}), latitude, longitude)
+        forecast = self._parse(entries[kind], kind)
+        if verbose:
+            forecast.print_info()
+        return forecast
+
+    def __get_forecasts_many(
+        self, kind: str, coords: list[tuple[float, float]], variables: Sequence[str], verbose: bool
+    ) -> list:
+        entries = self.__get_cache_entries_many(coords, self._selection({kind: variables}))
+        forecasts = [self._parse(cell_entries[kind], kind) for cell_entries in entries]
+        if verbose:
+            for forecast in forecasts:
+                forecast.print_info()
+        return forecasts
 
     def get_current_weather(
-        self, latitude: float = None, longitude: float = None, verbose=False
+        self, latitude: float = None, longitude: float = None, verbose=False, variables: Sequence[str] = None
     ) -> "CurrentWeatherForecast":
         """
-        Get (print) current weather
+        Get (print) current weather. Only the `variables` are requested (all of them by default),
+        the fields of the others are None.
         """
-        response = self._make_api_call(latitude, longitude)
-        current = WeatherForecastFactory.create_current_weather_forecast(response)
-        if verbose:
-            current.print_info()
-        return current
+        return self.__get_forecast("current", latitude, longitude, variables, verbose)
 
     def get_hourly_forecast(
-        self, latitude: float = None, longitude: float = None, verbose=False
+        self, latitude: float = None, longitude: float = None, verbose=False, variables: Sequence[str] = None
     ) -> "HourlyWeatherForecast":
         """
         Get hourly forecast of the next 7 days.
         Used for plotting.
         """
-        response = self._make_api_call(latitude, longitude)
-        hourly = WeatherForecastFactory.create_hourly_weather_forecast(response)
-        if verbose:
-            hourly.print_info()
-        return hourly
+        return self.__get_forecast("hourly", latitude, longitude, variables, verbose)
 
     def get_daily_forecast(
-        self, latitude: float = None, longitude: float = None, verbose=False
+        self, latitude: float = None, longitude: float = None, verbose=False, variables: Sequence[str] = None
     ) -> "DailyWeatherForecast":
         """
         Get daily forecast of the next 7 days.
         Used for plotting.
         """
-        response = self._make_api_call(latitude, longitude)
-        daily = WeatherForecastFactory.create_daily_weather_forecast(response)
-        if verbose:
-            daily.print_info()
-        return daily
+        return self.__get_forecast("daily", latitude, longitude, variables, verbose)
+
+    def get_current_weather_many(
+        self, coords: list[tuple[float, float]], verbose=False, variables: Sequence[str] = None
+    ) -> list["CurrentWeatherForecast"]:
+        """
+        Get current weather for many cities using batched requests.
+        """
+        return self.__get_forecasts_many("current", coords, variables, verbose)
+
+    def get_hourly_forecast_many(
+        self, coords: list[tuple[float, float]], verbose=False, variables: Sequence[str] = None
+    ) -> list["HourlyWeatherForecast"]:
+        """
+        Get hourly forecasts of the next 7 days for many cities using batched requests.
+        """
+        return self.__get_forecasts_many("hourly", coords, variables, verbose)
 
-# These classes represent received weather data (JSON response parsed to dataclasses)
-@dataclass(frozen=True)
+    def get_daily_forecast_many(
+        self, coords: list[tuple[float, float]], verbose=False, variables: Sequence[str] = None
+    ) -> list["DailyWeatherForecast"]:
+        """
+        Get daily forecasts of the next 7 days for many cities using batched requests.
+        """
+        return self.__get_forecasts_many("daily", coords, variables, verbose)
+
+    def close(self):
+        self.__cache_session.close()
+
+
+class AsyncApiSession(BaseApiSession):
+    """
+    asyncio counterpart of `ApiSession`, network waits don't block the event loop.
+    Uses the same in-memory forecast cache (share it with an `ApiSession` by passing `forecast_cache`)
+    and the same retry policy. There is no HTTP level cache, `requests_cache` is blocking only.
+    """
+    def __init__(
+        self,
+        latitude: float = None,
+        longitude: float = None,
+        grid_resolution: float = GRID_RESOLUTION,
+        forecast_cache: ForecastCache = None,
+        base_url: str = OPEN_METEO_URL,
+        single_flight: SingleFlight = None,
+    ):
+        super().__init__(latitude, longitude, grid_resolution, forecast_cache, base_url, single_flight)
+
+        # Setup the Open-Meteo async API client with retry on error
+        retries = niquests.RetryConfiguration(
+            total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=STATUS_TO_RETRY
+        )
+        self.__session = niquests.AsyncSession(retries=retries)
+        self.__openmeteo = openmeteo_requests.AsyncClient(session=self.__session)
+
+    async def __get_cache_entries(self, cells: list[tuple[float, float]], selection: tuple) -> list[dict[str, dict]]:
+        """
+        Missing cells are fetched in batches. Cells some other call (this session's or one sharing `single_flight`)
+        is fetching already are waited for, those requests may have been for other sections or variables though.
+        """
+        entries = {cell: self._lookup(cell, selection) for cell in cells}
+        while missing := [cell for cell, entry in entries.items() if entry is None]:
+            fetched = await self._single_flight.do_many_async(missing, lambda led: self.__fetch_entries(led, selection))
+            entries.update({cell: self._covered(fetched[cell][0], selection) for cell in missing})
+        return [entries[cell] for cell in cells]
+
+    async def __fetch_entries(self, cells: list[tuple[float, float]], selection: tuple) -> dict[tuple, tuple[dict, float]]:
+        # requests for some of the cells may have finished between the cache misses and becoming the leader
+        fetched = {cell: (entries, 0.0) for cell in cells if (entries := self._cached_entries(cell, selection)) is not None}
+        missing = [cell for cell in cells if cell not in fetched]
+        for start in range(0, len(missing), BATCH_CHUNK_SIZE):
+            chunk = missing[start:start + BATCH_CHUNK_SIZE]
+            with tracer.span("http"):
+                responses = await self.__openmeteo.weather_api(self._url, params=self._batch_params(chunk, selection))
+            fetched.update((cell, (entries, 0.0)) for cell, entries in zip(chunk, self._cache_responses(chunk, responses, selection)))
+        return fetched
+
+    async def _make_api_call(
+        self, latitude: float = None, longitude: float = None, variables: dict[str, Sequence[str] | None] = None
+    ) -> WeatherApiResponse:
+        selection = self._selection(variables or dict.fromkeys(SECTIONS))
+        entries = await self.__get_cache_entries([self._to_grid_cell(latitude, longitude)], selection)
+        return next(iter(entries[0].values()))["response"]
+
+    async def prefetch_many(
+        self, coords: list[tuple[float, float]], variables: dict[str, Sequence[str] | None]
+    ) -> None:
+        """
+        Fill the forecast cache for many cities in batched requests, several sections in each of them.
+        Example: `{"hourly": None, "current": ["temperature_2m"]}` - later calls for any of these are served from memory.
+        """
+        await self.__get_cache_entries(self._to_grid_cells(coords), self._selection(variables))
+
+    async def __get_forecasts(
+        self, kind: str, cells: list[tuple[float, float]], variables: Sequence[str] = None
+    ) -> list["WeatherForecast"]:
+        entries = await self.__get_cache_entries(cells, self._selection({kind: variables}))
+        return [self._parse(cell_entries[kind], kind) for cell_entries in entries]
+
+    async def get_current_weather(
+        self, latitude: float = None, longitude: float = None, variables: Sequence[str] = None
+    ) -> "CurrentWeatherForecast":
+        return (await self.__get_forecasts("current", [self._to_grid_cell(latitude, longitude)], variables))[0]
+
+    async def get_hourly_forecast(
+        self, latitude: float = None, longitude: float = None, variables: Sequence[str] = None
+    ) -> "HourlyWeatherForecast":
+        return (await self.__get_forecasts("hourly", [self._to_grid_cell(latitude, longitude)], variables))[0]
+
+    async def get_daily_forecast(
+        self, latitude: float = None, longitude: float = None, variables: Sequence[str] = None
+    ) -> "DailyWeatherForecast":
+        return (await self.__get_forecasts("daily", [self._to_grid_cell(latitude, longitude)], variables))[0]
+
+    async def get_current_weather_many(
+        self, coords: list[tuple[float, float]], variables: Sequence[str] = None
+    ) -> list["CurrentWeatherForecast"]:
+        return await self.__get_forecasts("current", self._to_grid_cells(coords), variables)
+
+    async def get_hourly_forecast_many(
+        self, coords: list[tuple[float, float]], variables: Sequence[str] = None
+    ) -> list["HourlyWeatherForecast"]:
+        return await self.__get_forecasts("hourly", self._to_grid_cells(coords), variables)
+
+    async def get_daily_forecast_many(
+        self, coords: list[tuple[float, float]], variables: Sequence[str] = None
+    ) -> list["DailyWeatherForecast"]:
+        return await self.__get_forecasts("daily", self._to_grid_cells(coords), variables)
+
+    async def close(self):
+        await self.__session.close()
+
+# These classes represent received weather data (flatbuffers response decoded by variable name, see `forecast_schema.py`).
+# Variables are attributes: `forecast.temperature_2m`, None for a valid name that wasn't requested.
+def variable_or_none(values: dict, name: str):
+    if name in values:
+        return values[name]
+    if is_variable_name(name):
+        return None
+    raise AttributeError(name)
+
+
+@dataclass(frozen=True, slots=True)
 class WeatherForecast:  # or Position?
     latitude: float
     longitude: float
@@ -173,179 +612,194 @@ class WeatherForecast:  # or Position?
         print(f"Timezone difference to GMT+0: {self.timezone_diff_utc0}s")
 
 
-@dataclass(frozen=True)
+# `slots=True` makes new classes, so the methods below call the base class by name instead of `super()`
+@dataclass(frozen=True, slots=True)
 class CurrentWeatherForecast(WeatherForecast):
-    time: str
-    temperature_2m: float
-    relative_humidity_2m: float
-    apparent_temperature: float
-    is_day: int
-    wind_speed_10m: float
-    wind_direction_10m: float
-    precipitation: float
-    cloud_cover: float
-    surface_pressure: float
+    time: int
+    values: dict[str, float]    # variable name -> value, for every requested variable
+
+    def __getattr__(self, name: str):
+        try:
+            values = object.__getattribute__(self, "values")
+        except AttributeError:  # not initialized yet
+            raise AttributeError(name) from None
+        return variable_or_none(values, name)
 
     def print_info(self):
         print("\n--------- Current weather ---------")
-        super().print_info()
+        WeatherForecast.print_info(self)
         print(f"\nCurrent time: {self.time}")
-        print(f"Current temperature_2m: {self.temperature_2m}")
-        print(f"Current relative_humidity_2m: {self.relative_humidity_2m}")
-        print(f"Current apparent_temperature: {self.apparent_temperature}")
-        print(f"Current is_day: {self.is_day}")
-        print(f"Current wind_speed_10m: {self.wind_speed_10m}")
-        print(f"Current wind_direction_10m: {self.wind_direction_10m}")
-        print(f"Current precipitation: {self.precipitation}")
-        print(f"Current cloud_cover: {self.cloud_cover}")
-        print(f"Current surface_pressure: {self.surface_pressure}")
-
-
-@dataclass(frozen=True)
+        for name, value in self.values.items():
+            print(f"Current {name}: {value}")
+
+
+@dataclass(frozen=True, slots=True, eq=False)
 class IntervalicWeatherForecast(WeatherForecast):
+    """
+    Columnar: one float32 row of `values` per name in `names`, one column per time step
+    (`time`, `time + interval`, ... before `time_end`). Int64 variables (`sunrise`, `sunset`) are rows of `int64_values`.
+    `forecast.temperature_2m` is a view of its row.
+    """
     time: int
     time_end: int
     interval: int
+    names: tuple[str, ...]
+    values: np.ndarray  # float32, (len(names), steps)
+    int64_names: tuple[str, ...] = ()
+    int64_values: np.ndarray = None     # int64, (len(int64_names), steps)
+    _dataframe: pd.DataFrame = field(default=None, init=False, repr=False)   # built by the first to_dataframe()
+
+    def __post_init__(self):
+        if self.int64_values is None:
+            object.__setattr__(self, "int64_values", np.empty((0, self.values.shape[1]), dtype=np.int64))
+        if self.values.shape != (len(self.names), self.steps) or self.int64_values.shape != (len(self.int64_names), self.steps):
+            raise ValueError("Every variable needs one value per time step.")
+
+    @classmethod
+    def from_columns(cls, latitude: float, longitude: float, elevation: float, timezone_diff_utc0: int,
+                     time: int, time_end: int, interval: int, columns: dict[str, np.ndarray]):
+        """Variable name -> one value per time step, e.g. `SectionSchema.decode()`. The float ones are copied into one block."""
+        names = tuple(name for name, column in columns.items() if np.asarray(column).dtype != np.int64)
+        int64_names = tuple(name for name in columns if name not in names)
+        steps = (time_end - time) // interval
+        values = np.empty((len(names), steps), dtype=np.float32)
+        int64_values = np.empty((len(int64_names), steps), dtype=np.int64)
+        try:
+            for row, name in enumerate(names):
+                values[row] = columns[name]
+            for row, name in enumerate(int64_names):
+                int64_values[row] = columns[name]
+        except ValueError:
+            raise ValueError("Every variable needs one value per time step.") from None
+        return cls(latitude, longitude, elevation, timezone_diff_utc0, time, time_end, interval,
+                   names, values, int64_names, int64_values)
+
+    def __getattr__(self, name: str):
+        try:
+            names = object.__getattribute__(self, "names")
+            int64_names = object.__getattribute__(self, "int64_names")
+        except AttributeError:  # not initialized yet
+            raise AttributeError(name) from None
+        if name in names:
+            return self.values[names.index(name)]
+        if name in int64_names:
+            return self.int64_values[int64_names.index(name)]
+        return variable_or_none({}, name)
 
+    @property
+    def steps(self) -> int:
+        return (self.time_end - self.time) // self.interval
 
-@dataclass(frozen=True)
-class HourlyWeatherForecast(IntervalicWeatherForecast):
-    temperature_2m: pd.Series
-    apparent_temperature: pd.Series
-    relative_humidity_2m: pd.Series
+    def between(self, start: int, end: int):
+        """
+        Time steps from `start` (inclusive) to `end` (exclusive), unix seconds, as a forecast of the same kind.
+        Its arrays are views of this one's, nothing is copied.
+        """
+        first = min(max(0, -((self.time - start) // self.interval)), self.steps)    # ceil division
+        last = min(max(first, -((self.time - end) // self.interval)), self.steps)
+        return type(self)(
+            self.latitude, self.longitude, self.elevation, self.timezone_diff_utc0,
+            self.time + first * self.interval, self.time + last * self.interval, self.interval,
+            self.names, self.values[:, first:last], self.int64_names, self.int64_values[:, first:last],
+        )
 
-    def print_info(self):
-        hourly_data = {
-            "date": pd.date_range(
+    def to_dataframe(self) -> pd.DataFrame:
+        """One row per time step, indexed by date (UTC). Built on the first call, the same frame afterwards."""
+        if self._dataframe is None:
+            dates = pd.date_range(
                 start=pd.to_datetime(self.time, unit="s", utc=True),
-                end=pd.to_datetime(self.time_end, unit="s", utc=True),
+                periods=self.steps,
                 freq=pd.Timedelta(seconds=self.interval),
-                inclusive="left",
+                name="date",
             )
-        }
-        hourly_data["temperature_2m"] = self.temperature_2m
-        hourly_data["apparent_temperature"] = self.apparent_temperature
-        hourly_data["relative_humidity_2m"] = self.relative_humidity_2m
-        hourly_dataframe = pd.DataFrame(data=hourly_data)
+            frame = pd.DataFrame(self.values.T, index=dates, columns=list(self.names), copy=False)
+            for name, row in zip(self.int64_names, self.int64_values):
+                frame[name] = row
+            object.__setattr__(self, "_dataframe", frame)
+        return self._dataframe
 
-        print("\n--------- Hourly data ---------")
-        super().print_info()
-        print(hourly_dataframe)
+    def print_info(self):
+        print(f"\n--------- {type(self).__name__.removesuffix('WeatherForecast')} data ---------")
+        WeatherForecast.print_info(self)
+        print(self.to_dataframe())
 
 
-@dataclass(frozen=True)
-class DailyWeatherForecast(IntervalicWeatherForecast):
-    temperature_2m_max: pd.Series
-    temperature_2m_min: pd.Series
-    apparent_temperature_max: pd.Series
-    apparent_temperature_min: pd.Series
-    sunrise: pd.Series
-    sunset: pd.Series
-    daylight_duration: pd.Series
-    precipitation_hours: pd.Series
-    precipitation_sum: pd.Series
+@dataclass(frozen=True, slots=True, eq=False)
+class HourlyWeatherForecast(IntervalicWeatherForecast):
+    pass
 
-    def print_info(self):
-        daily_data = {
-            "date": pd.date_range(
-                start=pd.to_datetime(self.time, unit="s", utc=True),
-                end=pd.to_datetime(self.time_end, unit="s", utc=True),
-                freq=pd.Timedelta(seconds=self.interval),
-                inclusive="left",
-            )
-        }
-        daily_data["temperature_2m_max"] = self.temperature_2m_max
-        daily_data["temperature_2m_min"] = self.temperature_2m_min
-        daily_data["apparent_temperature_max"] = self.apparent_temperature_max
-        daily_data["apparent_temperature_min"] = self.apparent_temperature_min
-        daily_data["sunrise"] = self.sunrise
-        daily_data["sunset"] = self.sunset
-        daily_data["daylight_duration"] = self.daylight_duration
-        daily_data["precipitation_hours"] = self.precipitation_hours
-        daily_data["precipitation_sum"] = self.precipitation_sum
-        daily_dataframe = pd.DataFrame(data=daily_data)
-
-        print("\n--------- Daily data ---------")
-        super().print_info()
-        print(daily_dataframe)
+
+@dataclass(frozen=True, slots=True, eq=False)
+class DailyWeatherForecast(IntervalicWeatherForecast):
+    pass
 
 
 class WeatherForecastFactory:
     @staticmethod
-    def create_current_weather_forecast(open_meteo_response: WeatherApiResponse) -> "CurrentWeatherForecast":
-        return CurrentWeatherFactory.create(open_meteo_response)
+    def create_current_weather_forecast(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["current"]
+    ) -> "CurrentWeatherForecast":
+        return CurrentWeatherFactory.create(open_meteo_response, variables)
 
     @staticmethod
-    def create_hourly_weather_forecast(open_meteo_response: WeatherApiResponse) -> "HourlyWeatherForecast":
-        return HourlyWeatherForecastFactory.create(open_meteo_response)
+    def create_hourly_weather_forecast(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["hourly"]
+    ) -> "HourlyWeatherForecast":
+        return HourlyWeatherForecastFactory.create(open_meteo_response, variables)
 
     @staticmethod
-    def create_daily_weather_forecast(open_meteo_response: WeatherApiResponse) -> "DailyWeatherForecast":
-        return DailyWeatherForecastFactory.create(open_meteo_response)
+    def create_daily_weather_forecast(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["daily"]
+    ) -> "DailyWeatherForecast":
+        return DailyWeatherForecastFactory.create(open_meteo_response, variables)
+
 
+def response_position(open_meteo_response: WeatherApiResponse) -> dict:
+    return dict(
+        latitude=open_meteo_response.Latitude(),
+        longitude=open_meteo_response.Longitude(),
+        elevation=open_meteo_response.Elevation(),
+        timezone_diff_utc0=open_meteo_response.UtcOffsetSeconds(),
+    )
 
+
+# `variables` of the factories - names of the requested variables, found in the response by name
 class CurrentWeatherFactory:
     @staticmethod
-    def create(open_meteo_response: WeatherApiResponse) -> "CurrentWeatherForecast":
+    def create(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["current"]
+    ) -> "CurrentWeatherForecast":
         current = open_meteo_response.Current()
-        return CurrentWeatherForecast(
-            # Process current data. The order of variables needs to be the same as requested.
-            latitude=open_meteo_response.Latitude(),
-            longitude=open_meteo_response.Longitude(),
-            elevation=open_meteo_response.Elevation(),
-            timezone_diff_utc0=open_meteo_response.UtcOffsetSeconds(),
-            time=current.Time(),
-            temperature_2m=current.Variables(0).Value(),
-            relative_humidity_2m=current.Variables(1).Value(),
-            apparent_temperature=current.Variables(2).Value(),
-            is_day=current.Variables(3).Value(),
-            wind_speed_10m=current.Variables(4).Value(),
-            wind_direction_10m=current.Variables(5).Value(),
-            precipitation=current.Variables(6).Value(),
-            cloud_cover=current.Variables(7).Value(),
-            surface_pressure=current.Variables(8).Value(),
+        values = section_schema(tuple(variables)).decode(current)
+        return CurrentWeatherForecast(**response_position(open_meteo_response), time=current.Time(), values=values)
+
+class IntervalicWeatherForecastFactory:
+    @staticmethod
+    def _create(forecast_class: type, section, open_meteo_response: WeatherApiResponse, variables: Sequence[str]):
+        return forecast_class.from_columns(
+            **response_position(open_meteo_response),
+            time=section.Time(),
+            time_end=section.TimeEnd(),
+            interval=section.Interval(),
+            columns=section_schema(tuple(variables)).decode(section),
         )
 
-class HourlyWeatherForecastFactory:
+class HourlyWeatherForecastFactory(IntervalicWeatherForecastFactory):
     @staticmethod
-    def create(open_meteo_response: WeatherApiResponse) -> "HourlyWeatherForecast":
-        hourly = open_meteo_response.Hourly()
-        return HourlyWeatherForecast(
-            # Process hourly data. The order of variables needs to be the same as requested.
-            latitude=open_meteo_response.Latitude(),
-            longitude=open_meteo_response.Longitude(),
-            elevation=open_meteo_response.Elevation(),
-            timezone_diff_utc0=open_meteo_response.UtcOffsetSeconds(),
-            time=hourly.Time(),
-            time_end=hourly.TimeEnd(),
-            interval=hourly.Interval(),
-            temperature_2m=hourly.Variables(0).ValuesAsNumpy(),
-            apparent_temperature=hourly.Variables(1).ValuesAsNumpy(),
-            relative_humidity_2m=hourly.Variables(2).ValuesAsNumpy(),
+    def create(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["hourly"]
+    ) -> "HourlyWeatherForecast":
+        return IntervalicWeatherForecastFactory._create(
+            HourlyWeatherForecast, open_meteo_response.Hourly(), open_meteo_response, variables
         )
 
-class DailyWeatherForecastFactory:
+class DailyWeatherForecastFactory(IntervalicWeatherForecastFactory):
     @staticmethod
-    def create(open_meteo_response: WeatherApiResponse) -> "DailyWeatherForecast":
-        daily = open_meteo_response.Daily()
-        return DailyWeatherForecast(
-            # Process daily data. The order of variables needs to be the same as requested.
-            latitude=open_meteo_response.Latitude(),
-            longitude=open_meteo_response.Longitude(),
-            elevation=open_meteo_response.Elevation(),
-            timezone_diff_utc0=open_meteo_response.UtcOffsetSeconds(),
-            time=daily.Time(),
-            time_end=daily.TimeEnd(),
-            interval=daily.Interval(),
-            temperature_2m_max=daily.Variables(0).ValuesAsNumpy(),
-            temperature_2m_min=daily.Variables(1).ValuesAsNumpy(),
-            apparent_temperature_max=daily.Variables(2).ValuesAsNumpy(),
-            apparent_temperature_min=daily.Variables(3).ValuesAsNumpy(),
-            sunrise=daily.Variables(4).ValuesInt64AsNumpy(),
-            sunset=daily.Variables(5).ValuesInt64AsNumpy(),
-            daylight_duration=daily.Variables(6).ValuesAsNumpy(),
-            precipitation_hours=daily.Variables(7).ValuesAsNumpy(),
-            precipitation_sum=daily.Variables(8).ValuesAsNumpy(),
+    def create(
+        open_meteo_response: WeatherApiResponse, variables: Sequence[str] = DEFAULT_VARIABLES["daily"]
+    ) -> "DailyWeatherForecast":
+        return IntervalicWeatherForecastFactory._create(
+            DailyWeatherForecast, open_meteo_response.Daily(), open_meteo_response, variables
         )
 
 if __name__ == "__main__":
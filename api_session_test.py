@@ -1,5 +1,14 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pytest
-from api_session import ApiSession
+from openmeteo_requests.Client import OpenMeteoRequestsError
+
+from api_session import ApiSession, AsyncApiSession, DailyWeatherForecast
+from forecast_cache import ForecastCache
 # from helpers import *
 
 
@@ -44,4 +53,322 @@ def test_cannot_modify_forecast_fields():
         current_weather.temperature_2m = 25.0
 
     with pytest.raises(AttributeError):
-        current_weather.humidity_2m = 60.0
\ No newline at end of file
+        current_weather.humidity_2m = 60.0
+
+def test_intervalic_forecast_is_columnar():
+    day = 24 * 3600
+    forecast = DailyWeatherForecast.from_columns(52.25, 21.0, 100, 0, 0, 7 * day, day, {
+        "temperature_2m_max": np.arange(7, dtype=np.float64),
+        "sunrise": np.arange(7, dtype=np.int64) * day,
+        "temperature_2m_min": -np.arange(7, dtype=np.float32),
+    })
+    assert forecast.names == ("temperature_2m_max", "temperature_2m_min") and forecast.int64_names == ("sunrise",)
+    assert forecast.values.dtype == np.float32 and forecast.values.shape == (2, 7)
+    assert forecast.temperature_2m_min.tolist() == [0, -1, -2, -3, -4, -5, -6]
+    assert forecast.sunrise.dtype == np.int64 and forecast.sunset is None
+    assert not hasattr(forecast, "__dict__")
+
+    weekend = forecast.between(5 * day, 7 * day)
+    assert (weekend.time, weekend.time_end, weekend.steps) == (5 * day, 7 * day, 2)
+    assert weekend.temperature_2m_max.tolist() == [5, 6] and weekend.sunrise.tolist() == [5 * day, 6 * day]
+    assert np.shares_memory(weekend.values, forecast.values)
+    assert forecast.between(day + 1, 3 * day).steps == 1   # whole steps only
+    assert forecast.between(8 * day, 9 * day).steps == 0
+
+    frame = forecast.to_dataframe()
+    assert frame is forecast.to_dataframe()
+    assert list(frame.columns) == ["temperature_2m_max", "temperature_2m_min", "sunrise"] and len(frame) == 7
+    with pytest.raises(ValueError):
+        DailyWeatherForecast.from_columns(52.25, 21.0, 100, 0, 0, 7 * day, day, {"temperature_2m_max": np.arange(6)})
+
+class FakeVariable:
+    """No metadata (`Variable.undefined`): found by the position it was requested at."""
+    def __init__(self, value):
+        self.value = value
+
+    def Variable(self):
+        return 0
+
+    def Altitude(self):
+        return 0
+
+    def Aggregation(self):
+        return 0
+
+    def Depth(self):
+        return 0
+
+    def DepthTo(self):
+        return 0
+
+    def PressureLevel(self):
+        return 0
+
+    def ValuesLength(self):
+        return 0
+
+    def ValuesInt64Length(self):
+        return 0
+
+    def Value(self):
+        return self.value
+
+
+class FakeVariablesWithTime:
+    def __init__(self, values):
+        self.values = values
+
+    def Time(self):
+        return 0
+
+    def VariablesLength(self):
+        return len(self.values)
+
+    def Variables(self, i):
+        return FakeVariable(self.values[i])
+
+
+class FakeResponse:
+    def __init__(self, latitude, longitude, variables=9):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.variables = variables  # as many as requested, like Open-Meteo
+
+    def Latitude(self):
+        return self.latitude
+
+    def Longitude(self):
+        return self.longitude
+
+    def Elevation(self):
+        return 100.0
+
+    def UtcOffsetSeconds(self):
+        return 0
+
+    def Current(self):
+        return FakeVariablesWithTime([self.latitude] * self.variables)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeOpenMeteoClient:
+    """Answers multi-location requests the way Open-Meteo does: one response per coords pair."""
+    def __init__(self):
+        self.calls = []
+        self.options = []   # keyword arguments passed on to the HTTP session
+
+    def weather_api(self, url, params, **kwargs):
+        if kwargs.get("only_if_cached"):
+            raise OpenMeteoRequestsError("504: not cached")     # there is no HTTP cache here
+        self.calls.append(params)
+        self.options.append(kwargs)
+        latitudes = [float(lat) for lat in str(params["latitude"]).split(",")]
+        longitudes = [float(lon) for lon in str(params["longitude"]).split(",")]
+        variables = len(params.get("current", [])) or 9
+        return [FakeResponse(lat, lon, variables) for lat, lon in zip(latitudes, longitudes)]
+
+
+def test_get_current_weather_many_batches_requests(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+    coords = [(float(lat), float(lat) / 2) for lat in range(1, 8)]
+
+    weathers = session._make_api_call_many(coords, chunk_size=3)
+    assert len(client.calls) == 3   # 3 + 3 + 1
+    assert client.calls[0]["latitude"] == "1.0,2.0,3.0"
+    assert [(w.Latitude(), w.Longitude()) for w in weathers] == coords
+
+    weathers = session.get_current_weather_many(coords[:2])
+    assert [(w.latitude, w.longitude) for w in weathers] == coords[:2]
+    assert weathers[1].temperature_2m == 2.0
+
+def test_get_many_validates_input():
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    with pytest.raises(ValueError):
+        session.get_current_weather_many([(52.2297, None)])
+    with pytest.raises(ValueError):
+        session._make_api_call_many([(52.2297, 21.0122)], chunk_size=0)
+
+def test_selection_validation():
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    assert session._selection({"hourly": ["temperature_2m", "temperature_2m"], "current": None}) == (
+        ("current", tuple(session.params["current"])),
+        ("hourly", ("temperature_2m",)),
+    )
+    with pytest.raises(ValueError):
+        session._selection({"weekly": None})
+    with pytest.raises(ValueError):
+        session.get_hourly_forecast(variables=[])
+
+def test_forecast_cache_serves_repeated_locations(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+
+    warsaw = session.get_current_weather(52.2297, 21.0122)
+    session.get_current_weather(41.8919, 12.5113)  # Rome
+    assert session.get_current_weather(52.2297, 21.0122) is warsaw  # parsed only once
+    assert len(client.calls) == 2
+    assert session.cache_stats["hits"] == 1
+
+    # batch calls go over the network only for the missing locations
+    session.get_current_weather_many([(52.2297, 21.0122), (48.8566, 2.3522)])
+    assert len(client.calls) == 3
+    assert client.calls[-1]["latitude"] == "48.85"  # grid cell of Paris
+
+def test_nearby_coords_share_grid_cell(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+
+    warszawa = session.get_current_weather(52.2297, 21.0122)
+    warsaw_poland = session.get_current_weather(52.2319581, 21.0067249)
+    assert warszawa is warsaw_poland
+    assert len(client.calls) == 1
+    assert (client.calls[0]["latitude"], client.calls[0]["longitude"]) == (52.25, 21.0)
+
+    session.get_current_weather_many([(52.2319581, 21.0067249), (52.4064, 16.9252)])  # Warsaw, Poznań
+    assert client.calls[-1]["latitude"] == "52.4"
+
+
+def test_stale_forecast_is_served_and_revalidated(monkeypatch):
+    clock = FakeClock()
+    session = ApiSession(52.2297, 21.0122, forecast_cache=ForecastCache(ttl=3600, max_stale=3600, clock=clock))
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+    assert session.get_stale_forecast("current", 41.8919, 12.5113) is None   # nothing known yet, no network
+    assert client.calls == []
+
+    warsaw = session.get_current_weather(52.2297, 21.0122)
+    clock.now = 5000
+    assert session.get_stale_forecast("current", 52.2297, 21.0122) == (warsaw, 5000)
+
+    fresh = session.revalidate_forecast("current", 52.2297, 21.0122)
+    assert fresh is not warsaw
+    assert client.options[-1]["force_refresh"] is True     # HTTP cache is bypassed too
+    assert session.get_current_weather(52.2297, 21.0122) is fresh
+    assert len(client.calls) == 2
+
+def test_default_cache_keeps_expired_forecasts(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # no cache passed, as in scripts and benchmarks
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+    warsaw = session.get_current_weather(52.2297, 21.0122)
+    key = ((52.25, 21.0), "current")
+    session._forecast_cache.put(key, session._forecast_cache.get(key), age=5000)    # expired an hour ago
+    forecast, age = session.get_stale_forecast("current", 52.2297, 21.0122)
+    assert forecast is warsaw and age == pytest.approx(5000, abs=1)
+    assert len(client.calls) == 1   # from memory
+
+
+class SlowOpenMeteoClient(FakeOpenMeteoClient):
+    """Lets other threads run in the middle of a request, like a real round trip."""
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def weather_api(self, url, params, **kwargs):
+        time.sleep(0.001)
+        with self.lock:
+            return super().weather_api(url, params, **kwargs)
+
+
+def test_session_is_thread_safe(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    client = SlowOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+    cities = [(float(latitude), float(longitude)) for latitude in range(-55, 60, 10) for longitude in (-90, 30, 90)]
+
+    def fetch(coords: tuple[float, float]):
+        weather = session.get_current_weather(*coords)
+        return weather.latitude, weather.longitude
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(3):  # a cold cache, then a warm one
+            assert list(executor.map(fetch, cities)) == cities    # every thread got its own city
+
+    assert len(client.calls) == len(cities)
+    assert "latitude" not in session.params     # requests never write to the shared params
+    assert session.cache_stats["hits"] == 2 * len(cities)
+
+
+class BlockingOpenMeteoClient(FakeOpenMeteoClient):
+    """Answers only once released."""
+    def __init__(self):
+        super().__init__()
+        self.started, self.release = threading.Event(), threading.Event()
+
+    def weather_api(self, url, params, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return super().weather_api(url, params, **kwargs)
+
+
+def test_concurrent_misses_share_one_request(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    client = BlockingOpenMeteoClient()
+    monkeypatch.setattr(session, "_ApiSession__openmeteo", client)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(session.get_current_weather, 52.2297, 21.0122)
+        client.started.wait(5)
+        # the alert checker and the plot screen, with nearby coords of the same grid cell
+        followers = [executor.submit(session.get_current_weather, 52.2319581, 21.0067249) for _ in range(3)]
+        while session.cache_stats["coalesced"] < 3:
+            time.sleep(0.001)
+        client.release.set()
+        weathers = [future.result(5) for future in (leader, *followers)]
+
+    assert all(weather is weathers[0] for weather in weathers)     # parsed once, shared
+    assert len(client.calls) == 1
+    assert session.cache_stats["fetches"] == 1 and session.cache_stats["coalesced"] == 3
+    assert session.get_current_weather(52.2297, 21.0122) is weathers[0]
+    assert session.cache_stats["hits"] == 1
+
+
+class FakeAsyncOpenMeteoClient(FakeOpenMeteoClient):
+    async def weather_api(self, url, params):
+        await asyncio.sleep(0)
+        return super().weather_api(url, params)
+
+
+def test_async_session_shares_forecast_cache(monkeypatch):
+    session = ApiSession(52.2297, 21.0122)  # Warszawa
+    async_session = AsyncApiSession(52.2297, 21.0122, forecast_cache=session._forecast_cache)
+    client = FakeAsyncOpenMeteoClient()
+    monkeypatch.setattr(async_session, "_AsyncApiSession__openmeteo", client)
+
+    async def fetch():
+        return await asyncio.gather(
+            async_session.get_current_weather(41.8919, 12.5113),  # Rome
+            async_session.get_current_weather_many([(48.8566, 2.3522), (52.2297, 21.0122)]),  # Paris, Warszawa
+        )
+
+    rome, (paris, warszawa) = asyncio.run(fetch())
+    assert rome.latitude == pytest.approx(41.8919, abs=0.05)
+    assert paris.longitude == pytest.approx(2.3522, abs=0.05)
+    # the blocking session is served from the cache filled by the async one
+    assert session.get_current_weather(52.2297, 21.0122) is warszawa
+
+def test_prefetch_requests_only_selected_sections(monkeypatch):
+    session = AsyncApiSession(52.2297, 21.0122)
+    client = FakeAsyncOpenMeteoClient()
+    monkeypatch.setattr(session, "_AsyncApiSession__openmeteo", client)
+
+    async def prefetch_then_check_alerts():
+        await session.prefetch_many([(41.8919, 12.5113), (48.8566, 2.3522)], {"current": ["temperature_2m"]})
+        return await session.get_current_weather(48.8566, 2.3522, variables=["temperature_2m"])
+
+    paris = asyncio.run(prefetch_then_check_alerts())
+    assert paris.temperature_2m == pytest.approx(48.85) and paris.relative_humidity_2m is None
+    assert len(client.calls) == 1
+    assert client.calls[0]["current"] == ["temperature_2m"]
+    assert "hourly" not in client.calls[0] and "daily" not in client.calls[0]
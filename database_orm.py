@@ -1,4 +1,7 @@
-from peewee import SqliteDatabase, Model, CharField, FloatField 
+import threading
+
+from peewee import SqliteDatabase, Model, CharField, FloatField
+from playhouse.migrate import SqliteMigrator, migrate
 
 DATABASE_FILENAME = 'user_settings.db'
 db = SqliteDatabase(DATABASE_FILENAME)
@@ -14,6 +17,10 @@ class Alert(BaseModel):  # A database table
     city_name = CharField()  # or Location object?      # column on the table
     min_temp = FloatField(default=-273.15)
     max_temp = FloatField(default=1000.0)
+    # Resolved once and stored, so checking alerts and favourites doesn't need geocoding
+    latitude = FloatField(null=True)
+    longitude = FloatField(null=True)
+    display_name = CharField(null=True)
     # min_wind_speed = FloatField(default=0.0)
     # max_wind_speed = FloatField(default=100.0)
     # min_precipitation = FloatField(default=0.0)
@@ -24,17 +31,61 @@ class Alert(BaseModel):  # A database table
     # max_pressure = FloatField(default=2000.0)
     # ...
 
+class GeocodeEntry(BaseModel):  # Geocoding results shared by all the Geocoder objects, survives restarts
+    query = CharField(null=True, index=True)  # normalized city name, NULL for reverse geocoding results
+    cell_lat = FloatField()     # quantized coords, see geocode_cache.py
+    cell_lon = FloatField()
+    latitude = FloatField()
+    longitude = FloatField()
+    display_name = CharField()
+    created_at = FloatField(index=True)  # unix time, used for TTL and eviction
+
+    class Meta:
+        indexes = ((("cell_lat", "cell_lon"), False),)
+
+
+# Columns added after the first release: name -> field. Must be nullable, old rows have no values.
+ALERT_MIGRATIONS = {
+    "latitude": FloatField(null=True),
+    "longitude": FloatField(null=True),
+    "display_name": CharField(null=True),
+}
+
+
+def migrate_db(database: SqliteDatabase = db):
+    """Add missing columns to databases created by older versions of the app."""
+    existing_columns = {column.name for column in database.get_columns(Alert._meta.table_name)}
+    migrator = SqliteMigrator(database)
+    operations = [
+        migrator.add_column(Alert._meta.table_name, column_name, field)
+        for column_name, field in ALERT_MIGRATIONS.items()
+        if column_name not in existing_columns
+    ]
+    if operations:
+        migrate(*operations)
+
 # In order to start using the models, its necessary to create the tables.
-# This is a one-time operation and can be done quickly using the interactive interpreter
-def initialize_db(db_filename):
-    def create_tables():
-        with db:
-            db.create_tables([Alert])
-
-    try:
-        with open(db_filename) as file:
-            if not file: create_tables()
-    except FileNotFoundError:
-        create_tables()
-
-initialize_db(DATABASE_FILENAME)
+# Existing databases are migrated to the current schema.
+# Done once per process by the entry points (not at import, it would delay the start of the app),
+# the connection is kept open and shared by everything that uses the models.
+_initialized = False
+_initialize_lock = threading.Lock()    # the geocoder may be the first to use it, from a worker thread
+
+def initialize_db(db_filename: str = DATABASE_FILENAME) -> SqliteDatabase:
+    global _initialized
+    with _initialize_lock:
+        if _initialized and db.database == db_filename:
+            return db
+        if db.database != db_filename:
+            db.close()
+            db.init(db_filename)
+        db.connect(reuse_if_open=True)
+        with db.bind_ctx([Alert, GeocodeEntry]):   # even if a test has bound the models elsewhere for a while
+            db.create_tables([Alert, GeocodeEntry], safe=True)
+            migrate_db(db)
+        _initialized = True
+    return db
+
+def ensure_db() -> SqliteDatabase:
+    """For code used outside the app too (scripts, benchmarks): the database initialized already, the default one if none."""
+    return db if _initialized else initialize_db()
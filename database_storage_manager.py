@@ -1,13 +1,19 @@
 from peewee import *
 
-from database_orm import DATABASE_FILENAME, Alert
+from database_orm import DATABASE_FILENAME, Alert, initialize_db
+from geocoder import Location, ResolvedLocation
 
 
-class DatabaseStorageManager:
-    db = SqliteDatabase(DATABASE_FILENAME)
+def alert_to_location(alert: Alert) -> Location:
+    """Use stored coords when the row has them, otherwise the city name has to be geocoded (once)."""
+    if alert.latitude is not None and alert.longitude is not None:
+        return ResolvedLocation(alert.latitude, alert.longitude, alert.display_name or alert.city_name)
+    return Location(city_prompt=alert.city_name)
+
 
+class DatabaseStorageManager:
     def __init__(self, db_filename=DATABASE_FILENAME):
-        self.db.connect()
+        self.db = initialize_db(db_filename)     # the one connection the models use, closed when the app exits
 
     # def __init__(self, db: SqliteDatabase):
     #     self.db.connect()
@@ -17,15 +23,32 @@ class DatabaseStorageManager:
     #
     # dbm = DatabaseStorageManager(sqlitedatabase)
 
-    def save_city_to_favourties(self, city_name: str) -> bool:
+    def save_city_to_favourties(self, city_name: str, latitude: float = None, longitude: float = None) -> bool:
         if city_name in self.get_favourites():
             return
-        return Alert(city_name=city_name).save()
-
-    def create_temperature_alert(self, city_name: str, min_temp: float, max_temp: float = None) -> bool:
-        alert = Alert(city_name=city_name, min_temp=min_temp, max_temp=max_temp)
+        display_name = city_name if latitude is not None and longitude is not None else None
+        return Alert(city_name=city_name, latitude=latitude, longitude=longitude, display_name=display_name).save()
+
+    def create_temperature_alert(
+        self, city_name: str, min_temp: float, max_temp: float = None, latitude: float = None, longitude: float = None
+    ) -> bool:
+        display_name = city_name if latitude is not None and longitude is not None else None
+        alert = Alert(
+            city_name=city_name,
+            min_temp=min_temp,
+            max_temp=max_temp,
+            latitude=latitude,
+            longitude=longitude,
+            display_name=display_name,
+        )
         return alert.save()
 
+    def save_location(self, city_name: str, latitude: float, longitude: float, display_name: str = None) -> int:
+        """Store coords resolved for `city_name`, so it is never geocoded again."""
+        return Alert.update(
+            latitude=latitude, longitude=longitude, display_name=display_name or city_name
+        ).where(Alert.city_name == city_name).execute()
+
     def get_alert(self, city_name: str) -> tuple[float, float] | None:
         alert = Alert.get_or_none(Alert.city_name == city_name)
         if not alert: return None
@@ -37,14 +60,13 @@ class DatabaseStorageManager:
     def get_favourites(self) -> list[str]:
         return list(map(lambda favourite: favourite.city_name, Alert.select(Alert.city_name)))
 
+    def get_favourite_locations(self) -> list[Location]:
+        return list(map(alert_to_location, Alert.select()))
+
     def erase(self):
         for query in Alert.select():
             query.delete_instance()
 
-    def __del__(self):
-        # Have to close the connection and this is one way of doing it (through __del__)
-        self.db.close()
-
 
 # TODO: Consider the following design:
 # Favourite("Warszawa").save()
@@ -1,5 +1,7 @@
 from peewee import SqliteDatabase, Model
+from database_orm import Alert, migrate_db
 from database_storage_manager import DatabaseStorageManager
+from geocoder import ResolvedLocation
 
 MOCK_DATABASE_FILENAME = "user_settings_test.db"
 
@@ -29,7 +31,46 @@ def test_save_alert():
 #     dbh.create_temperature_alert("Warszawa", -10, 20)
 #     assert dbh.get_alert("Warszawa") == (-10, 20)
 
+def test_manager_leaves_the_shared_connection_open():
+    first, second = DatabaseStorageManager(), DatabaseStorageManager()
+    del first   # garbage collected
+    assert not second.db.is_closed()
+    second.get_favourites()
+
 def test_select_from_empty_db():
     dbh = DatabaseStorageManager()
     dbh.erase()   # need to make the db empty first
     assert dbh.get_favourites() == []
+
+def test_migration_adds_coords_to_old_database(tmp_path):
+    old_db = SqliteDatabase(str(tmp_path / "user_settings_old.db"))
+    old_db.execute_sql(
+        'CREATE TABLE "alert" ("id" INTEGER NOT NULL PRIMARY KEY, "city_name" VARCHAR(255) NOT NULL, '
+        '"min_temp" REAL NOT NULL, "max_temp" REAL NOT NULL)'
+    )
+    old_db.execute_sql("INSERT INTO alert (city_name, min_temp, max_temp) VALUES ('Warszawa', -8, 30)")
+    migrate_db(old_db)
+    migrate_db(old_db)  # running it twice is harmless
+
+    columns = {column.name for column in old_db.get_columns("alert")}
+    assert {"latitude", "longitude", "display_name"} <= columns
+    with old_db.bind_ctx([Alert]):
+        alert = Alert.get()
+        assert (alert.city_name, alert.latitude, alert.longitude) == ("Warszawa", None, None)
+
+def test_favourites_keep_coords():
+    test_db = SqliteDatabase(":memory:")
+    with test_db.bind_ctx([Alert]):
+        test_db.create_tables([Alert])
+        dbh = DatabaseStorageManager()
+        dbh.save_city_to_favourties("Warsaw, Poland", 52.2297, 21.0122)
+        dbh.save_city_to_favourties("Zakopane")
+        warsaw, zakopane = dbh.get_favourite_locations()
+        assert isinstance(warsaw, ResolvedLocation)
+        assert warsaw.coords == (52.2297, 21.0122)
+        assert not isinstance(zakopane, ResolvedLocation)
+
+        dbh.save_location("Zakopane", 49.2992, 19.9496)
+        zakopane = dbh.get_favourite_locations()[1]
+        assert zakopane.coords == (49.2992, 19.9496)
+        assert zakopane.city_name == "Zakopane"
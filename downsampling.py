@@ -0,0 +1,73 @@
+import math
+
+import numpy as np
+
+# Braille marker puts 2 points in every column of the terminal
+POINTS_PER_COLUMN = 2
+
+
+def lttb(series: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of at most `max_points` samples that keep the shape of the series.
+    First and last samples are always kept, from every bucket in between the sample making the largest
+    triangle with the previously kept one and the average of the next bucket is chosen.
+    """
+    y = np.asarray(series, dtype=np.float64)
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)    # max_points - 2 buckets
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        next_lo, next_hi = hi, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_y = y[next_lo:next_hi]
+        finite = next_y[np.isfinite(next_y)]
+        average_x = (next_lo + next_hi - 1) / 2
+        average_y = finite.mean() if len(finite) else y[previous]
+
+        x = np.arange(lo, hi)
+        areas = np.abs((previous - average_x) * (y[lo:hi] - y[previous]) - (previous - x) * (average_y - y[previous]))
+        previous = selected[bucket + 1] = lo + np.argmax(np.nan_to_num(areas, nan=-1.0))
+    return selected
+
+
+def min_max(series: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the minimum and the maximum of every bucket (in order of time),
+    so no peak is lost. At most `max_points` of them.
+    """
+    y = np.asarray(series, dtype=np.float64)
+    n = len(y)
+    buckets = max_points // 2
+    if max_points >= n or buckets < 1 or np.isnan(y).all():
+        return np.arange(n)
+
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    selected = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        values = y[lo:hi]
+        if np.isnan(values).all():
+            continue
+        selected.extend(sorted({lo + np.nanargmin(values), lo + np.nanargmax(values)}))
+    return np.asarray(selected, dtype=np.int64)
+
+
+DOWNSAMPLING_METHODS = {"lttb": lttb, "min_max": min_max}
+
+
+def thin_ticks(labels: list[str], width: int) -> list[int]:
+    """
+    Positions of the labels that fit side by side in `width` columns (with a gap between them),
+    evenly spaced, starting with the first one.
+    Example: 168 hourly labels `12:00 19/12` in 100 columns -> every 21st one
+    """
+    if not labels:
+        return []
+    label_width = max(map(len, labels)) + 2
+    max_ticks = max(1, width // label_width)
+    step = math.ceil(len(labels) / max_ticks)
+    return list(range(0, len(labels), step))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from downsampling import lttb, min_max, thin_ticks
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.normal(size=2000))
+
+
+def test_short_series_are_kept(series):
+    assert lttb(series[:50], 100).tolist() == list(range(50))
+    assert min_max(series[:50], 100).tolist() == list(range(50))
+
+def test_lttb_keeps_the_ends_and_the_count(series):
+    indices = lttb(series, 200)
+    assert len(indices) == 200
+    assert indices[0] == 0 and indices[-1] == len(series) - 1
+    assert np.all(np.diff(indices) > 0)
+
+def test_lttb_keeps_a_spike():
+    series = np.zeros(1000)
+    series[537] = 10
+    assert 537 in lttb(series, 50)
+
+def test_lttb_survives_missing_values(series):
+    series[100:400] = np.nan
+    indices = lttb(series, 100)
+    assert len(indices) == 100 and np.all(np.diff(indices) > 0)
+
+def test_min_max_keeps_the_extremes(series):
+    indices = min_max(series, 100)
+    assert len(indices) <= 100
+    assert np.all(np.diff(indices) > 0)
+    assert series.argmin() in indices and series.argmax() in indices
+
+def test_thin_ticks():
+    labels = ["12:00 19/12"] * 168
+    ticks = thin_ticks(labels, 100)
+    assert ticks[0] == 0
+    assert len(ticks) * (len(labels[0]) + 2) <= 100
+    assert thin_ticks(labels[:3], 100) == [0, 1, 2]
+    assert thin_ticks([], 100) == []
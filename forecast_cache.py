@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Open-Meteo refreshes its forecast models roughly every hour,
+# there is no point in keeping a parsed forecast for longer than that.
+FORECAST_TTL_SECONDS = 3600
+FORECAST_CACHE_MAX_ENTRIES = 128
+# An outdated forecast is still worth showing for a moment, while the fresh one is on its way
+STALE_FORECAST_MAX_AGE_SECONDS = 24 * 3600
+
+# Open-Meteo snaps requested coords to the nearest model grid point anyway.
+# 0.05° is ~5 km, close to the resolution of the regional models used by the "best_match" model.
+GRID_RESOLUTION = 0.05
+
+
+def to_grid_cell(latitude: float, longitude: float, resolution: float = GRID_RESOLUTION) -> tuple[float, float]:
+    """
+    Map coords to the canonical coords of the grid cell they fall into,
+    so nearby coords (e.g. "Warszawa" and "Warsaw, Poland") share one cache key.
+    Example: `52.2297, 21.0122` -> `52.25, 21.0`
+    """
+    if resolution <= 0:
+        raise ValueError("Grid resolution must be a positive number of degrees.")
+    cell_lat = min(max(round(latitude / resolution) * resolution, -90.0), 90.0)
+    cell_lon = round(longitude / resolution) * resolution
+    # get rid of float noise like 52.300000000000004, it would make different keys and urls
+    return round(cell_lat, 6), round(cell_lon, 6)
+
+
+class ForecastCache:
+    """
+    In-process cache for parsed forecasts, keyed by location.
+    Size is bounded (least recently used entry is evicted first) and every entry expires after `ttl` seconds.
+    Expired entries are kept for `max_stale` more seconds: `get()` misses them, but `get_stale()` returns them.
+    Safe to share between threads.
+    """
+    def __init__(
+        self,
+        max_entries: int = FORECAST_CACHE_MAX_ENTRIES,
+        ttl: float = FORECAST_TTL_SECONDS,
+        max_stale: float = 0,
+        clock=time.monotonic,
+    ):
+        if max_entries < 1:
+            raise ValueError("Cache must be able to hold at least one entry.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.__clock = clock
+        self.__entries: OrderedDict = OrderedDict()  # key -> (stored_at, value)
+        self.__lock = threading.Lock()  # reads reorder the entries too
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.__lock:
+            item = self.__get_item(key)
+            if item is None or item[0] >= self.ttl:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return item[1]
+
+    def get_stale(self, key) -> tuple[object, float] | None:
+        """`(value, age in seconds)`, even if the value has expired already. None if there is nothing to show."""
+        with self.__lock:
+            item = self.__get_item(key)
+        return (item[1], item[0]) if item is not None else None
+
+    def __get_item(self, key) -> tuple[float, object] | None:
+        """`(age, value)` of a fresh or stale entry. The lock must be held."""
+        item = self.__entries.get(key)
+        if item is None:
+            return None
+
+        stored_at, value = item
+        age = self.__clock() - stored_at
+        if age >= self.ttl + self.max_stale:
+            del self.__entries[key]
+            return None
+
+        self.__entries.move_to_end(key)
+        return age, value
+
+    def put(self, key, value, age: float = 0.0) -> None:
+        """`age` - how old the value was already when it was stored (e.g. read from a disk cache)."""
+        with self.__lock:
+            self.__entries[key] = (self.__clock() - age, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.__entries),
+            }
+
+    def __contains__(self, key) -> bool:
+        with self.__lock:
+            item = self.__entries.get(key)
+        return item is not None and self.__clock() - item[0] < self.ttl
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -0,0 +1,65 @@
+import pytest
+
+from forecast_cache import ForecastCache, to_grid_cell
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hit_and_miss():
+    cache = ForecastCache()
+    assert cache.get((52.2297, 21.0122)) is None
+    cache.put((52.2297, 21.0122), "Warszawa")
+    assert cache.get((52.2297, 21.0122)) == "Warszawa"
+    assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ForecastCache(max_entries=2)
+    cache.put("Warszawa", 1)
+    cache.put("Rome", 2)
+    cache.get("Warszawa")   # Rome is now the least recently used
+    cache.put("Paris", 3)
+    assert "Rome" not in cache
+    assert "Warszawa" in cache and "Paris" in cache
+    assert cache.evictions == 1
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ForecastCache(ttl=3600, clock=clock)
+    cache.put("Warszawa", 1)
+    clock.now = 3599
+    assert cache.get("Warszawa") == 1
+    clock.now = 3600
+    assert cache.get("Warszawa") is None
+    assert len(cache) == 0
+
+def test_expired_entries_are_kept_as_stale():
+    clock = FakeClock()
+    cache = ForecastCache(ttl=3600, max_stale=600, clock=clock)
+    cache.put("Warszawa", 1)
+    cache.put("Rome", 2, age=3500)  # e.g. read from a disk cache
+    clock.now = 200
+    assert cache.get("Rome") is None
+    assert cache.get_stale("Rome") == (2, 3700)
+    assert cache.get_stale("Warszawa") == (1, 200)
+    clock.now = 4200
+    assert cache.get_stale("Warszawa") is None  # too old even to be shown
+    assert len(cache) == 1
+    assert cache.get_stale("Paris") is None
+
+def test_cache_must_hold_something():
+    with pytest.raises(ValueError):
+        ForecastCache(max_entries=0)
+
+def test_to_grid_cell():
+    assert to_grid_cell(52.2297, 21.0122) == (52.25, 21.0)
+    assert to_grid_cell(52.2319581, 21.0067249) == to_grid_cell(52.2297, 21.0122)
+    assert to_grid_cell(-33.9249, 18.4241, resolution=0.1) == (-33.9, 18.4)
+    assert to_grid_cell(89.99, 0.0, resolution=1.0) == (90.0, 0.0)
+    with pytest.raises(ValueError):
+        to_grid_cell(52.2297, 21.0122, resolution=0)
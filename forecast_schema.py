@@ -0,0 +1,113 @@
+# Decoding of Open-Meteo's flatbuffers responses by variable name, not by position:
+# `temperature_2m_max` is the variable with `Variable.temperature`, altitude 2 and `Aggregation.maximum`.
+import re
+from functools import lru_cache
+from typing import NamedTuple, Sequence
+
+import numpy as np
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Variable import Variable
+
+# name suffix -> member, e.g. `_max`, `_dominant`, `_p90`: every aggregation, most of them named as in the API
+AGGREGATIONS = {
+    "max": Aggregation.maximum,
+    "min": Aggregation.minimum,
+    **{name: value for name, value in vars(Aggregation).items() if not name.startswith("_") and name != "none"},
+}
+# `_2m` (altitude), `_0cm` or `_0_to_7cm` (depth) and `_850hPa` (pressure level)
+LEVEL_SUFFIX = re.compile(r"(.+?)_(?:(\d+)m|(\d+)(?:_to_(\d+))?cm|(\d+)hPa)")
+SCHEMA_CACHE_MAX_ENTRIES = 64   # variable lists a process requests, a handful in practice
+
+
+class VariableKey(NamedTuple):
+    """What identifies a variable in the flatbuffers schema."""
+    variable: int
+    altitude: int = 0
+    aggregation: int = Aggregation.none
+    depth: int = 0
+    depth_to: int = 0
+    pressure_level: int = 0
+
+
+def parse_variable(name: str) -> VariableKey:
+    """
+    Open-Meteo variable name to its key in the flatbuffers schema.
+    Examples: `temperature_2m_max` -> `VariableKey(Variable.temperature, 2, Aggregation.maximum)`,
+    `soil_moisture_0_to_7cm` -> `VariableKey(Variable.soil_moisture, depth=0, depth_to=7)`
+    """
+    if name.startswith("_"):    # attributes of the `Variable` class, not variables
+        raise ValueError(f"Cannot initialize WeatherVariable from invalid String value {name}")
+    base, aggregation = name, Aggregation.none
+    if not hasattr(Variable, base) and base.rpartition("_")[2] in AGGREGATIONS:
+        base, _, suffix = base.rpartition("_")
+        aggregation = AGGREGATIONS[suffix]
+    altitude = depth = depth_to = pressure_level = 0
+    if not hasattr(Variable, base) and (match := LEVEL_SUFFIX.fullmatch(base)):
+        base, altitude, depth, depth_to, pressure_level = (
+            match[1], *(int(level) if level else 0 for level in match.groups()[1:])
+        )
+    if not hasattr(Variable, base):
+        raise ValueError(f"Cannot initialize WeatherVariable from invalid String value {name}")
+    return VariableKey(getattr(Variable, base), altitude, aggregation, depth, depth_to, pressure_level)
+
+
+def is_variable_name(name: str) -> bool:
+    try:
+        parse_variable(name)
+    except ValueError:
+        return False
+    return True
+
+
+class SectionSchema:
+    """
+    How to find the requested variables in a section ("current", "hourly" or "daily") of a response.
+    Built once per list of names (`section_schema()`), then every response is decoded in a single pass.
+    Names this module can't parse (variables newer than it) are found by their position.
+    """
+    __slots__ = ("names", "__by_key", "__unparsed")
+
+    def __init__(self, names: Sequence[str]):
+        self.names = tuple(names)
+        self.__by_key = {}
+        self.__unparsed = set()
+        for name in self.names:
+            try:
+                self.__by_key[parse_variable(name)] = name
+            except ValueError:
+                self.__unparsed.add(name)
+
+    def decode(self, section) -> dict[str, np.ndarray | float]:
+        """
+        Variable name -> values: arrays of the hourly and daily sections are views of the response buffer
+        (no copies), int64 ones (e.g. `sunrise`) stay int64. The current section has a single value per variable.
+        """
+        columns = {}
+        count = section.VariablesLength()
+        # Unexpected metadata: Open-Meteo answers in the requested order, but the position means something
+        # only if exactly these variables were requested. Responses shared by calls often have more.
+        by_position = count == len(self.names)
+        for i in range(count):
+            variable = section.Variables(i)
+            key = (
+                variable.Variable(), variable.Altitude(), variable.Aggregation(),
+                variable.Depth(), variable.DepthTo(), variable.PressureLevel(),
+            )
+            name = self.__by_key.get(key)
+            # a variable without metadata, or one this module can't name, is the one requested at its position
+            if name is None and by_position and (key[0] == Variable.undefined or self.names[i] in self.__unparsed):
+                name = self.names[i]
+            if name is None or name in columns:     # not requested
+                continue
+            if variable.ValuesInt64Length():
+                columns[name] = variable.ValuesInt64AsNumpy()
+            elif variable.ValuesLength():
+                columns[name] = variable.ValuesAsNumpy()
+            else:
+                columns[name] = variable.Value()
+        return columns
+
+
+@lru_cache(maxsize=SCHEMA_CACHE_MAX_ENTRIES)
+def section_schema(names: tuple[str, ...]) -> SectionSchema:
+    return SectionSchema(names)
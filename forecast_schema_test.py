@@ -0,0 +1,69 @@
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from forecast_schema import VariableKey, is_variable_name, parse_variable, section_schema
+from stub_server import encode_forecast
+
+
+def decode_response(message: bytes) -> WeatherApiResponse:
+    return WeatherApiResponse.GetRootAs(message, 4)    # after the size prefix
+
+def test_parse_variable():
+    assert parse_variable("apparent_temperature_min") == VariableKey(Variable.apparent_temperature, 0, Aggregation.minimum)
+    assert parse_variable("relative_humidity_2m") == VariableKey(Variable.relative_humidity, 2, Aggregation.none)
+    assert parse_variable("wind_direction_10m_dominant") == VariableKey(Variable.wind_direction, 10, Aggregation.dominant)
+    assert parse_variable("temperature_2m_p90").aggregation == Aggregation.p90
+    assert parse_variable("soil_temperature_0cm") == VariableKey(Variable.soil_temperature, depth=0)
+    assert parse_variable("soil_moisture_0_to_7cm") == VariableKey(Variable.soil_moisture, depth=0, depth_to=7)
+    assert parse_variable("temperature_850hPa") == VariableKey(Variable.temperature, pressure_level=850)
+    assert is_variable_name("sunset") and not is_variable_name("print_info") and not is_variable_name("__dict__")
+
+def test_variables_are_found_by_name():
+    response = decode_response(encode_forecast(
+        52.25, 21.0,
+        current=["relative_humidity_2m", "temperature_2m"],
+        hourly=["apparent_temperature", "temperature_2m"],
+        daily=["sunrise", "temperature_2m_max", "temperature_2m_min"],
+        now=1_766_000_000,
+    ))
+    hourly = section_schema(("temperature_2m", "apparent_temperature")).decode(response.Hourly())
+    assert list(hourly) == ["apparent_temperature", "temperature_2m"]   # as in the response, not as requested
+    assert hourly["temperature_2m"].tolist() == response.Hourly().Variables(1).ValuesAsNumpy().tolist()
+    assert not hourly["temperature_2m"].flags.owndata  # a view of the response buffer
+
+    daily = section_schema(("temperature_2m_min", "sunrise")).decode(response.Daily())
+    assert set(daily) == {"temperature_2m_min", "sunrise"}    # not requested, not decoded
+    assert daily["sunrise"].dtype == "int64"
+    assert daily["temperature_2m_min"].tolist() == response.Daily().Variables(2).ValuesAsNumpy().tolist()
+
+    current = section_schema(("temperature_2m", "relative_humidity_2m")).decode(response.Current())
+    assert 0 <= current["relative_humidity_2m"] <= 100 and isinstance(current["temperature_2m"], float)
+
+def test_response_with_more_variables_than_requested():
+    # a cached response shared by calls asking for fewer variables
+    response = decode_response(encode_forecast(
+        52.25, 21.0, daily=["temperature_2m_max", "temperature_2m_min", "sunrise"], now=1_766_000_000
+    ))
+    daily = section_schema(("temperature_2m_min", "sunrise")).decode(response.Daily())
+    assert list(daily) == ["temperature_2m_min", "sunrise"]
+    assert daily["temperature_2m_min"].tolist() == response.Daily().Variables(1).ValuesAsNumpy().tolist()
+    assert daily["sunrise"].tolist() == response.Daily().Variables(2).ValuesInt64AsNumpy().tolist()
+
+def test_levels_tell_variables_apart():
+    names = ["soil_temperature_0cm", "soil_moisture_0_to_7cm", "temperature_850hPa", "temperature_2m"]
+    response = decode_response(encode_forecast(52.25, 21.0, hourly=names, now=1_766_000_000))
+    hourly = section_schema(tuple(reversed(names))).decode(response.Hourly())
+    for i, name in enumerate(names):
+        assert hourly[name].tolist() == response.Hourly().Variables(i).ValuesAsNumpy().tolist()
+
+def test_unknown_names_are_found_by_position():
+    response = decode_response(encode_forecast(
+        52.25, 21.0, daily=["temperature_2m_max", "sunrise"], now=1_766_000_000
+    ))
+    daily = section_schema(("temperature_2m_max", "sunrise_in_the_future")).decode(response.Daily())
+    assert daily["sunrise_in_the_future"].tolist() == response.Daily().Variables(1).ValuesInt64AsNumpy().tolist()
+    assert set(daily) == {"temperature_2m_max", "sunrise_in_the_future"}
+
+def test_schema_is_built_once_per_variable_list():
+    assert section_schema(("temperature_2m",)) is section_schema(("temperature_2m",))
@@ -0,0 +1,297 @@
+# Offline geocoding over a bundled list of cities (GeoNames "cities15000" dump, CC BY 4.0, https://www.geonames.org)
+import bisect
+import csv
+import gzip
+import heapq
+import math
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+GAZETTEER_PATH = Path(__file__).parent / "data" / "cities15000.tsv.gz"
+EARTH_RADIUS_KM = 6371.0
+# Points outside of every city's footprint and farther than that are left for Nominatim (villages, sea, deserts)
+MAX_DISTANCE_KM = 5.0
+# Cities are points, big ones cover a lot more ground. Radius is estimated from the population and this density.
+PEOPLE_PER_KM2 = 3000
+SUGGESTIONS_LIMIT = 5
+REVERSE_CANDIDATES = 24   # enough to get past the districts of a big city to the city itself
+PRIMARY_NAME_BONUS = 1 << 40    # above any population: a city's own name outranks other cities' alternate names
+
+
+def to_unit_vector(latitude: float, longitude: float) -> tuple[float, float, float]:
+    """
+    Points on a unit sphere: euclidean distance between them grows with the great-circle one,
+    and there is no wrapping at the antimeridian.
+    """
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def normalize_name(name: str) -> str:
+    """
+    Example: `  Kraków,  Polska ` -> `krakow, polska`
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def is_code(name: str) -> bool:
+    """Airport, IATA and similar codes among the alternate names: `WAW`, `KRK`."""
+    return 3 <= len(name) <= 4 and name.isupper()
+
+
+def chord_to_km(squared_chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+class KDTree:
+    """
+    Static 3-D k-d tree kept in flat arrays: points are reordered so that every subtree is a contiguous
+    range with its median in the middle, no node objects are allocated.
+    """
+    LEAF_SIZE = 8
+
+    def __init__(self, points: np.ndarray):
+        n = len(points)
+        points = np.array(points, dtype=np.float64)
+        indices = np.arange(n)
+        stack = [(0, n, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= self.LEAF_SIZE:
+                continue
+            mid = (lo + hi) // 2
+            order = np.argpartition(points[lo:hi, depth % 3], mid - lo)
+            points[lo:hi] = points[lo:hi][order]
+            indices[lo:hi] = indices[lo:hi][order]
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+
+        self.size = n
+        # plain lists, scalar access to them is much faster than to numpy arrays in the query loop
+        self.__coords = (points[:, 0].tolist(), points[:, 1].tolist(), points[:, 2].tolist())
+        self.__indices = indices.tolist()
+
+    def query(self, point: tuple[float, float, float], k: int = 1) -> list[tuple[float, int]]:
+        """
+        `k` nearest points as `(squared distance, index in the original array)`, closest first.
+        """
+        xs, ys, zs = self.__coords
+        coords = self.__coords
+        x, y, z = point
+        best = []   # max-heap of (-squared distance, index)
+        stack = [(0, self.size, 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            if hi - lo <= self.LEAF_SIZE:
+                candidates = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                candidates = (mid,)
+                diff = point[depth % 3] - coords[depth % 3][mid]
+                near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+                stack.append((*far, depth + 1, diff * diff))
+                stack.append((*near, depth + 1, bound))
+            for i in candidates:
+                d2 = (xs[i] - x) ** 2 + (ys[i] - y) ** 2 + (zs[i] - z) ** 2
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, self.__indices[i]))
+                elif d2 < -best[0][0]:
+                    heapq.heapreplace(best, (-d2, self.__indices[i]))
+        return sorted((-neg_d2, index) for neg_d2, index in best)
+
+
+class PrefixIndex:
+    """
+    City names (and alternate names) of a gazetteer in one sorted list: all the names starting with a prefix
+    are a contiguous range found with two binary searches. Cities in the range are ranked by population,
+    the ones matched by their own name above the ones matched only by an alternate name.
+    Ranges of short prefixes are huge ("s..."), best cities for them are computed once, up front.
+    """
+    MAX_SCAN = 256          # ranges longer than that are not scanned on every keystroke
+    PRECOMPUTED_LENGTH = 3  # prefixes up to that long can have precomputed results
+    PRECOMPUTED_LIMIT = 10
+
+    def __init__(self, gazetteer: "Gazetteer"):
+        populations = gazetteer.populations.tolist()
+        entries = {}
+        for index, (name, alternate_names) in enumerate(zip(gazetteer.names, gazetteer.alternate_names)):
+            for alternate_name in alternate_names:
+                if not is_code(alternate_name):
+                    entries[normalize_name(alternate_name), index] = populations[index]
+            entries[normalize_name(name), index] = populations[index] + PRIMARY_NAME_BONUS
+        entries = sorted(entries.items())
+        self.keys = [key for (key, _), _ in entries]
+        self.cities = [index for (_, index), _ in entries]
+        self.ranks = [rank for _, rank in entries]
+
+        self.precomputed: dict[str, list[int]] = {}
+        for length in range(1, self.PRECOMPUTED_LENGTH + 1):
+            for prefix in {key[:length] for key in self.keys if len(key) >= length}:
+                lo, hi = self.__range(prefix)
+                if hi - lo > self.MAX_SCAN:
+                    self.precomputed[prefix] = self.__best(lo, hi, self.PRECOMPUTED_LIMIT)
+
+    def __range(self, prefix: str) -> tuple[int, int]:
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + "\U0010ffff")
+
+    def __best(self, lo: int, hi: int, limit: int) -> list[int]:
+        """Best ranked cities in the range, without intermediate allocations besides the result."""
+        best, best_ranks = [], []
+        for position in range(lo, hi):
+            city, rank = self.cities[position], self.ranks[position]
+            if city in best:    # matched by more than one of its names, the better one counts
+                i = best.index(city)
+                if best_ranks[i] >= rank:
+                    continue
+                del best[i], best_ranks[i]
+            if len(best) == limit and rank <= best_ranks[-1]:
+                continue
+            i = len(best)
+            while i > 0 and best_ranks[i - 1] < rank:
+                i -= 1
+            best.insert(i, city)
+            best_ranks.insert(i, rank)
+            if len(best) > limit:
+                best.pop()
+                best_ranks.pop()
+        return best
+
+    def search(self, prefix: str, limit: int = SUGGESTIONS_LIMIT) -> list[int]:
+        """Indices of the best ranked cities with a name starting with `prefix` (normalized already)."""
+        if not prefix:
+            return []
+        lo, hi = self.__range(prefix)
+        if hi - lo > self.MAX_SCAN and limit <= self.PRECOMPUTED_LIMIT and prefix in self.precomputed:
+            return self.precomputed[prefix][:limit]
+        return self.__best(lo, hi, limit)
+
+    def exact(self, name: str) -> list[int]:
+        """Indices of the cities called exactly `name` (normalized already), best ranked first."""
+        lo, hi = bisect.bisect_left(self.keys, name), bisect.bisect_right(self.keys, name)
+        return self.__best(lo, hi, hi - lo)
+
+
+class Gazetteer:
+    """
+    Cities kept column-wise (one array/list per field) with a k-d tree over their positions.
+    """
+    __shared = None
+    __shared_lock = threading.Lock()    # the app's threads may all ask for it first, it is loaded once
+
+    def __init__(
+        self,
+        names: list[str],
+        countries: list[str],
+        latitudes: np.ndarray,
+        longitudes: np.ndarray,
+        populations: np.ndarray,
+        alternate_names: list[list[str]] = None,
+    ):
+        self.names = names
+        self.countries = countries
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.populations = np.asarray(populations, dtype=np.int64)
+        self.alternate_names = alternate_names if alternate_names is not None else [[] for _ in names]
+
+        lat, lon = np.radians(self.latitudes), np.radians(self.longitudes)
+        points = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+        self.tree = KDTree(points)
+        self.__radii_km = np.maximum(1.0, np.sqrt(self.populations / (math.pi * PEOPLE_PER_KM2))).tolist()
+        self.__prefix_index = None
+        self.__prefix_index_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path = GAZETTEER_PATH) -> "Gazetteer":
+        """Read a GeoNames-style tab separated file (gzipped or not)."""
+        opener = gzip.open if str(path).endswith(".gz") else open
+        names, countries, latitudes, longitudes, populations, alternate_names = [], [], [], [], [], []
+        with opener(path, "rt", encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE, escapechar="\\"):
+                names.append(row["name"])
+                countries.append(row["country"])
+                latitudes.append(float(row["latitude"]))
+                longitudes.append(float(row["longitude"]))
+                populations.append(int(row["population"]))
+                alternate_names.append(row["alternatenames"].split(",") if row["alternatenames"] else [])
+        return cls(names, countries, latitudes, longitudes, populations, alternate_names)
+
+    @classmethod
+    def shared(cls) -> "Gazetteer":
+        """Loaded on first use, takes a moment."""
+        if cls.__shared is None:
+            with cls.__shared_lock:
+                if cls.__shared is None:
+                    cls.__shared = cls.load()
+        return cls.__shared
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def prefix_index(self) -> PrefixIndex:
+        """Built on first use, only forward geocoding needs it."""
+        if self.__prefix_index is None:
+            with self.__prefix_index_lock:
+                if self.__prefix_index is None:
+                    self.__prefix_index = PrefixIndex(self)
+        return self.__prefix_index
+
+    def suggest(self, prefix: str, limit: int = SUGGESTIONS_LIMIT) -> list[str]:
+        """
+        As-you-type suggestions, most populous first, cities matched only by an alternate name after the others.
+        Example: `war` -> `["Warsaw, Poland", "Warri, Nigeria", "Warangal, India", ...]`
+        """
+        return [self.display_name(index) for index in self.prefix_index.search(normalize_name(prefix), limit)]
+
+    def lookup(self, city_name: str) -> int | None:
+        """
+        Forward geocoding: index of the (most populous) city called `city_name`, None if unknown.
+        A city's own name wins over an alternate name of another one: `Waw` is in Myanmar, not `Wau` in South Sudan.
+        An optional country after a comma must match, otherwise it is left for Nominatim ("Paris, Texas").
+        Example: `Warszawa` -> index of `Warsaw, Poland`
+        """
+        name, _, country = normalize_name(city_name).partition(",")
+        cities = self.prefix_index.exact(name.strip())
+        if country := country.strip():
+            cities = [index for index in cities if normalize_name(self.countries[index]).startswith(country)]
+        return cities[0] if cities else None
+
+    def coords(self, index: int) -> tuple[float, float]:
+        return float(self.latitudes[index]), float(self.longitudes[index])
+
+    def display_name(self, index: int) -> str:
+        """Same format as `Geocoder` produces: `Warsaw, Poland`"""
+        return f"{self.names[index]}, {self.countries[index]}" if self.countries[index] else self.names[index]
+
+    def nearest(self, latitude: float, longitude: float) -> tuple[int, float]:
+        """Index of the nearest city and the distance to it in km."""
+        squared_chord, index = self.tree.query(to_unit_vector(latitude, longitude), k=1)[0]
+        return index, chord_to_km(squared_chord)
+
+    def reverse(self, latitude: float, longitude: float, max_distance_km: float = MAX_DISTANCE_KM) -> str | None:
+        """
+        Name of the city the coords are in, None if there is no city close enough.
+        Big cities cover a lot of ground (radius is estimated from the population): if the point is within
+        the footprint of some of the nearest cities the most populous one wins, so a district of Warsaw is Warsaw.
+        Otherwise the nearest city not farther than `max_distance_km` is used.
+        """
+        candidates = self.tree.query(to_unit_vector(latitude, longitude), k=REVERSE_CANDIDATES)
+        best_index = None
+        for squared_chord, index in candidates:
+            if chord_to_km(squared_chord) > self.__radii_km[index]:
+                continue
+            if best_index is None or self.populations[index] > self.populations[best_index]:
+                best_index = index
+        if best_index is None:
+            squared_chord, index = candidates[0]
+            if chord_to_km(squared_chord) > max_distance_km:
+                return None
+            best_index = index
+        return self.display_name(best_index)
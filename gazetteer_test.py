@@ -0,0 +1,118 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from gazetteer import Gazetteer, KDTree, PrefixIndex, normalize_name, to_unit_vector
+from geocoder import Geocoder
+from request_scheduler import RequestScheduler
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    return Gazetteer.shared()
+
+
+def test_kd_tree_matches_brute_force():
+    rng = random.Random(0)
+    coords = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+    points = np.array([to_unit_vector(lat, lon) for lat, lon in coords])
+    tree = KDTree(points)
+    for _ in range(100):
+        query = np.array(to_unit_vector(rng.uniform(-90, 90), rng.uniform(-180, 180)))
+        squared = ((points - query) ** 2).sum(axis=1)
+        expected = np.argsort(squared)[:3].tolist()
+        assert [index for _, index in tree.query(tuple(query), k=3)] == expected
+
+def test_reverse_geocoding(gazetteer):
+    assert gazetteer.reverse(52.2297, 21.0122) == "Warsaw, Poland"
+    assert gazetteer.reverse(52.2797, 21.0622) == "Warsaw, Poland"   # a district is still Warsaw
+    assert gazetteer.reverse(41.8919, 12.5113) == "Rome, Italy"
+    assert gazetteer.reverse(32.2097, 14.0022) is None  # Sahara, too far from any city
+
+def test_nearest(gazetteer):
+    index, distance_km = gazetteer.nearest(49.2992, 19.9496)
+    assert gazetteer.names[index] == "Zakopane"
+    assert distance_km < 1
+
+def test_geocoder_reverse_is_offline():
+    geo = Geocoder()
+    geo.geolocator = None   # any network call would fail
+    assert geo.convert_coords_to_city_name(52.1897, 20.9722) == "Warsaw, Poland"
+
+def test_normalize_name():
+    assert normalize_name("  Kraków,  Polska ") == "krakow, polska"
+    assert normalize_name("MÜNCHEN") == "munchen"
+
+def test_suggestions_are_ranked_by_population(gazetteer):
+    assert gazetteer.suggest("wars")[0] == "Warsaw, Poland"
+    assert gazetteer.suggest("Warsz") == ["Warsaw, Poland"]     # alternate name
+    assert gazetteer.suggest("zakop") == ["Zakopane, Poland"]
+    assert len(gazetteer.suggest("s", limit=3)) == 3
+    assert gazetteer.suggest("") == []
+    assert gazetteer.suggest("qqqqq") == []
+
+def test_suggestions_match_brute_force(gazetteer):
+    index = gazetteer.prefix_index
+    for prefix in ("a", "sa", "san", "new", "kra"):
+        ranks = {}
+        for key, city, rank in zip(index.keys, index.cities, index.ranks):
+            if key.startswith(prefix):
+                ranks[city] = max(rank, ranks.get(city, 0))
+        expected = sorted(ranks.values(), reverse=True)[:5]
+        assert [ranks[city] for city in index.search(prefix)] == expected
+
+def test_own_names_rank_above_alternate_names(gazetteer):
+    assert gazetteer.display_name(gazetteer.lookup("WAW")) == "Waw, Myanmar"     # "Waw" is also Wau's alternate
+    suggestions = gazetteer.suggest("war")
+    assert suggestions[:3] == ["Warsaw, Poland", "Warri, Nigeria", "Warangal, India"]
+    assert "Varanasi, India" not in suggestions and "Oran, Algeria" not in suggestions     # bigger, but "war..." are alternates
+
+def test_codes_are_not_indexed():
+    cities = Gazetteer(["Warsaw", "Wawer"], ["Poland", "Poland"], [52.23, 52.2], [21.01, 21.18], [1702139, 140000],
+                       [["WAW", "Warszawa"], []])
+    assert cities.suggest("wa") == ["Warsaw, Poland", "Wawer, Poland"]
+    assert cities.suggest("waw") == ["Wawer, Poland"]
+    assert cities.lookup("Warszawa") == 0 and cities.lookup("WAW") is None
+
+def test_forward_lookup(gazetteer):
+    warsaw = gazetteer.lookup("Warsaw, Poland")
+    assert gazetteer.display_name(warsaw) == "Warsaw, Poland"
+    assert gazetteer.lookup("  warszawa ") == warsaw
+    assert gazetteer.lookup("Warszawa, ") == warsaw
+    assert gazetteer.lookup("Paris, Texas") is None     # unknown country is left for Nominatim
+    assert gazetteer.lookup("Nowhere at all") is None
+
+def test_geocoder_forward_is_offline():
+    geo = Geocoder()
+    geo.geolocator = None
+    latitude, longitude = geo.convert_city_name_to_coords("Zakopane")
+    assert round(latitude, 1) == 49.3 and round(longitude, 1) == 19.9
+    assert geo.suggest("zakop") == ["Zakopane, Poland"]
+
+def test_bulk_geocoding_asks_nominatim_once_per_name():
+    class FakeNominatim:
+        calls = []
+
+        def geocode(self, query, language):
+            self.calls.append(query)
+            return None
+
+    geo = Geocoder(scheduler=RequestScheduler(rate=1000.0))
+    geo.geolocator = FakeNominatim()
+    geo.persistent_cache.get_coords = lambda query: None
+    geo.persistent_cache.save_coords = lambda *args: None
+    result = geo.convert_city_names_to_coords(["Zakopane", "Xyzzy Village", "Xyzzy Village"])
+    assert round(result["Zakopane"][0], 1) == 49.3
+    assert result["Xyzzy Village"] is None
+    assert FakeNominatim.calls == ["Xyzzy Village, "]
+
+def test_prefix_index_is_built_once(gazetteer, monkeypatch):
+    fresh = Gazetteer(gazetteer.names, gazetteer.countries, gazetteer.latitudes, gazetteer.longitudes, gazetteer.populations)
+    built = []
+    monkeypatch.setattr("gazetteer.PrefixIndex", lambda cities: built.append(cities) or PrefixIndex(cities))
+    with ThreadPoolExecutor(max_workers=8) as executor:     # the UI and the warm-up worker, at once
+        suggestions = list(executor.map(fresh.suggest, ["war"] * 8))
+    assert len(built) == 1
+    assert suggestions[0][0] == "Warsaw, Poland" and all(s == suggestions[0] for s in suggestions)
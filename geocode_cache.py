@@ -0,0 +1,120 @@
+import threading
+import time
+
+from database_orm import GeocodeEntry, db, ensure_db
+from forecast_cache import to_grid_cell
+
+# City names and coordinates don't change, a month is only to pick up fixes in OpenStreetMap.
+GEOCODE_TTL_SECONDS = 30 * 24 * 3600
+GEOCODE_CACHE_MAX_ENTRIES = 10_000
+# ~1 km, reverse geocoding anything closer than that ends up in the same city anyway
+GEOCODE_CELL_RESOLUTION = 0.01
+
+
+def normalize_city_name(city_name: str) -> str:
+    """
+    Example: `  Warszawa,  Polska ` -> `warszawa, polska`; `Warszawa, ` -> `warszawa`
+    """
+    return " ".join(city_name.casefold().split()).strip(", ")
+
+
+class GeocodeCache:
+    """
+    Geocoding results persisted in the `GeocodeEntry` table (in `user_settings.db`).
+    Forward results are looked up by normalized name, reverse ones by quantized coords.
+    Entries expire after `ttl` seconds (None - never) and the oldest ones are evicted above `max_entries`.
+    """
+    def __init__(
+        self,
+        ttl: float | None = GEOCODE_TTL_SECONDS,
+        max_entries: int = GEOCODE_CACHE_MAX_ENTRIES,
+        resolution: float = GEOCODE_CELL_RESOLUTION,
+        clock=time.time,
+    ):
+        if max_entries < 1:
+            raise ValueError("Cache must be able to hold at least one entry.")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__size = None  # rows in the table: counted once, then kept up to date by the saves
+
+    @staticmethod
+    def __ensure_table() -> None:
+        """The table is created with the database, on first use if nothing opened it (unless bound elsewhere, e.g. in tests)."""
+        if GeocodeEntry._meta.database is db:
+            ensure_db()
+
+    def get_coords(self, city_name: str) -> tuple[float, float] | None:
+        self.__ensure_table()
+        query = GeocodeEntry.select().where(GeocodeEntry.query == normalize_city_name(city_name))
+        entry = self.__first_fresh(query)
+        return (entry.latitude, entry.longitude) if entry else None
+
+    def get_city_name(self, latitude: float, longitude: float) -> str | None:
+        self.__ensure_table()
+        cell_lat, cell_lon = to_grid_cell(latitude, longitude, self.resolution)
+        query = GeocodeEntry.select().where(
+            (GeocodeEntry.cell_lat == cell_lat) & (GeocodeEntry.cell_lon == cell_lon) & GeocodeEntry.query.is_null()
+        )
+        entry = self.__first_fresh(query)
+        return entry.display_name if entry else None
+
+    def save_coords(self, city_name: str, coords: tuple[float, float]) -> None:
+        """Forward geocoding result: `city_name` -> `coords`."""
+        self.__save(normalize_city_name(city_name), coords, display_name=city_name)
+
+    def save_city_name(self, coords: tuple[float, float], city_name: str) -> None:
+        """Reverse geocoding result: `coords` -> `city_name`."""
+        self.__save(None, coords, display_name=city_name)
+
+    def clear(self) -> None:
+        self.__ensure_table()
+        with self.__lock:
+            GeocodeEntry.delete().execute()
+            self.__size = 0
+
+    def __len__(self) -> int:
+        self.__ensure_table()
+        return GeocodeEntry.select().count()
+
+    def __first_fresh(self, query) -> GeocodeEntry | None:
+        if self.ttl is not None:
+            query = query.where(GeocodeEntry.created_at > self.__clock() - self.ttl)
+        return query.order_by(GeocodeEntry.created_at.desc()).first()
+
+    def __save(self, query: str | None, coords: tuple[float, float], display_name: str) -> None:
+        self.__ensure_table()
+        latitude, longitude = coords
+        cell_lat, cell_lon = to_grid_cell(latitude, longitude, self.resolution)
+        if query is not None:   # newer result replaces the old one
+            same_key = GeocodeEntry.query == query
+        else:
+            same_key = (GeocodeEntry.cell_lat == cell_lat) & (GeocodeEntry.cell_lon == cell_lon) & GeocodeEntry.query.is_null()
+        # all or nothing: a failed (or concurrent) save must not drop the old entry or leave two
+        with self.__lock, GeocodeEntry._meta.database.atomic():
+            replaced = GeocodeEntry.delete().where(same_key).execute()
+            GeocodeEntry.create(
+                query=query,
+                cell_lat=cell_lat,
+                cell_lon=cell_lon,
+                latitude=latitude,
+                longitude=longitude,
+                display_name=display_name,
+                created_at=self.__clock(),
+            )
+            self.__size = GeocodeEntry.select().count() if self.__size is None else self.__size + 1 - replaced
+            if self.ttl is not None:
+                self.__size -= GeocodeEntry.delete().where(GeocodeEntry.created_at <= self.__clock() - self.ttl).execute()
+            if self.__size > self.max_entries:
+                self.__evict()
+
+    def __evict(self) -> None:
+        """Counted again: other caches (processes) may have written to the table too."""
+        size = GeocodeEntry.select().count()
+        overflow = size - self.max_entries
+        if overflow > 0:
+            oldest = GeocodeEntry.select(GeocodeEntry.id).order_by(GeocodeEntry.created_at).limit(overflow)
+            size -= GeocodeEntry.delete().where(GeocodeEntry.id.in_(oldest)).execute()
+        self.__size = size
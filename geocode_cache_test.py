@@ -0,0 +1,99 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from peewee import SqliteDatabase
+
+from database_orm import GeocodeEntry
+from geocode_cache import GeocodeCache, normalize_city_name
+from geocoder import Geocoder
+
+
+@pytest.fixture
+def memory_db():
+    test_db = SqliteDatabase(":memory:")
+    with test_db.bind_ctx([GeocodeEntry]):
+        test_db.create_tables([GeocodeEntry])
+        yield test_db
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_city_name():
+    assert normalize_city_name("  Warszawa,  Polska ") == "warszawa, polska"
+    assert normalize_city_name("Warszawa, ") == "warszawa"
+
+def test_forward_and_reverse_lookups(memory_db):
+    cache = GeocodeCache()
+    cache.save_coords("Warszawa, ", (52.2297, 21.0122))
+    cache.save_city_name((52.2297, 21.0122), "Warsaw, Poland")
+
+    assert cache.get_coords("WARSZAWA") == (52.2297, 21.0122)
+    assert cache.get_city_name(52.2297, 21.0122) == "Warsaw, Poland"
+    assert cache.get_city_name(52.2301, 21.0118) == "Warsaw, Poland"  # same ~1 km cell
+    assert cache.get_city_name(41.8919, 12.5113) is None
+
+def test_entries_expire_and_are_evicted(memory_db):
+    clock = FakeClock()
+    cache = GeocodeCache(ttl=60, max_entries=2, clock=clock)
+    cache.save_coords("Warszawa", (52.2297, 21.0122))
+    clock.now += 61
+    assert cache.get_coords("Warszawa") is None
+
+    cache.save_coords("Rome", (41.8919, 12.5113))
+    clock.now += 1
+    cache.save_coords("Paris", (48.8566, 2.3522))
+    clock.now += 1
+    cache.save_coords("Zakopane", (49.2992, 19.9496))
+    assert len(cache) == 2
+    assert cache.get_coords("Rome") is None
+    assert cache.get_coords("Zakopane") == (49.2992, 19.9496)
+
+def test_save_is_atomic_and_counts_rows_once(memory_db, monkeypatch):
+    cache = GeocodeCache(max_entries=3)
+    cache.save_coords("Warszawa", (52.2297, 21.0122))
+    def broken_insert(**fields):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(GeocodeEntry, "create", broken_insert)
+    with pytest.raises(RuntimeError):
+        cache.save_coords("Warszawa", (52.0, 21.0))
+    assert cache.get_coords("Warszawa") == (52.2297, 21.0122)    # the old entry wasn't deleted
+    monkeypatch.undo()
+
+    statements = []
+    execute_sql = memory_db.execute_sql
+    monkeypatch.setattr(memory_db, "execute_sql", lambda sql, *args, **kwargs: statements.append(sql) or execute_sql(sql, *args, **kwargs))
+    for name, coords in [("Rome", (41.8919, 12.5113)), ("Paris", (48.8566, 2.3522)), ("Zakopane", (49.2992, 19.9496))]:
+        cache.save_coords(name, coords)
+    assert sum("COUNT" in sql for sql in statements) == 1   # only once the table grew past the limit
+    assert len(cache) == 3 and cache.get_coords("Warszawa") is None
+
+def test_geocoder_uses_persistent_cache_before_network(memory_db):
+    GeocodeCache().save_coords("Wólka Kosowska, ", (52.0375, 20.8486))  # a village, not in the gazetteer
+    geo = Geocoder()    # fresh in-memory cache, like after a restart
+    geo.geolocator = None   # any network call would fail
+    assert geo.convert_city_name_to_coords("Wólka Kosowska") == (52.0375, 20.8486)
+    assert geo.is_in_cache(city_name="Wólka Kosowska")
+
+def test_location_uses_shared_geocoder():
+    assert Geocoder.shared() is Geocoder.shared()
+
+def test_table_is_created_on_first_use(tmp_path):
+    # fresh interpreter, nothing has initialized the database (a script, a benchmark)
+    script = (
+        "from geocode_cache import GeocodeCache; cache = GeocodeCache(); "
+        "cache.save_coords('Warszawa', (52.2297, 21.0122)); print(cache.get_coords('warszawa'))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env={"PYTHONPATH": str(Path(__file__).parent)}, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "(52.2297, 21.0122)"
+    assert (tmp_path / "user_settings.db").exists()
@@ -1,10 +1,27 @@
-from geopy.exc import GeopyError
-from geopy.geocoders import Nominatim
+from peewee import PeeweeException
 import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+from geocode_cache import GeocodeCache, normalize_city_name
+from request_scheduler import RequestScheduler
+from tracing import tracer
 logging.getLogger(__name__)
 logging.basicConfig(filename='geocoder.log', level=logging.INFO)
 # from helpers import coords_to_str
 
+# Another server speaking Nominatim's API can be used instead, e.g. the local stand-in (`stub_server.py`)
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+
+
+def shared_gazetteer():
+    """numpy and the city list are loaded on first use, they are not needed to start the app."""
+    from gazetteer import Gazetteer
+
+    return Gazetteer.shared()
+
+
 class Location:
     def __init__(self, latitude: float = None, longitude: float = None, city_prompt: str = None):
         if (not latitude or not longitude) and not city_prompt:
@@ -16,13 +33,13 @@ class Location:
 
     def __init_geo(self):
         if self.geo is None:
-            self.geo = Geocoder()
+            self.geo = Geocoder.shared()
 
     @property
     def city_name(self) -> str:
-        self.__init_geo()
-        if self.__city_name:
+        if self.__city_name:    # known, the geocoder (geopy, the database) isn't needed
             return self.__city_name
+        self.__init_geo()
         self.__city_name = self.geo.convert_coords_to_city_name(self.__lat, self.__lon)
         return self.__city_name
 
@@ -34,9 +51,9 @@ class Location:
 
     @property
     def coords(self) -> tuple[float, float]:
-        self.__init_geo()
         if self.__lat and self.__lon:
             return (self.__lat, self.__lon)
+        self.__init_geo()
         self.__lat, self.__lon = self.geo.convert_city_name_to_coords(self.__city_name)
         return (self.__lat, self.__lon)
 
@@ -55,11 +72,55 @@ class Location:
         # print(f"Timezone difference to GMT+0: {self.timezone_diff_utc0}s")
 
 
+class ResolvedLocation(Location):
+    """
+    Location with both coords and display name already known (e.g. stored in the database).
+    It never needs the geocoder.
+    """
+    def __init__(self, latitude: float, longitude: float, city_name: str):
+        if latitude is None or longitude is None or not city_name:
+            raise ValueError("ResolvedLocation needs latitude, longitude and city_name.")
+        super().__init__(latitude, longitude, city_prompt=city_name)
+
+
 class Geocoder:
-    def __init__(self):
-        self.geolocator = Nominatim(user_agent="my_geopy_app123")
+    __shared = None
+    __shared_lock = threading.Lock()
+    # Nominatim limits requests per client, not per geocoder: all of them share the limit
+    nominatim_scheduler = RequestScheduler()
+
+    def __init__(
+        self,
+        persistent_cache: GeocodeCache = None,
+        offline: bool = True,
+        scheduler: RequestScheduler = None,
+        nominatim_url: str = NOMINATIM_URL,
+    ):
+        """
+        With `offline` set, geocoding is answered from the bundled gazetteer when possible,
+        Nominatim is asked only about places it doesn't know (villages, addresses, places far from any city).
+        `nominatim_url` is the server to ask, e.g. `http://127.0.0.1:8080`.
+        """
+        from geopy.geocoders import Nominatim  # heavy, imported when the first geocoder is made
+
+        url = urlsplit(nominatim_url)
+        self.geolocator = Nominatim(user_agent="my_geopy_app123", domain=url.netloc + url.path.rstrip("/"), scheme=url.scheme)
         self.cache = {}  # coords -> city_name
         self.cache_reverse = {}  # city_name -> coords
+        # second level, on disk: survives restarts
+        self.persistent_cache = persistent_cache if persistent_cache is not None else GeocodeCache()
+        self.offline = offline
+        # throttles calls to Nominatim, concurrent lookups of the same place share one call
+        self.scheduler = scheduler if scheduler is not None else self.nominatim_scheduler
+
+    @classmethod
+    def shared(cls) -> "Geocoder":
+        """One geocoder (so one in-memory cache) for the whole process."""
+        if cls.__shared is None:
+            with cls.__shared_lock:     # the UI and the background workers may both be first
+                if cls.__shared is None:
+                    cls.__shared = cls()
+        return cls.__shared
 
     def fill_location_coords(self, location: Location) -> None:
         """ Location must have city_name filled."""
@@ -91,16 +152,33 @@ class Geocoder:
         self.cache[coords] = city_name
         self.cache_reverse[city_name] = coords
 
+    @tracer.traced("geocoding.reverse")
     def convert_coords_to_city_name(self, latitude: float, longitude: float) -> str | None:
         """
         Example: `52.2297, 21.0122` -> `Warszawa, Polska`
         """
         if (latitude, longitude) in self.cache:
             logging.info(f"Cache hit for coords: {self.cache[(latitude, longitude)]}, {(latitude, longitude)}")
+            tracer.count("geocoder_cache.hit")
             return self.cache[(latitude, longitude)]
+        tracer.count("geocoder_cache.miss")
+        if self.offline and (display_name := shared_gazetteer().reverse(latitude, longitude)):
+            logging.info(f"Offline reverse geocoding: {display_name}, {(latitude, longitude)}")
+            self.save_to_cache(display_name, (latitude, longitude))
+            return display_name
+        if display_name := self.__use_persistent_cache(self.persistent_cache.get_city_name, latitude, longitude):
+            logging.info(f"Persistent cache hit for coords: {display_name}, {(latitude, longitude)}")
+            self.save_to_cache(display_name, (latitude, longitude))
+            return display_name
+
+        from geopy.exc import GeopyError    # imported already by __init__
 
         try:
-            location = self.geolocator.reverse(f"{latitude}, {longitude}", language="en")
+            with tracer.span("geocoding.nominatim"):
+                location = self.scheduler.submit(
+                    ("reverse", latitude, longitude),
+                    lambda: self.geolocator.reverse(f"{latitude}, {longitude}", language="en"),
+                )
             logging.info(f"Geocoder made call: {location}")
             display_name = location.raw.get("display_name", f"{latitude}, {longitude}")
             address: dict = location.raw.get("address", None)
@@ -115,25 +193,75 @@ class Geocoder:
             else display_name or f"{latitude}, {longitude}"
         )
         self.save_to_cache(display_name, coords := (latitude, longitude))
+        self.__use_persistent_cache(self.persistent_cache.save_city_name, coords, display_name)
         return display_name
 
+    @tracer.traced("geocoding.forward")
     def convert_city_name_to_coords(self, city_name: str, country_name: str = None) -> tuple[float, float] | None:
-        if city_name in self.cache:
-            logging.info(f"Cache hit for coords: {self.cache[city_name]}, {city_name}")
-            return self.cache[city_name]
+        if city_name in self.cache_reverse:
+            logging.info(f"Cache hit for coords: {self.cache_reverse[city_name]}, {city_name}")
+            tracer.count("geocoder_cache.hit")
+            return self.cache_reverse[city_name]
+        tracer.count("geocoder_cache.miss")
+        query = f"{city_name}, {country_name if country_name else ''}"
+        if self.offline and (coords := self.__lookup_offline(query)):
+            logging.info(f"Offline geocoding: {coords}, {query}")
+            self.save_to_cache(city_name, coords)
+            return coords
+        if coords := self.__use_persistent_cache(self.persistent_cache.get_coords, query):
+            logging.info(f"Persistent cache hit for city: {coords}, {query}")
+            self.save_to_cache(city_name, coords)
+            return coords
+
+        from geopy.exc import GeopyError
 
         try:
-            location = self.geolocator.geocode(f"{city_name}, {country_name if country_name else ''}", language="en")
+            with tracer.span("geocoding.nominatim"):
+                location = self.scheduler.submit(
+                    ("geocode", normalize_city_name(query)), lambda: self.geolocator.geocode(query, language="en")
+                )
             logging.info(f"Geocoder made call: {location}")
             if location is None: return None
         except GeopyError as e:
             return None
         coords = (float(location.raw["lat"]), float(location.raw["lon"]))
         self.save_to_cache(city_name, coords)
+        self.__use_persistent_cache(self.persistent_cache.save_coords, query, coords)
         return coords
 
+    def convert_city_names_to_coords(self, city_names: list[str]) -> dict[str, tuple[float, float] | None]:
+        """
+        Bulk forward geocoding. Names known offline or cached are answered at once,
+        the rest queue up for Nominatim (about one per second), every distinct name is asked about once.
+        """
+        return {city_name: self.convert_city_name_to_coords(city_name) for city_name in dict.fromkeys(city_names)}
+
+    @staticmethod
+    def __lookup_offline(query: str) -> tuple[float, float] | None:
+        gazetteer = shared_gazetteer()
+        index = gazetteer.lookup(query)
+        return gazetteer.coords(index) if index is not None else None
+
+    def suggest(self, prefix: str, limit: int | None = None) -> list[str]:
+        """City names for as-you-type completion, offline only. `limit` defaults to the gazetteer's one."""
+        if not self.offline:
+            return []
+        gazetteer = shared_gazetteer()
+        return gazetteer.suggest(prefix, limit) if limit is not None else gazetteer.suggest(prefix)
+
+    @staticmethod
+    def __use_persistent_cache(method, *args):
+        """The disk cache is an optimization only, a broken database must not break geocoding."""
+        try:
+            return method(*args)
+        except PeeweeException as e:
+            logging.warning(f"Persistent geocoding cache unavailable: {e}")
+            return None
+
 
 if __name__ == "__main__":
+    from geopy.geocoders import Nominatim
+
     geolocator = Nominatim(user_agent="my_geopy_app")
     location = geolocator.geocode("Warszawa", language="en")
     print(location.raw)
@@ -1,6 +1,6 @@
 import pytest
 
-from geocoder import Geocoder, Location
+from geocoder import Geocoder, Location, ResolvedLocation
 
 
 def test_location_internal_state_stability():
@@ -14,6 +14,13 @@ def test_location_internal_state_stability():
     assert lon == pytest.approx(-118.2437, rel=0.0001)
 
 
+def test_resolved_location_never_geocodes(monkeypatch):
+    monkeypatch.setattr(Geocoder, "shared", lambda: pytest.fail("the geocoder was created"))
+    location = ResolvedLocation(52.25, 21.0, "Warsaw, Poland")
+    assert location.city_name == "Warsaw, Poland"
+    assert location.to_coords() == (52.25, 21.0)
+
+
 def test_location_cache():
     geo = Geocoder()
     loc1 = Location(city_prompt="Warsaw, Poland")
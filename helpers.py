@@ -1,10 +1,16 @@
 # Generic functions used in project
-import datetime as dt
 import time
+from functools import lru_cache
 
-import pandas as pd
+import numpy as np
 
-from api_session import *
+
+# Labels are put together from characters of `np.datetime_as_string(..., unit="m")`: `2025-12-19T12:00`.
+# Numbers are positions in that string, bytes are put as they are.
+_LABEL_LAYOUTS = {
+    False: (11, 12, 13, 14, 15, b" ", 8, 9, b"/", 5, 6),  # `12:00 19/12`
+    True: (8, 9, b"/", 5, 6),                               # `19/12`
+}
 
 
 def datetime_to_labels(start: time, end: time, interval: int, dates=False) -> list:
@@ -13,18 +19,34 @@ def datetime_to_labels(start: time, end: time, interval: int, dates=False) -> li
     `2025-12-19 12:00:00+00:00` -> `12:00 19/12`
     if dates -> `19/12`
     """
-    data = pd.date_range(
-        start=pd.to_datetime(start, unit="s", utc=True),
-        end=pd.to_datetime(end, unit="s", utc=True),
-        freq=pd.Timedelta(seconds=interval),
-        inclusive="left",
-    ).to_pydatetime().tolist()
+    return list(_datetime_to_labels(int(start), int(end), int(interval), bool(dates)))
 
-    format = "%H:%M %d/%m" if not dates else "%d/%m"
 
-    for i, date in enumerate(data):
-        data[i] = dt.datetime.strftime(date, format)
-    return data
+@lru_cache(maxsize=64)
+def _datetime_to_labels(start: int, end: int, interval: int, dates: bool) -> tuple[str, ...]:
+    """
+    All the labels at once, no per-label python code: numpy formats the timestamps,
+    then the needed characters are picked out column by column. Cached, a forecast is drawn many times.
+    """
+    timestamps = np.arange(start, end, interval, dtype=np.int64).astype("datetime64[s]")
+    iso = np.datetime_as_string(timestamps, unit="m").astype("S16").view(np.uint8).reshape(-1, 16)
+
+    layout = _LABEL_LAYOUTS[dates]
+    labels = np.empty((len(iso), len(layout)), dtype=np.uint8)
+    for i, part in enumerate(layout):
+        labels[:, i] = iso[:, part] if isinstance(part, int) else part[0]
+    return tuple(labels.view(f"S{len(layout)}").ravel().astype(str).tolist())
+
+
+def age_to_str(seconds: float) -> str:
+    """
+    Example: `90` -> `1 min`, `7200` -> `2 h`, `200000` -> `2 d`
+    """
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min"
+    if seconds < 24 * 3600:
+        return f"{int(seconds // 3600)} h"
+    return f"{int(seconds // (24 * 3600))} d"
 
 
 def coords_to_str(latitude: float, longitude: float) -> str:
@@ -32,6 +54,8 @@ def coords_to_str(latitude: float, longitude: float) -> str:
 
 
 if __name__ == "__main__":
+    from api_session import ApiSession
+
     api = ApiSession()
     hourly = api.get_hourly_data()
     datetime_to_labels(hourly.time, hourly.time_end, hourly.interval)
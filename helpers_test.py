@@ -0,0 +1,38 @@
+import datetime as dt
+
+from helpers import _datetime_to_labels, age_to_str, coords_to_str, datetime_to_labels
+
+START = int(dt.datetime(2025, 12, 19, 12, tzinfo=dt.timezone.utc).timestamp())
+
+
+def test_hourly_labels():
+    labels = datetime_to_labels(START, START + 168 * 3600, 3600)
+    assert len(labels) == 168
+    assert labels[:2] == ["12:00 19/12", "13:00 19/12"]
+    assert labels[12] == "00:00 20/12"
+
+def test_daily_labels():
+    assert datetime_to_labels(START, START + 3 * 86400, 86400, dates=True) == ["19/12", "20/12", "21/12"]
+
+def test_labels_match_strftime():
+    labels = datetime_to_labels(START, START + 1000 * 900, 900)
+    expected = [
+        dt.datetime.fromtimestamp(START + i * 900, dt.timezone.utc).strftime("%H:%M %d/%m") for i in range(1000)
+    ]
+    assert labels == expected
+
+def test_labels_are_memoized():
+    _datetime_to_labels.cache_clear()
+    first = datetime_to_labels(START, START + 24 * 3600, 3600)
+    first.append("changed by the caller")
+    second = datetime_to_labels(START, START + 24 * 3600, 3600)
+    assert _datetime_to_labels.cache_info().hits == 1
+    assert len(second) == 24
+
+def test_coords_to_str():
+    assert coords_to_str(52.23, 21.01) == "52.23°N 21.01°E"
+
+def test_age_to_str():
+    assert age_to_str(90) == "1 min"
+    assert age_to_str(7200) == "2 h"
+    assert age_to_str(200000) == "2 d"
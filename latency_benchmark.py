@@ -0,0 +1,173 @@
+# End-to-end latency of showing a plot, stage by stage: geocoding, API call, parsing, payload, labels, rendering.
+# Forecasts come from the local stand-in server (`stub_server.py`), recorded ones with `--fixtures`,
+# so the numbers don't depend on the network. Every stage is timed cold: no cache answers for it.
+#   python latency_benchmark.py --iterations 100 --output latency.json
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import plotext
+
+from api_session import ApiSession, DailyWeatherForecastFactory, HourlyWeatherForecastFactory
+from geocoder import Geocoder, Location
+from helpers import _datetime_to_labels, datetime_to_labels
+from my_weather_app import Plotter, make_data_payload
+from startup_benchmark import git_commit
+from stub_server import StubServer
+
+STAGES = ["geocoding", "api_call", "parsing", "payload", "labels", "rendering"]
+PERCENTILES = [50, 90, 99]
+ITERATIONS = 50
+CITIES = ["Warszawa", "Kraków", "Paris", "Tokyo", "Sydney", "Cairo", "Lima", "Toronto"]
+KINDS = ["hourly", "daily"]
+FORECAST_DAYS = [1, 7, 16]
+EXTRA_VARIABLE_COUNTS = [0, 4, 8]
+# Requested on top of the ones the app needs
+EXTRA_VARIABLES = {
+    "hourly": ["dew_point_2m", "precipitation", "cloud_cover", "wind_speed_10m", "wind_direction_10m",
+               "surface_pressure", "pressure_msl", "wind_gusts_10m"],
+    "daily": ["uv_index_max", "wind_speed_10m_max", "rain_sum", "snowfall_sum", "shortwave_radiation_sum",
+              "showers_sum", "wind_gusts_10m_max", "precipitation_probability_max"],
+}
+FACTORIES = {"hourly": HourlyWeatherForecastFactory, "daily": DailyWeatherForecastFactory}
+CANVAS_SIZE = (120, 30)
+GRID_STEP = 0.05    # every API call asks about another grid cell, no cache can answer it
+
+
+class NoPersistentCache:
+    """Geocoding is timed without the database."""
+    def get_coords(self, city_name):
+        return None
+
+    def get_city_name(self, latitude, longitude):
+        return None
+
+    def save_coords(self, city_name, coords):
+        pass
+
+    def save_city_name(self, coords, city_name):
+        pass
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """
+    Example: `{"p50": 0.012, "p90": 0.020, "p99": 0.031, "mean": 0.014, "max": 0.035}` (seconds)
+    """
+    values = np.asarray(samples, dtype=np.float64)
+    summary = {f"p{percentile}": float(np.percentile(values, percentile)) for percentile in PERCENTILES}
+    summary.update(mean=float(values.mean()), max=float(values.max()))
+    return summary
+
+
+class Timer:
+    """Seconds spent in every stage, one sample per `with timer.stage(name)`."""
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started_at = time.perf_counter()
+        yield
+        self.samples.setdefault(name, []).append(time.perf_counter() - started_at)
+
+
+def run_configuration(
+    stub: StubServer, kind: str, forecast_days: int, extra_variables: int, iterations: int, first_cell: int = 0
+) -> dict:
+    """`iterations` plots of `kind` forecasts, `forecast_days` long, with `extra_variables` more variables requested."""
+    session = ApiSession(52.2297, 21.0122, base_url=stub.url)
+    # the app's params, with the forecast length and the number of variables changed for this configuration
+    session.params["forecast_days"] = forecast_days
+    session.params[kind] = session.params[kind] + EXTRA_VARIABLES[kind][:extra_variables]
+    timer = Timer()
+    for iteration in range(iterations):
+        city = CITIES[iteration % len(CITIES)]
+        location = Location(city_prompt=city)
+        location.geo = Geocoder(NoPersistentCache())   # empty in-memory cache
+        with timer.stage("geocoding"):
+            latitude, longitude = location.coords
+
+        longitude = (longitude + (first_cell + iteration) * GRID_STEP + 180) % 360 - 180
+        with timer.stage("api_call"):
+            response = session._make_api_call(latitude, longitude, {kind: None})  # only the plotted section
+        with timer.stage("parsing"):
+            forecast = FACTORIES[kind].create(response, session.params[kind])
+        with timer.stage("payload"):
+            series, labels = make_data_payload(forecast)
+        _datetime_to_labels.cache_clear()
+        with timer.stage("labels"):
+            datetime_to_labels(forecast.time, forecast.time_end, forecast.interval)
+        _datetime_to_labels.cache_clear()
+        plotext.clear_figure()
+        plotext.plotsize(*CANVAS_SIZE)
+        with timer.stage("rendering"), contextlib.redirect_stdout(io.StringIO()):  # off-screen
+            Plotter(plotext).draw(forecast, series, labels, title=city, width=CANVAS_SIZE[0])
+
+    totals = [sum(stage_samples) for stage_samples in zip(*(timer.samples[stage] for stage in STAGES))]
+    return {
+        "kind": kind,
+        "forecast_days": forecast_days,
+        "variables": len(session.params[kind]),
+        "points": len(forecast.temperature_2m if kind == "hourly" else forecast.temperature_2m_max),
+        "stages": {stage: summarize(timer.samples[stage]) for stage in STAGES},
+        "total": summarize(totals),
+    }
+
+
+def run_benchmark(
+    iterations: int = ITERATIONS,
+    kinds: list[str] = KINDS,
+    forecast_days: list[int] = FORECAST_DAYS,
+    extra_variable_counts: list[int] = EXTRA_VARIABLE_COUNTS,
+    latency: float = 0.0,
+    fixtures_dir: Path = None,
+) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):   # HTTP cache of the sessions
+        with StubServer(latency=latency, fixtures_dir=fixtures_dir) as stub:
+            for kind in kinds:
+                for days in forecast_days:
+                    for extra_variables in extra_variable_counts:
+                        first_cell = len(results) * iterations
+                        results.append(run_configuration(stub, kind, days, extra_variables, iterations, first_cell))
+    return {
+        "commit": git_commit(),
+        "iterations": iterations,
+        "server_latency": latency,
+        "results": results,
+    }
+
+
+def format_table(benchmark: dict) -> str:
+    """Median (p50) and p99 of every stage in milliseconds, one row per configuration."""
+    header = f"{'kind':<7}{'days':>5}{'vars':>5}{'points':>7}" + "".join(f"{stage:>20}" for stage in [*STAGES, "total"])
+    rows = [header + "  (p50 / p99, ms)"]
+    for result in benchmark["results"]:
+        stages = {**result["stages"], "total": result["total"]}
+        row = f"{result['kind']:<7}{result['forecast_days']:>5}{result['variables']:>5}{result['points']:>7}"
+        row += "".join(f"{stages[stage]['p50'] * 1000:>12.2f} /{stages[stage]['p99'] * 1000:>6.2f}" for stage in [*STAGES, "total"])
+        rows.append(row)
+    return "\n".join(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency of the fetch -> parse -> plot pipeline.")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    parser.add_argument("--forecast-days", type=int, nargs="+", default=FORECAST_DAYS)
+    parser.add_argument("--extra-variables", type=int, nargs="+", default=EXTRA_VARIABLE_COUNTS)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub server adds to every request")
+    parser.add_argument("--fixtures", type=Path, default=None, help="recorded forecasts for the stub server")
+    parser.add_argument("--output", type=Path, help="where to write the results (JSON)")
+    args = parser.parse_args()
+
+    benchmark = run_benchmark(args.iterations, args.kinds, args.forecast_days, args.extra_variables, args.latency, args.fixtures)
+    if args.output:
+        args.output.write_text(json.dumps(benchmark, indent=2))
+    print(format_table(benchmark), file=sys.stderr)
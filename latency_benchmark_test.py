@@ -0,0 +1,22 @@
+import pytest
+
+from latency_benchmark import STAGES, format_table, run_benchmark, summarize
+
+
+def test_summarize():
+    summary = summarize([float(i) for i in range(1, 101)])
+    assert summary["p50"] == pytest.approx(50.5)
+    assert summary["p99"] == pytest.approx(99.01)
+    assert (summary["mean"], summary["max"]) == (pytest.approx(50.5), 100.0)
+
+def test_every_stage_is_timed():
+    benchmark = run_benchmark(iterations=3, kinds=["hourly", "daily"], forecast_days=[2], extra_variable_counts=[0, 2])
+    assert [(result["kind"], result["variables"]) for result in benchmark["results"]] == [
+        ("hourly", 3), ("hourly", 5), ("daily", 9), ("daily", 11)
+    ]
+    hourly = benchmark["results"][0]
+    assert hourly["points"] == 2 * 24
+    assert set(hourly["stages"]) == set(STAGES)
+    assert all(0 < stage["p50"] <= stage["max"] for stage in hourly["stages"].values())
+    assert hourly["total"]["p50"] >= hourly["stages"]["api_call"]["p50"]
+    assert len(format_table(benchmark).splitlines()) == 1 + 4
@@ -1,18 +1,41 @@
+import asyncio
+import logging
+import shutil
+from dataclasses import dataclass
 from functools import singledispatch, singledispatchmethod
+from typing import AsyncIterator
 
 import plotext
+import numpy as np
 from numpy import ndarray
 
+from alert_engine import ALERT_VARIABLES
 from api_session import (
     ApiSession,
+    AsyncApiSession,
     CurrentWeatherForecast,
     IntervalicWeatherForecast,
     DailyWeatherForecast,
     HourlyWeatherForecast,
     WeatherForecast,
 )
-from geocoder import Geocoder, Location
+from downsampling import DOWNSAMPLING_METHODS, POINTS_PER_COLUMN, thin_ticks
+from forecast_cache import STALE_FORECAST_MAX_AGE_SECONDS, ForecastCache
+from geocoder import Geocoder, Location, ResolvedLocation
 from helpers import datetime_to_labels, coords_to_str
+from request_scheduler import SingleFlight
+from tracing import tracer
+
+
+# cities geocoded at once while warming up, the forecasts are fetched in batches anyway
+PREFETCH_CONCURRENCY = 4
+# views of the plot screen: a few cities, hourly and daily, a couple of canvas sizes
+RENDER_CACHE_MAX_ENTRIES = 16
+# the series on the plots, the only hourly and daily variables the app requests
+PLOTTED_VARIABLES = {
+    "hourly": ("temperature_2m", "apparent_temperature"),
+    "daily": ("temperature_2m_max", "temperature_2m_min", "apparent_temperature_max", "apparent_temperature_min"),
+}
 
 
 # TODO: Create interfaces for future extension??
@@ -22,15 +45,25 @@ class MyWeatherApp:
     """
     def __init__(self):
         self.__current_location = Location(city_prompt="Warszawa")  # default
-        self.api = ApiSession(self.__current_location.coords[0], self.__current_location.coords[1])
-        self.geocoder = Geocoder()
+        # shared by both sessions, expired forecasts are kept to be shown while the fresh ones are fetched
+        self.forecast_cache = ForecastCache(max_stale=STALE_FORECAST_MAX_AGE_SECONDS)
+        lat, lon = self.__current_location.coords
+        # and so are the requests in flight: the alert check and the plot of one city make one request
+        single_flight = SingleFlight()
+        self.api = ApiSession(lat, lon, forecast_cache=self.forecast_cache, single_flight=single_flight)
+        self.async_api = AsyncApiSession(lat, lon, forecast_cache=self.forecast_cache, single_flight=single_flight)
+        for session in (self.api, self.async_api):  # nothing else of the hourly and daily data is shown
+            session.params.update({kind: list(variables) for kind, variables in PLOTTED_VARIABLES.items()})
+        self.geocoder = Geocoder.shared()
+        self.plotter = None
+        self.render_cache = ForecastCache(max_entries=RENDER_CACHE_MAX_ENTRIES)    # prepared plots
 
     def get_current_weather(self, location: Location = None) -> CurrentWeatherForecast:
         if location is None:
             lat, lon = None, None
         else:
             lat, lon = location.to_coords()
-        self.__update_current_location(weather := self.api.get_current_weather(lat, lon))
+        self.__update_current_location(weather := self.api.get_current_weather(lat, lon), location)
         return weather
 
     def get_hourly_forecast(self, location: Location = None) -> HourlyWeatherForecast:
@@ -38,7 +71,7 @@ class MyWeatherApp:
             lat, lon = None, None
         else:
             lat, lon = location.to_coords()
-        self.__update_current_location(weather := self.api.get_hourly_forecast(lat, lon))
+        self.__update_current_location(weather := self.api.get_hourly_forecast(lat, lon), location)
         return weather
 
     def get_daily_forecast(self, location: Location = None) -> DailyWeatherForecast:
@@ -46,44 +79,200 @@ class MyWeatherApp:
             lat, lon = None, None
         else:
             lat, lon = location.to_coords()
-        self.__update_current_location(weather := self.api.get_daily_forecast(lat, lon))
+        self.__update_current_location(weather := self.api.get_daily_forecast(lat, lon), location)
+        return weather
+
+    # Async variants for the TUI: network waits are awaited, blocking geocoding runs in a worker thread
+    async def get_current_weather_async(self, location: Location = None) -> CurrentWeatherForecast:
+        lat, lon = await self.__to_coords_async(location)
+        weather = await self.async_api.get_current_weather(lat, lon)
+        await asyncio.to_thread(self.__update_current_location, weather, location)
+        return weather
+
+    async def get_hourly_forecast_async(self, location: Location = None) -> HourlyWeatherForecast:
+        lat, lon = await self.__to_coords_async(location)
+        weather = await self.async_api.get_hourly_forecast(lat, lon)
+        await asyncio.to_thread(self.__update_current_location, weather, location)
         return weather
 
+    async def get_daily_forecast_async(self, location: Location = None) -> DailyWeatherForecast:
+        lat, lon = await self.__to_coords_async(location)
+        weather = await self.async_api.get_daily_forecast(lat, lon)
+        await asyncio.to_thread(self.__update_current_location, weather, location)
+        return weather
+
+    async def prefetch_forecasts(self, locations: list[Location], max_concurrency: int = PREFETCH_CONCURRENCY) -> int:
+        """
+        Warm up the forecast cache: locate all the `locations` (at most `max_concurrency` at a time)
+        and fetch their hourly forecasts (what the plot screen shows first) and what the alert checks need
+        in batched multi-location calls, so afterwards both are served from memory.
+        Locations that couldn't be located are skipped. Returns the number of prefetched locations.
+        """
+        if max_concurrency < 1:
+            raise ValueError("At least one location must be located at a time.")
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def locate(location: Location) -> tuple[float, float] | None:
+            async with semaphore:
+                try:
+                    return await self.__to_coords_async(location)
+                except Exception as e:
+                    logging.warning(f"Couldn't locate {location} for prefetching: {e}")
+                    return None
+
+        located = await asyncio.gather(*map(locate, locations))
+        coords = list(dict.fromkeys(c for c in located if c is not None and None not in c))
+        if coords:
+            await self.async_api.prefetch_many(coords, {"hourly": None, "current": ALERT_VARIABLES})
+        return len(coords)
+
+    @staticmethod
+    async def __to_coords_async(location: Location = None) -> tuple[float, float]:
+        if location is None:
+            return None, None
+        return await asyncio.to_thread(location.to_coords)
+
+    async def close(self) -> None:
+        """Connections of both sessions, once the app exits."""
+        self.api.close()
+        await self.async_api.close()
+
     @property   # user cannot change current location
     def current_location(self):
         return self.__current_location
 
-    def __update_current_location(self, weather: WeatherForecast):
+    def __update_current_location(self, weather: WeatherForecast, location: Location = None) -> Location:
         """
         Updates the location specified during last api call
         """
         if not weather:
             raise ValueError("No weather data to update location from.")
-        self.__current_location.coords = (weather.latitude, weather.longitude)
+        self.__current_location = self.__located(weather, location)
+        return self.__current_location
+
+    @staticmethod
+    def __located(weather: WeatherForecast, location: Location = None) -> Location:
+        """Where the `weather` is: `location` if its name is already known, the forecast's coords otherwise."""
+        if isinstance(location, ResolvedLocation):  # no reverse geocoding
+            return location
+        # city name is looked up lazily, only when somebody needs it
+        return Location(weather.latitude, weather.longitude)
+
+    @staticmethod
+    def __to_location(city: str | Location) -> Location:
+        return city if isinstance(city, Location) else Location(city_prompt=city)
+
+    def draw_daily_plot(self, plt: plotext, city: str | Location, width: int = None, height: int = None) -> "PreparedPlot":
+        location = self.__to_location(city)
+        weather_forecast = self.get_daily_forecast(location)
+        return self.__draw_plot(plt, weather_forecast, self.__located(weather_forecast, location), width, height)
+
+    def draw_hourly_plot(self, plt: plotext, city: str | Location, width: int = None, height: int = None) -> "PreparedPlot":
+        location = self.__to_location(city)
+        weather_forecast = self.get_hourly_forecast(location)
+        return self.__draw_plot(plt, weather_forecast, self.__located(weather_forecast, location), width, height)
+
+    async def draw_daily_plot_async(self, plt: plotext, city: str | Location, width: int = None, height: int = None) -> "PreparedPlot":
+        location = self.__to_location(city)
+        weather_forecast = await self.get_daily_forecast_async(location)
+        located = self.__located(weather_forecast, location)
+        return await asyncio.to_thread(self.__draw_plot, plt, weather_forecast, located, width, height)
 
-    def draw_daily_plot(self, plt: plotext, city: str):
-        weather_forecast = self.get_daily_forecast(Location(city_prompt=city))
-        self.__draw_plot(plt, weather_forecast)
+    async def draw_hourly_plot_async(self, plt: plotext, city: str | Location, width: int = None, height: int = None) -> "PreparedPlot":
+        location = self.__to_location(city)
+        weather_forecast = await self.get_hourly_forecast_async(location)
+        located = self.__located(weather_forecast, location)
+        return await asyncio.to_thread(self.__draw_plot, plt, weather_forecast, located, width, height)
 
-    def draw_hourly_plot(self, plt: plotext, city: str):
-        weather_forecast = self.get_hourly_forecast(Location(city_prompt=city))
-        self.__draw_plot(plt, weather_forecast)
+    async def draw_plot_stale_while_revalidate(
+        self, plt: plotext, city: str | Location, kind: str, width: int = None, height: int = None
+    ) -> AsyncIterator[tuple["PreparedPlot", float]]:
+        """
+        Draw the last known `kind` ("hourly" or "daily") forecast at once and yield it with its age in seconds.
+        If it has expired (or there was none), a fresh one is fetched, drawn and yielded too (age 0).
+        A failed refresh leaves the outdated forecast on the canvas.
+        """
+        location = self.__to_location(city)
+        lat, lon = await self.__to_coords_async(location)
+        stale = await asyncio.to_thread(self.api.get_stale_forecast, kind, lat, lon)
+        if stale is not None:
+            weather_forecast, age = stale
+            located = await asyncio.to_thread(self.__update_current_location, weather_forecast, location)
+            yield await asyncio.to_thread(self.__draw_plot, plt, weather_forecast, located, width, height), age
+            if not self.is_outdated(age):
+                return
+
+        try:
+            weather_forecast = await asyncio.to_thread(self.api.revalidate_forecast, kind, lat, lon)
+        except Exception as e:
+            if stale is None:
+                raise
+            logging.warning(f"Couldn't refresh the {kind} forecast, showing the outdated one: {e}")
+            return
+        located = await asyncio.to_thread(self.__update_current_location, weather_forecast, location)
+        yield await asyncio.to_thread(self.__draw_plot, plt, weather_forecast, located, width, height), 0.0
+
+    def is_outdated(self, age: float) -> bool:
+        return age >= self.forecast_cache.ttl
+
+    def __draw_plot(
+        self,
+        plt: plotext,
+        weather_forecast: IntervalicWeatherForecast,
+        location: Location,
+        width: int = None,
+        height: int = None,
+    ) -> "PreparedPlot":
+        """
+        Series, labels and title are prepared once per forecast, title and canvas width, switching back
+        to an already seen view only replays them. A refreshed forecast is a new object, so it is prepared again.
+        Cities in the same grid cell share the forecast but not the title. Only the width shapes the plot
+        (downsampling, ticks), the height is left to the canvas.
+        `location` is where the forecast was fetched for, the current location may have changed since.
+        """
+        location = location.city_name   # may reverse geocode, the async callers run this in a worker thread
+        key = (
+            (weather_forecast.latitude, weather_forecast.longitude),
+            type(weather_forecast).__name__,
+            location,
+            width,
+            weather_forecast.time,
+        )
+        cached = self.render_cache.get(key)
+        if cached is not None and cached[0] is weather_forecast:
+            tracer.count("render_cache.hit")
+            prepared = cached[1]
+        else:
+            tracer.count("render_cache.miss")
+            # loop through fields of weather_forecast and make plot for each of them??
+            series, labels = make_data_payload(weather_forecast)
+            prepared = Plotter(plt).prepare(weather_forecast, series, labels, title=location, width=width)
+            self.render_cache.put(key, (weather_forecast, prepared))
+
+        if self.plotter is None or self.plotter.plt is not plt:
+            self.plotter = Plotter(plt)
+        self.plotter.render(prepared)
+        return prepared
 
-    def __draw_plot(self, plt: plotext, weather_forecast: IntervalicWeatherForecast):
-        # loop through fields of weather_forecast and make plot for each of them??
-        series, labels = make_data_payload(weather_forecast, self.api.params)
-        location = self.geocoder.convert_coords_to_city_name(weather_forecast.latitude, weather_forecast.longitude)
 
-        self.plotter = Plotter(plt)
-        self.plotter.draw(weather_forecast, series, labels, title=location)
+@dataclass(frozen=True)
+class PreparedPlot:
+    """Everything `Plotter` passes to plotext, ready to be drawn again."""
+    title: str
+    series: tuple[tuple[list[int], list[float], str], ...]     # x, y and label of every line
+    ticks: list[int]
+    tick_labels: list[str]
 
 
 class Plotter:
-    def __init__(self, plt: plotext):
+    def __init__(self, plt: plotext, downsampling: str = "lttb"):
         # plt.clear_terminal()
         # plt.theme("dark")
+        if downsampling not in DOWNSAMPLING_METHODS:
+            raise ValueError(f"Unknown downsampling method: {downsampling}. Use one of {list(DOWNSAMPLING_METHODS)}.")
         self.plt = plt
         self.y_label = "°C"
+        self.downsample = DOWNSAMPLING_METHODS[downsampling]
         plt.xlabel("Time")
         plt.ylabel(self.y_label)
 
@@ -93,45 +282,60 @@ class Plotter:
         series_of_data_measurements: list[ndarray],
         labels: list[str],
         title: str,
+        width: int = None,
     ):
         """
         Draw a few plots on a sigle canvas (for instance: both temp and humidity on a single plot).
         len(series) and len(labels) should be equal.
         """
+        self.render(self.prepare(weather_forecast, series_of_data_measurements, labels, title, width))
+
+    @tracer.traced("plot.prepare")
+    def prepare(
+        self,
+        weather_forecast: IntervalicWeatherForecast,
+        series_of_data_measurements: list[ndarray],
+        labels: list[str],
+        title: str,
+        width: int = None,
+    ) -> PreparedPlot:
+        """
+        Series longer than the canvas is wide (`width` columns, terminal width by default) are downsampled,
+        only the time labels that fit are kept.
+        """
+        if width is None:
+            width = shutil.get_terminal_size().columns
+        # all the series share the time axis, its labels are made once per forecast
+        x_labels = datetime_to_labels(weather_forecast.time, weather_forecast.time_end, weather_forecast.interval)
+        lines = []
+        for single_series, label in zip(series_of_data_measurements, labels):
+            x_axis_indices = self.downsample(single_series, width * POINTS_PER_COLUMN)
+            lines.append((x_axis_indices.tolist(), np.asarray(single_series)[x_axis_indices].tolist(), label))
+        ticks = thin_ticks(x_labels, width)
+        return PreparedPlot(title, tuple(lines), ticks, [x_labels[tick] for tick in ticks])
+
+    @tracer.traced("plot.render")
+    def render(self, prepared: PreparedPlot):
         plt = self.plt
         plt.clear_data()
         plt.clear_figure()
-        plt.title(title)
-        for single_series, label in zip(series_of_data_measurements, labels):
-            x_labels = datetime_to_labels(weather_forecast.time, weather_forecast.time_end, weather_forecast.interval)
-            x_axis_indices = range(len(single_series))
-            plt.plot(x_axis_indices, single_series, marker="braille", label=label)
-            plt.xticks(ticks=x_axis_indices, labels=x_labels)
+        plt.title(prepared.title)
+        for x, y, label in prepared.series:
+            plt.plot(x, y, marker="braille", label=label)
+        plt.xticks(ticks=prepared.ticks, labels=prepared.tick_labels)
         plt.show()
 
 
-# adapter for plotter
+# adapter for plotter: the plotted series and their labels
 @singledispatch
-def make_data_payload(weather_forecast: DailyWeatherForecast, params: list[str]) -> list[ndarray]:
-    # labels = params["daily"]
-    labels = [  # edit the labels list to select the displayed data among requested
-        "temperature_2m_max",
-        "temperature_2m_min",
-        "apparent_temperature_max",
-        "apparent_temperature_min"
-    ]
-    series = obj_properties_from_strings(weather_forecast, params["daily"])
-    return series, labels
+def make_data_payload(weather_forecast: DailyWeatherForecast) -> tuple[list[ndarray], list[str]]:
+    labels = list(PLOTTED_VARIABLES["daily"])
+    return obj_properties_from_strings(weather_forecast, labels), labels
 
 @make_data_payload.register(HourlyWeatherForecast)
-def _(weather_forecast: HourlyWeatherForecast, params: list[str]) -> list[ndarray]:
-    # labels = params["hourly"]
-    labels = [
-        "temperature_2m",
-        "apparent_temperature"
-    ]
-    series = obj_properties_from_strings(weather_forecast, params["hourly"])
-    return series, labels
+def _(weather_forecast: HourlyWeatherForecast) -> tuple[list[ndarray], list[str]]:
+    labels = list(PLOTTED_VARIABLES["hourly"])
+    return obj_properties_from_strings(weather_forecast, labels), labels
 
 def obj_properties_from_strings(obj, ls: list[str]) -> list[any]:
     """
@@ -1,6 +1,13 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
 import pytest
 import geocoder
 
+import my_weather_app
+from api_session import HourlyWeatherForecast
+from geocoder import ResolvedLocation
 from my_weather_app import MyWeatherApp, Plotter, make_data_payload
 
 
@@ -14,3 +21,150 @@ def test_get_hourly_weather():
     app = MyWeatherApp()
     weather = app.get_hourly_forecast()
     assert app.current_location.to_coords() == (weather.latitude, weather.longitude)
+
+class RecordingPlt:
+    """Stands in for `plotext`, remembers the calls."""
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+def test_plotter_labels_the_axis_once():
+    class Forecast:
+        time, time_end, interval = 1766145600, 1766145600 + 48 * 3600, 3600
+
+    plt = RecordingPlt()
+    Plotter(plt).draw(Forecast(), [list(range(48)), list(range(48))], ["a", "b"], "Warsaw", width=1000)
+    names = [name for name, _, _ in plt.calls]
+    assert names.count("plot") == 2
+    assert names.count("xticks") == 1
+    xticks = next(kwargs for name, _, kwargs in plt.calls if name == "xticks")
+    assert xticks["labels"][0] == "12:00 19/12" and len(xticks["labels"]) == 48
+
+def test_plotter_downsamples_to_the_canvas_width():
+    class Forecast:
+        time, time_end, interval = 1766145600, 1766145600 + 16 * 24 * 3600, 3600
+
+    plt = RecordingPlt()
+    series = np.sin(np.linspace(0, 20, 16 * 24))
+    Plotter(plt).draw(Forecast(), [series], ["a"], "Warsaw", width=100)
+    x, y = next(args for name, args, _ in plt.calls if name == "plot")
+    assert len(x) == 200 and x[0] == 0 and x[-1] == 16 * 24 - 1
+    assert y == series[x].tolist()
+    xticks = next(kwargs for name, _, kwargs in plt.calls if name == "xticks")
+    assert len(xticks["labels"]) * len("12:00 19/12 ") <= 100
+    assert xticks["labels"][0] == "12:00 19/12"
+
+def make_hourly_forecast(latitude=52.25, longitude=21.0):
+    values = pd.Series(np.linspace(-5, 5, 168))
+    columns = {"temperature_2m": values, "apparent_temperature": values, "relative_humidity_2m": values}
+    return HourlyWeatherForecast.from_columns(latitude, longitude, 100, 0, 1766145600, 1766145600 + 168 * 3600, 3600, columns)
+
+def test_render_cache_reuses_prepared_plots(monkeypatch):
+    app = MyWeatherApp()
+    forecast = make_hourly_forecast()
+    location = ResolvedLocation(52.25, 21.0, "Warsaw, Poland")
+    monkeypatch.setattr(app, "get_hourly_forecast", lambda location: forecast)
+    prepared_payloads = []
+    monkeypatch.setattr(
+        my_weather_app, "make_data_payload",
+        lambda *args: prepared_payloads.append(args) or make_data_payload(*args)
+    )
+
+    plt = RecordingPlt()
+    first = app.draw_hourly_plot(plt, location, width=100, height=30)
+    second = app.draw_hourly_plot(plt, location, width=100, height=30)
+    assert first is second and first.title == "Warsaw, Poland"
+    assert len(prepared_payloads) == 1
+    assert [name for name, _, _ in plt.calls].count("show") == 2   # replayed on the canvas both times
+
+    assert app.draw_hourly_plot(plt, location, width=60, height=30) is not first    # other canvas size
+    assert app.draw_hourly_plot(plt, location, width=100, height=20) is first       # the height isn't plotted
+    neighbour = ResolvedLocation(52.26, 21.01, "Warsaw Praga")     # same grid cell, same forecast
+    assert app.draw_hourly_plot(plt, neighbour, width=100, height=30).title == "Warsaw Praga"
+    monkeypatch.setattr(app, "get_hourly_forecast", lambda location: make_hourly_forecast())
+    assert app.draw_hourly_plot(plt, location, width=100, height=30) is not first   # refreshed forecast
+    assert len(prepared_payloads) == 4
+
+def collect_stale_while_revalidate(app, plt, location):
+    async def collect():
+        return [item async for item in app.draw_plot_stale_while_revalidate(plt, location, "hourly", width=100)]
+    return asyncio.run(collect())
+
+def test_stale_forecast_is_drawn_first_then_refreshed(monkeypatch):
+    app = MyWeatherApp()
+    location = ResolvedLocation(52.25, 21.0, "Warsaw, Poland")
+    stale, fresh = make_hourly_forecast(), make_hourly_forecast()
+    monkeypatch.setattr(app.api, "get_stale_forecast", lambda kind, lat, lon: (stale, 5 * 3600))
+    monkeypatch.setattr(app.api, "revalidate_forecast", lambda kind, lat, lon: fresh)
+
+    plt = RecordingPlt()
+    (outdated, age), (refreshed, fresh_age) = collect_stale_while_revalidate(app, plt, location)
+    assert age == 5 * 3600 and app.is_outdated(age)
+    assert fresh_age == 0 and outdated is not refreshed
+    assert [name for name, _, _ in plt.calls].count("show") == 2
+
+def test_plot_is_titled_with_its_own_location(monkeypatch):
+    app = MyWeatherApp()
+    warsaw, rome = ResolvedLocation(52.25, 21.0, "Warsaw, Poland"), ResolvedLocation(41.9, 12.5, "Rome, Italy")
+    monkeypatch.setattr(app.api, "get_stale_forecast", lambda kind, lat, lon: (make_hourly_forecast(lat, lon), 60))
+    async def to_thread(function, *args):   # both plots take turns at every step
+        await asyncio.sleep(0)
+        return function(*args)
+    monkeypatch.setattr(my_weather_app.asyncio, "to_thread", to_thread)
+
+    async def draw_both():
+        return await asyncio.gather(*(
+            anext(app.draw_plot_stale_while_revalidate(RecordingPlt(), location, "hourly", width=100))
+            for location in (warsaw, rome)
+        ))
+    (warsaw_plot, _), (rome_plot, _) = asyncio.run(draw_both())
+    assert warsaw_plot.title == "Warsaw, Poland" and rome_plot.title == "Rome, Italy"
+
+def test_fresh_forecast_is_not_refreshed(monkeypatch):
+    app = MyWeatherApp()
+    location = ResolvedLocation(52.25, 21.0, "Warsaw, Poland")
+    monkeypatch.setattr(app.api, "get_stale_forecast", lambda kind, lat, lon: (make_hourly_forecast(), 60))
+    monkeypatch.setattr(app.api, "revalidate_forecast", lambda kind, lat, lon: pytest.fail("fresh enough"))
+    assert len(collect_stale_while_revalidate(app, RecordingPlt(), location)) == 1
+
+def test_failed_refresh_keeps_the_stale_forecast(monkeypatch):
+    app = MyWeatherApp()
+    location = ResolvedLocation(52.25, 21.0, "Warsaw, Poland")
+    monkeypatch.setattr(app.api, "get_stale_forecast", lambda kind, lat, lon: (make_hourly_forecast(), 5 * 3600))
+    def offline(kind, lat, lon):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(app.api, "revalidate_forecast", offline)
+    assert len(collect_stale_while_revalidate(app, RecordingPlt(), location)) == 1
+
+def test_prefetch_batches_distinct_locations(monkeypatch):
+    app = MyWeatherApp()
+    batches = []
+
+    async def prefetch_many(coords, variables):
+        assert variables == {"hourly": None, "current": ["temperature_2m"]}   # plots and alert checks
+        batches.append(coords)
+
+    monkeypatch.setattr(app.async_api, "prefetch_many", prefetch_many)
+    locations = [
+        ResolvedLocation(52.25, 21.0, "Warsaw, Poland"),
+        ResolvedLocation(52.25, 21.0, "Warszawa"),    # same place, fetched once
+        ResolvedLocation(41.9, 12.5, "Rome, Italy"),
+        geocoder.Location(city_prompt="Zakopane"),   # from the gazetteer, no network
+    ]
+    assert asyncio.run(app.prefetch_forecasts(locations, max_concurrency=2)) == 3
+    assert len(batches) == 1 and batches[0][:2] == [(52.25, 21.0), (41.9, 12.5)]
+    with pytest.raises(ValueError):
+        asyncio.run(app.prefetch_forecasts(locations, max_concurrency=0))
+
+def test_close_closes_both_sessions(monkeypatch):
+    app = MyWeatherApp()
+    closed = []
+    monkeypatch.setattr(app.api, "close", lambda: closed.append("api"))
+    async def close_async():
+        closed.append("async_api")
+    monkeypatch.setattr(app.async_api, "close", close_async)
+    asyncio.run(app.close())
+    assert closed == ["api", "async_api"]
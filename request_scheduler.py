@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+# Nominatim usage policy: an absolute maximum of 1 request per second
+NOMINATIM_REQUESTS_PER_SECOND = 1.0
+
+
+class TokenBucket:
+    """
+    Rate limit: `rate` tokens per second, at most `capacity` of them saved up for a burst.
+    Every request takes one token. Tokens are reserved in order of arrival, so waiting callers are served fairly.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("Rate must be positive and capacity must hold at least one token.")
+        self.rate = rate
+        self.capacity = capacity
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__tokens = capacity
+        self.__updated_at = clock()
+        self.__lock = threading.Lock()
+
+    def __refill(self) -> None:
+        now = self.__clock()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now, never wait (e.g. to reject requests over the limit)."""
+        with self.__lock:
+            self.__refill()
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+    def acquire(self) -> float:
+        """Block until a token is available, return how long it took (in seconds)."""
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= 1  # may go below zero: the token is reserved for later
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+        if wait > 0:
+            self.__sleep(wait)
+        return wait
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller runs the function,
+    the others wait for its result (or exception).
+    """
+    def __init__(self):
+        self.__in_flight: dict[Hashable, Future] = {}
+        self.__lock = threading.Lock()
+        self.__tasks: set[asyncio.Task] = set()     # running `do_many_async()` executions, not to be garbage collected
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.__in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            return future.result()
+
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+        return future.result()
+
+    async def do_many_async(
+        self, keys: list[Hashable], function: Callable[[list[Hashable]], Awaitable[dict[Hashable, T]]]
+    ) -> dict[Hashable, T]:
+        """
+        `do()` for many keys at once and a coroutine function, waiting doesn't block the event loop.
+        The keys nobody runs yet are run together: `function(keys)` returns key -> result for them.
+        The others wait for the running executions, `do()` ones too. Cancelling the caller doesn't cancel
+        an execution the others wait for.
+        """
+        futures, led = {}, []
+        with self.__lock:
+            for key in dict.fromkeys(keys):
+                future = self.__in_flight.get(key)
+                if future is None:
+                    future = self.__in_flight[key] = Future()
+                    led.append(key)
+                else:
+                    self.coalesced += 1
+                futures[key] = future
+            if led:
+                self.calls += 1
+        if led:
+            task = asyncio.ensure_future(function(led))
+            self.__tasks.add(task)
+            task.add_done_callback(lambda task: self.__settle(task, {key: futures[key] for key in led}))
+        return {key: await asyncio.shield(asyncio.wrap_future(future)) for key, future in futures.items()}
+
+    def __settle(self, task: asyncio.Task, futures: dict[Hashable, Future]) -> None:
+        self.__tasks.discard(task)
+        for key, future in futures.items():
+            if task.cancelled():    # only when the event loop is closed
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            elif key not in task.result():
+                future.set_exception(KeyError(key))
+            else:
+                future.set_result(task.result()[key])
+        with self.__lock:
+            for key in futures:
+                del self.__in_flight[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.__in_flight)
+
+
+class RequestScheduler:
+    """
+    Requests to a rate limited service: identical concurrent requests are coalesced into one,
+    the distinct ones queue up for tokens of the bucket.
+    """
+    def __init__(self, rate: float = NOMINATIM_REQUESTS_PER_SECOND, capacity: float = 1.0, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(rate, capacity, clock, sleep)
+        self.single_flight = SingleFlight()
+        self.__lock = threading.Lock()
+        self.queue_depth = 0        # requests waiting for a token right now
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, key: Hashable, request: Callable[[], T]) -> T:
+        """Run `request` once a token is available, unless a request with the same key is running already."""
+        return self.single_flight.do(key, lambda: self.__throttled(request))
+
+    def __throttled(self, request: Callable[[], T]) -> T:
+        with self.__lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            wait = self.bucket.acquire()
+        finally:
+            with self.__lock:
+                self.queue_depth -= 1
+        with self.__lock:
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return request()
+
+    @property
+    def stats(self) -> dict[str, float]:
+        calls = self.single_flight.calls
+        return {
+            "requests": calls,
+            "coalesced": self.single_flight.coalesced,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "total_wait": self.total_wait,
+            "mean_wait": self.total_wait / calls if calls else 0.0,
+            "max_wait": self.max_wait,
+        }
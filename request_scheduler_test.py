@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import pytest
+
+from request_scheduler import RequestScheduler, SingleFlight, TokenBucket
+
+
+class FakeClock:
+    """Sleeping only moves the time forward."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_token_bucket_spaces_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=1, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+    clock.now += 5     # unused tokens are saved up only to the capacity
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+
+def test_token_bucket_try_acquire_never_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock, sleep=clock.sleep)
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+    clock.now += 0.5
+    assert bucket.try_acquire() is True
+    assert bucket.try_acquire() is False
+    assert clock.now == 0.5
+
+def test_token_bucket_validation():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "Warsaw"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("warszawa", slow_call)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("warszawa", slow_call))) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    while flight.coalesced < 4:
+        pass
+    release.set()
+    for thread in (leader, *followers):
+        thread.join(5)
+
+    assert results == ["Warsaw"] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert flight.in_flight == 0
+    assert flight.do("warszawa", lambda: "again") == "again"     # nothing is cached after the call
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+    with pytest.raises(RuntimeError):
+        flight.do("x", lambda: (_ for _ in ()).throw(RuntimeError("throttled")))
+    assert flight.in_flight == 0
+
+def test_single_flight_batches_asyncio_calls():
+    flight = SingleFlight()
+    batches = []
+
+    async def fetch(keys):
+        batches.append(keys)
+        await asyncio.sleep(0.1)
+        return {key: key.upper() for key in keys}
+
+    async def main():
+        first = asyncio.create_task(flight.do_many_async(["a", "b"], fetch))
+        await asyncio.sleep(0)  # "a" and "b" are running now
+        cancelled = asyncio.create_task(flight.do_many_async(["a"], fetch))
+        blocking = asyncio.to_thread(flight.do, "b", lambda: "not run")
+        second = flight.do_many_async(["b", "c"], fetch)
+        await asyncio.sleep(0)
+        cancelled.cancel()  # the others still get "a"
+        return await asyncio.gather(first, blocking, second)
+
+    assert asyncio.run(main()) == [{"a": "A", "b": "B"}, "B", {"b": "B", "c": "C"}]
+    assert batches == [["a", "b"], ["c"]]
+    assert flight.calls == 2 and flight.in_flight == 0
+
+def test_scheduler_stats():
+    clock = FakeClock()
+    scheduler = RequestScheduler(rate=1.0, clock=clock, sleep=clock.sleep)
+    assert [scheduler.submit(name, lambda: name.upper()) for name in ("a", "b", "c")] == ["A", "B", "C"]
+    stats = scheduler.stats
+    assert stats["requests"] == 3
+    assert stats["total_wait"] == pytest.approx(2.0)
+    assert stats["max_wait"] == pytest.approx(1.0)
+    assert stats["queue_depth"] == 0 and stats["max_queue_depth"] == 1
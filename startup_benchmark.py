@@ -0,0 +1,169 @@
+# Cold-start benchmark: import time of the modules, time to the first painted frame and peak memory.
+# Every measurement runs in a fresh interpreter (imports are cached within one), in an empty directory
+# (no database, no HTTP cache) and with networking disabled.
+#   python startup_benchmark.py --output startup.json [--baseline previous.json]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO = Path(__file__).parent
+MODULES = ["api_session", "helpers", "my_weather_app", "geocoder", "database_orm", "terminal_user_interface"]
+REPEAT = 5
+TOP_IMPORTS = 10    # slowest imports (by their own time) reported for every module
+
+# Prepended to every measured script: any attempt to reach the network fails at once
+NO_NETWORK = """
+import socket
+def _no_network(*args, **kwargs):
+    raise OSError("Networking is disabled in the benchmark.")
+socket.socket.connect = socket.socket.connect_ex = _no_network
+socket.create_connection = socket.getaddrinfo = _no_network
+"""
+
+IMPORT_SCRIPT = """
+import json, resource, time
+started_at = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started_at
+print(json.dumps({{"seconds": elapsed, "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+FIRST_FRAME_SCRIPT = """
+import asyncio, json, resource, time
+import terminal_user_interface
+
+async def main():
+    app = terminal_user_interface.app = terminal_user_interface.TerminalUserInterface()
+    async with app.run_test() as pilot:
+        while not hasattr(app, "startup_time"):
+            await pilot.pause(0.005)
+        await app.get_my_weather_app()
+        ready = time.perf_counter() - terminal_user_interface.STARTED_AT
+    return {
+        "first_frame_seconds": app.startup_time,
+        "background_ready_seconds": ready,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def run_script(script: str, *python_options: str) -> subprocess.CompletedProcess:
+    """Fresh interpreter with the repo on the path, in an empty temporary directory, without network."""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, "PYTHONPATH": str(REPO)}
+        result = subprocess.run(
+            [sys.executable, *python_options, "-c", NO_NETWORK + script],
+            cwd=directory, env=env, capture_output=True, text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark script failed:\n{result.stderr}")
+    return result
+
+
+def last_json_line(output: str) -> dict:
+    """Modules may print things on import, the result is the last line."""
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """
+    Lines of `python -X importtime`, slowest (by their own time) first.
+    Example: `import time:      2566 |     191852 |         numpy` -> `{"module": "numpy", "self_seconds": 0.002566, ...}`
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():   # the header
+            continue
+        imports.append({
+            "module": name.strip(),
+            "self_seconds": int(self_us) / 1e6,
+            "cumulative_seconds": int(cumulative_us) / 1e6,
+        })
+    return sorted(imports, key=lambda entry: entry["self_seconds"], reverse=True)
+
+
+def summarize(samples: list[float]) -> dict:
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples)}
+
+
+def measure_import(module: str, repeat: int = REPEAT) -> dict:
+    runs = [last_json_line(run_script(IMPORT_SCRIPT.format(module=module)).stdout) for _ in range(repeat)]
+    profile = run_script(f"import {module}", "-X", "importtime")
+    return {
+        "seconds": summarize([run["seconds"] for run in runs]),
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+        "slowest_imports": parse_importtime(profile.stderr)[:TOP_IMPORTS],
+    }
+
+
+def measure_first_frame(repeat: int = REPEAT) -> dict:
+    """Headless app: time from the start of the TUI's imports to the first frame and to `MyWeatherApp` being ready."""
+    runs = [last_json_line(run_script(FIRST_FRAME_SCRIPT).stdout) for _ in range(repeat)]
+    return {
+        "first_frame_seconds": summarize([run["first_frame_seconds"] for run in runs]),
+        "background_ready_seconds": summarize([run["background_ready_seconds"] for run in runs]),
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+    }
+
+
+def git_commit() -> str | None:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def run_benchmark(modules: list[str] = MODULES, repeat: int = REPEAT) -> dict:
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "imports": {module: measure_import(module, repeat) for module in modules},
+        "first_frame": measure_first_frame(repeat),
+    }
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """
+    Median times of both runs side by side.
+    Example: `terminal_user_interface import: 3.214s -> 0.512s (x0.16)`
+    """
+    pairs = [
+        (f"{module} import", baseline["imports"][module]["seconds"], result["seconds"])
+        for module, result in current["imports"].items() if module in baseline.get("imports", {})
+    ]
+    if "first_frame" in baseline:
+        for key in ("first_frame_seconds", "background_ready_seconds"):
+            pairs.append((key.removesuffix("_seconds").replace("_", " "), baseline["first_frame"][key], current["first_frame"][key]))
+    lines = []
+    for name, old, new in pairs:
+        ratio = new["median"] / old["median"] if old["median"] else float("inf")
+        lines.append(f"{name}: {old['median']:.3f}s -> {new['median']:.3f}s (x{ratio:.2f})")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time, time to the first frame and peak RSS of the app.")
+    parser.add_argument("--output", type=Path, help="where to write the results (JSON), stdout if not given")
+    parser.add_argument("--baseline", type=Path, help="results of an earlier run to compare with")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.modules, args.repeat)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline:
+        print("\n".join(compare(json.loads(args.baseline.read_text()), results)), file=sys.stderr)
@@ -0,0 +1,39 @@
+import pytest
+
+from startup_benchmark import compare, measure_import, parse_importtime, run_script
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:      1519 |     141618 |               numpy._core
+import time:      2566 |     191852 |         numpy
+import time:     12902 |     218478 |     geocoder
+"""
+
+
+def test_parse_importtime():
+    imports = parse_importtime(IMPORTTIME_OUTPUT)
+    assert [entry["module"] for entry in imports] == ["geocoder", "numpy", "numpy._core"]
+    assert imports[0] == {"module": "geocoder", "self_seconds": 0.012902, "cumulative_seconds": 0.218478}
+
+
+def test_network_is_disabled():
+    with pytest.raises(RuntimeError, match="Networking is disabled"):
+        run_script("import socket; socket.create_connection(('example.com', 80))")
+
+
+def test_measure_import():
+    result = measure_import("database_orm", repeat=1)
+    assert 0 < result["seconds"]["min"] <= result["seconds"]["median"] <= result["seconds"]["max"]
+    assert result["peak_rss_kb"] > 0
+    assert any(entry["module"] == "peewee" for entry in result["slowest_imports"])
+
+
+def test_compare():
+    def results(seconds):
+        timing = {"median": seconds, "min": seconds, "max": seconds}
+        return {"imports": {"helpers": {"seconds": timing}}, "first_frame": {"first_frame_seconds": timing, "background_ready_seconds": timing}}
+
+    assert compare(results(2.0), results(0.5)) == [
+        "helpers import: 2.000s -> 0.500s (x0.25)",
+        "first frame: 2.000s -> 0.500s (x0.25)",
+        "background ready: 2.000s -> 0.500s (x0.25)",
+    ]
@@ -0,0 +1,437 @@
+# Local stand-in for the Open-Meteo forecast API and Nominatim: benchmarks and load tests run against it offline.
+#   python stub_server.py --port 8080 --latency 0.05 --error-rate 0.01 --rate-limit 10
+#   OPEN_METEO_URL=http://127.0.0.1:8080 NOMINATIM_URL=http://127.0.0.1:8080 python terminal_user_interface.py
+# Forecasts are recorded responses (`--fixtures`, see `--record`) or synthetic ones, made up for any place,
+# encoded as size-prefixed flatbuffers exactly like Open-Meteo does. Geocoding is answered from the gazetteer.
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import flatbuffers
+import numpy as np
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+
+from forecast_cache import to_grid_cell
+from forecast_schema import parse_variable
+from request_scheduler import TokenBucket
+
+FORECAST_DAYS = 7
+CURRENT_INTERVAL_SECONDS = 15 * 60
+UNITS = {
+    Variable.temperature: Unit.celsius,
+    Variable.apparent_temperature: Unit.celsius,
+    Variable.relative_humidity: Unit.percentage,
+    Variable.cloud_cover: Unit.percentage,
+    Variable.wind_speed: Unit.kilometres_per_hour,
+    Variable.wind_direction: Unit.degree_direction,
+    Variable.precipitation: Unit.millimetre,
+    Variable.precipitation_hours: Unit.hours,
+    Variable.surface_pressure: Unit.hectopascal,
+    Variable.daylight_duration: Unit.seconds,
+    Variable.sunrise: Unit.unix_time,
+    Variable.sunset: Unit.unix_time,
+    Variable.is_day: Unit.dimensionless_integer,
+}
+INT64_VARIABLES = {Variable.sunrise, Variable.sunset}
+
+
+def synthetic_values(variable: int, times: np.ndarray, latitude: float, utc_offset: int) -> np.ndarray:
+    """
+    Made-up but plausible values at unix `times`: daily cycles, a few days long weather changes,
+    colder towards the poles. The same place and time always gets the same value.
+    """
+    local_hours = ((times + utc_offset) % 86400) / 3600
+    daily = np.sin(2 * np.pi * (local_hours - 9) / 24)      # warmest in the afternoon
+    weather = np.sin(2 * np.pi * times / (4.3 * 86400) + latitude)
+    temperature = 22 - 0.4 * abs(latitude) + 6 * daily + 4 * weather
+    if variable == Variable.temperature:
+        return temperature
+    if variable == Variable.apparent_temperature:
+        return temperature - 2 + 1.5 * weather
+    if variable == Variable.relative_humidity:
+        return np.clip(65 - 20 * daily + 10 * weather, 0, 100)
+    if variable == Variable.cloud_cover:
+        return np.clip(50 + 45 * weather, 0, 100)
+    if variable == Variable.wind_speed:
+        return 12 + 6 * weather + 3 * daily
+    if variable == Variable.wind_direction:
+        return (times / 3600 * 7) % 360
+    if variable == Variable.precipitation:
+        return np.maximum(0, 3 * weather - 1.5)
+    if variable == Variable.surface_pressure:
+        return 1013 - 8 * weather
+    if variable == Variable.is_day:
+        return ((local_hours >= 6) & (local_hours < 18)).astype(np.float64)
+    return np.zeros(len(times))
+
+
+def daily_values(variable: int, aggregation: int, days: np.ndarray, latitude: float, utc_offset: int) -> np.ndarray:
+    """One value per (local) day starting at `days`, aggregated from the synthetic hourly values."""
+    if variable == Variable.sunrise:
+        return days + 6 * 3600
+    if variable == Variable.sunset:
+        return days + 18 * 3600
+    if variable == Variable.daylight_duration:
+        return np.full(len(days), 12 * 3600 + 60 * latitude)
+    hours = (days[:, None] + np.arange(24) * 3600).ravel()
+    if variable == Variable.precipitation_hours:
+        return (synthetic_values(Variable.precipitation, hours, latitude, utc_offset) > 0).reshape(-1, 24).sum(axis=1)
+    hourly = synthetic_values(variable, hours, latitude, utc_offset).reshape(-1, 24)
+    if aggregation == Aggregation.minimum:
+        return hourly.min(axis=1)
+    if aggregation == Aggregation.sum:
+        return hourly.sum(axis=1)
+    if aggregation == Aggregation.maximum:
+        return hourly.max(axis=1)
+    return hourly.mean(axis=1)
+
+
+def build_variable(builder: flatbuffers.Builder, name: str, values: np.ndarray | float) -> int:
+    key = parse_variable(name)
+    variable = key.variable
+    if np.ndim(values):
+        is_int64 = variable in INT64_VARIABLES
+        vector = builder.CreateNumpyVector(np.asarray(values, dtype=np.int64 if is_int64 else np.float32))
+    builder.StartObject(10)
+    builder.PrependUint8Slot(0, variable, 0)
+    builder.PrependUint8Slot(1, UNITS.get(variable, Unit.undefined), 0)
+    if not np.ndim(values):
+        builder.PrependFloat32Slot(2, float(values), 0.0)
+    else:
+        builder.PrependUOffsetTRelativeSlot(4 if is_int64 else 3, vector, 0)
+    builder.PrependInt16Slot(5, key.altitude, 0)
+    builder.PrependUint8Slot(6, key.aggregation, 0)
+    builder.PrependInt16Slot(7, key.pressure_level, 0)
+    builder.PrependInt16Slot(8, key.depth, 0)
+    builder.PrependInt16Slot(9, key.depth_to, 0)
+    return builder.EndObject()
+
+
+def build_variables_with_time(
+    builder: flatbuffers.Builder, start: int, end: int, interval: int, variables: list[tuple[str, np.ndarray | float]]
+) -> int:
+    offsets = [build_variable(builder, name, values) for name, values in variables]
+    builder.StartVector(4, len(offsets), 4)
+    for offset in reversed(offsets):
+        builder.PrependUOffsetTRelative(offset)
+    vector = builder.EndVector()
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, end, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+    return builder.EndObject()
+
+
+def encode_forecast(
+    latitude: float,
+    longitude: float,
+    current: list[str] = (),
+    hourly: list[str] = (),
+    daily: list[str] = (),
+    forecast_days: int = FORECAST_DAYS,
+    auto_timezone: bool = True,
+    now: float = None,
+) -> bytes:
+    """
+    One synthetic forecast as a size-prefixed `WeatherApiResponse` message, what Open-Meteo sends per location.
+    Variables are in the requested order, like the app's factories expect.
+    """
+    now = int(time.time() if now is None else now)
+    utc_offset = round(longitude / 15) * 3600 if auto_timezone else 0
+    first_day = (now + utc_offset) // 86400 * 86400 - utc_offset     # local midnight, in unix time
+    end = first_day + forecast_days * 86400
+
+    builder = flatbuffers.Builder(1024)
+    blocks = {}
+    if current:
+        current_time = now // CURRENT_INTERVAL_SECONDS * CURRENT_INTERVAL_SECONDS
+        times = np.array([current_time])
+        variables = [(name, float(synthetic_values(parse_variable(name)[0], times, latitude, utc_offset)[0])) for name in current]
+        blocks[9] = build_variables_with_time(builder, current_time, current_time + CURRENT_INTERVAL_SECONDS, CURRENT_INTERVAL_SECONDS, variables)
+    if daily:
+        days = np.arange(first_day, end, 86400)
+        variables = []
+        for name in daily:
+            key = parse_variable(name)
+            variables.append((name, daily_values(key.variable, key.aggregation, days, latitude, utc_offset)))
+        blocks[10] = build_variables_with_time(builder, first_day, end, 86400, variables)
+    if hourly:
+        hours = np.arange(first_day, end, 3600)
+        variables = [(name, synthetic_values(parse_variable(name)[0], hours, latitude, utc_offset)) for name in hourly]
+        blocks[11] = build_variables_with_time(builder, first_day, end, 3600, variables)
+    timezone = builder.CreateString("GMT" if not utc_offset else f"Etc/GMT{-utc_offset // 3600:+d}")
+    abbreviation = builder.CreateString("GMT" if not utc_offset else f"GMT{utc_offset // 3600:+d}")
+
+    builder.StartObject(13)
+    builder.PrependFloat32Slot(0, latitude, 0.0)
+    builder.PrependFloat32Slot(1, longitude, 0.0)
+    builder.PrependFloat32Slot(2, 100.0, 0.0)   # elevation
+    builder.PrependFloat32Slot(3, 0.5, 0.0)     # generation time
+    builder.PrependInt32Slot(6, utc_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(7, timezone, 0)
+    builder.PrependUOffsetTRelativeSlot(8, abbreviation, 0)
+    for slot, block in blocks.items():
+        builder.PrependUOffsetTRelativeSlot(slot, block, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def fixture_path(fixtures_dir: Path, latitude: float, longitude: float) -> Path:
+    """One fixture per grid cell: the app asks for the cell's coords, not the ones a fixture was recorded for."""
+    latitude, longitude = to_grid_cell(latitude, longitude)
+    return Path(fixtures_dir) / f"forecast_{latitude:.4f}_{longitude:.4f}.bin"
+
+
+def record_fixture(latitude: float, longitude: float, fixtures_dir: Path, base_url: str = None) -> Path:
+    """
+    Save Open-Meteo's real response for the grid cell of the coords (with the app's params),
+    to be served by the stub later. `base_url` is Open-Meteo's server by default.
+    """
+    import niquests
+
+    from api_session import BaseApiSession
+
+    latitude, longitude = to_grid_cell(latitude, longitude)
+    session = BaseApiSession(latitude, longitude) if base_url is None else BaseApiSession(latitude, longitude, base_url=base_url)
+    params = {**session.params, "latitude": latitude, "longitude": longitude, "format": "flatbuffers"}
+    response = niquests.get(session._url, params=params)
+    response.raise_for_status()
+    path = fixture_path(fixtures_dir, latitude, longitude)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(response.content)
+    return path
+
+
+class StubServer:
+    """
+    Open-Meteo's `/v1/forecast` and Nominatim's `/search` and `/reverse` on a local port, in a background thread.
+    Every request waits `latency` (+ up to `jitter`) seconds, fails with 500 at `error_rate`
+    and gets 429 above `rate_limit` requests per second (no limit if None).
+    """
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float | None = None,
+        fixtures_dir: Path = None,
+        seed: int = None,
+    ):
+        if latency < 0 or jitter < 0 or not 0 <= error_rate <= 1:
+            raise ValueError("Latency and jitter can't be negative, error rate must be between 0 and 1.")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit, capacity=max(1.0, rate_limit)) if rate_limit else None
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir else None
+        self.random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.requests: dict[str, int] = {}   # path -> count
+        self.errors = 0
+        self.throttled = 0
+        self.connections: set[socket.socket] = set()    # open keep-alive connections, closed by stop()
+
+        handler = type("Handler", (StubRequestHandler,), {"stub": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        load_gazetteer()   # takes a moment, geocoding requests would time out waiting for it
+        self.__thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stopped is unreachable: connections kept alive by the clients are closed as well."""
+        self.server.shutdown()
+        self.server.server_close()
+        with self.__lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:     # closed by the client meanwhile
+                pass
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def track(self, connection: socket.socket, is_open: bool) -> None:
+        with self.__lock:
+            if is_open:
+                self.connections.add(connection)
+            else:
+                self.connections.discard(connection)
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @property
+    def stats(self) -> dict:
+        with self.__lock:
+            return {"requests": dict(self.requests), "errors": self.errors, "throttled": self.throttled}
+
+    def admit(self, path: str) -> int | None:
+        """Simulated network and server trouble: status code to fail the request with, None to serve it."""
+        with self.__lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if self.bucket is not None and not self.bucket.try_acquire():
+            with self.__lock:
+                self.throttled += 1
+            return 429
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.__lock:
+                self.errors += 1
+            return 500
+        return None
+
+    def forecast(self, query: dict[str, list[str]]) -> bytes:
+        """Body for `/v1/forecast`, one message per location (comma separated lists of coords)."""
+        def values(name: str) -> list[str]:
+            return [value for item in query.get(name, []) for value in item.split(",") if value]
+
+        if values("format") != ["flatbuffers"]:
+            raise ValueError("Only format=flatbuffers is supported.")
+        latitudes, longitudes = list(map(float, values("latitude"))), list(map(float, values("longitude")))
+        if not latitudes or len(latitudes) != len(longitudes):
+            raise ValueError("Parameter 'latitude' and 'longitude' must have the same number of elements")
+        forecast_days = int(values("forecast_days")[0]) if values("forecast_days") else FORECAST_DAYS
+        body = b""
+        for latitude, longitude in zip(latitudes, longitudes):
+            if self.fixtures_dir and (path := fixture_path(self.fixtures_dir, latitude, longitude)).exists():
+                body += path.read_bytes()
+                continue
+            body += encode_forecast(
+                latitude, longitude, values("current"), values("hourly"), values("daily"),
+                forecast_days, auto_timezone=values("timezone") == ["auto"],
+            )
+        return body
+
+    @staticmethod
+    def search(query: dict[str, list[str]]) -> list[dict]:
+        """Nominatim's forward geocoding, for the cities of the gazetteer."""
+        gazetteer = load_gazetteer()
+        index = gazetteer.lookup(query.get("q", [""])[0])
+        if index is None:
+            return []
+        return [nominatim_place(gazetteer, index)]
+
+    @staticmethod
+    def reverse(query: dict[str, list[str]]) -> dict:
+        """Nominatim's reverse geocoding: the nearest city of the gazetteer, however far it is."""
+        gazetteer = load_gazetteer()
+        index, _ = gazetteer.nearest(float(query["lat"][0]), float(query["lon"][0]))
+        return nominatim_place(gazetteer, index)
+
+
+def load_gazetteer():
+    from gazetteer import Gazetteer
+
+    gazetteer = Gazetteer.shared()
+    gazetteer.prefix_index  # built on first use too
+    return gazetteer
+
+
+def nominatim_place(gazetteer, index: int) -> dict:
+    latitude, longitude = gazetteer.coords(index)
+    return {
+        "place_id": index,
+        "lat": str(latitude),
+        "lon": str(longitude),
+        "display_name": gazetteer.display_name(index),
+        "address": {"city": gazetteer.names[index], "country": gazetteer.countries[index]},
+    }
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    stub: StubServer = None
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real servers
+
+    def setup(self) -> None:
+        super().setup()
+        self.stub.track(self.connection, is_open=True)
+
+    def finish(self) -> None:
+        self.stub.track(self.connection, is_open=False)
+        super().finish()
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        status = self.stub.admit(url.path)
+        if status == 429:
+            return self.send_json(429, {"error": True, "reason": "Too many concurrent requests"})
+        if status is not None:
+            return self.send_json(status, {"error": True, "reason": "Internal server error"})
+        try:
+            if url.path == "/v1/forecast":
+                return self.send(200, self.stub.forecast(query), "application/octet-stream")
+            if url.path == "/search":
+                return self.send_json(200, self.stub.search(query))
+            if url.path == "/reverse":
+                return self.send_json(200, self.stub.reverse(query))
+        except (ValueError, KeyError) as e:
+            return self.send_json(400, {"error": True, "reason": str(e)})
+        self.send_json(404, {"error": True, "reason": f"Unknown endpoint {url.path}"})
+
+    def send_json(self, status: int, body) -> None:
+        self.send(status, json.dumps(body).encode(), "application/json")
+
+    def send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass    # thousands of requests in a load test
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Open-Meteo forecast API and Nominatim.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to that many seconds more, at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second, 429 above that")
+    parser.add_argument("--fixtures", type=Path, default=None, help="directory with recorded forecasts")
+    parser.add_argument("--record", type=float, nargs=2, metavar=("LAT", "LON"),
+                        help="save Open-Meteo's real forecast for the coords into --fixtures and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        if args.fixtures is None:
+            parser.error("--record needs --fixtures")
+        print(record_fixture(*args.record, args.fixtures))
+    else:
+        stub = StubServer(args.host, args.port, args.latency, args.jitter, args.error_rate, args.rate_limit, args.fixtures)
+        load_gazetteer()
+        print(f"Serving on {stub.url}")
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            stub.server.server_close()
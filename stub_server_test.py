@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+import niquests
+import pytest
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+import api_session
+from api_session import ApiSession, AsyncApiSession
+from forecast_cache import ForecastCache
+from geocoder import Geocoder
+from request_scheduler import RequestScheduler, SingleFlight
+from stub_server import StubServer, encode_forecast, fixture_path, parse_variable, record_fixture
+
+
+class NoPersistentCache:
+    def get_coords(self, city_name):
+        return None
+
+    def get_city_name(self, latitude, longitude):
+        return None
+
+    def save_coords(self, city_name, coords):
+        pass
+
+    def save_city_name(self, coords, city_name):
+        pass
+
+
+@pytest.fixture
+def stub():
+    with StubServer(seed=0) as server:
+        yield server
+
+
+@pytest.fixture
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)    # the HTTP cache of ApiSession is created in the working directory
+
+
+def test_parse_variable():
+    assert parse_variable("temperature_2m_max")[:3] == (Variable.temperature, 2, Aggregation.maximum)
+    assert parse_variable("wind_speed_10m")[:3] == (Variable.wind_speed, 10, Aggregation.none)
+    assert parse_variable("precipitation_hours")[:3] == (Variable.precipitation_hours, 0, Aggregation.none)
+    assert parse_variable("precipitation_sum")[:3] == (Variable.precipitation, 0, Aggregation.sum)
+    with pytest.raises(ValueError):
+        parse_variable("temperature_2m_max_sum")
+
+def test_encoded_forecast_is_what_open_meteo_sends():
+    message = encode_forecast(52.25, 21.0, hourly=["temperature_2m", "relative_humidity_2m"], daily=["sunrise"], now=1_766_000_000)
+    assert int.from_bytes(message[:4], "little") == len(message) - 4
+    response = WeatherApiResponse.GetRootAs(message, 4)
+    assert response.Latitude() == pytest.approx(52.25)
+    assert response.UtcOffsetSeconds() == 3600
+
+    hourly = response.Hourly()
+    assert (hourly.TimeEnd() - hourly.Time()) // hourly.Interval() == 7 * 24
+    assert hourly.VariablesLength() == 2
+    humidity = hourly.Variables(1)
+    assert (humidity.Variable(), humidity.Altitude()) == (Variable.relative_humidity, 2)
+    assert len(humidity.ValuesAsNumpy()) == 7 * 24
+    assert response.Daily().Variables(0).ValuesInt64AsNumpy()[0] == response.Daily().Time() + 6 * 3600
+    assert response.Current() is None
+
+def test_api_session_against_stub(stub, in_tmp_path):
+    session = ApiSession(52.2297, 21.0122, base_url=stub.url)
+    session._make_api_call()    # every section
+    hourly = session.get_hourly_forecast()
+    daily = session.get_daily_forecast()
+    current = session.get_current_weather()
+    assert hourly.latitude == pytest.approx(52.25)
+    assert len(hourly.temperature_2m) == 7 * 24
+    assert len(daily.sunset) == 7
+    assert 0 <= current.relative_humidity_2m <= 100
+    assert stub.stats["requests"] == {"/v1/forecast": 1}     # one response, parsed three ways
+
+    forecasts = session.get_hourly_forecast_many([(41.8919, 12.5113), (48.8566, 2.3522)])
+    assert [forecast.latitude for forecast in forecasts] == pytest.approx([41.9, 48.85])
+    assert stub.stats["requests"] == {"/v1/forecast": 2}     # both in one batched request
+
+def test_only_selected_variables_are_fetched(stub, in_tmp_path):
+    session = ApiSession(52.2297, 21.0122, base_url=stub.url)
+    alert_check = session.get_current_weather(variables=["temperature_2m"])
+    assert alert_check.temperature_2m is not None and alert_check.relative_humidity_2m is None
+    assert stub.stats["requests"] == {"/v1/forecast": 1}
+
+    current = session.get_current_weather()     # more variables than cached
+    assert current.relative_humidity_2m is not None
+    assert session.get_current_weather(variables=["relative_humidity_2m", "temperature_2m"]) is current
+    assert stub.stats["requests"] == {"/v1/forecast": 2}     # the larger response answers the smaller call
+
+    hourly = session.get_hourly_forecast(variables=["apparent_temperature"])
+    assert hourly.temperature_2m is None and len(hourly.apparent_temperature) == 7 * 24
+    assert stub.stats["requests"] == {"/v1/forecast": 3}
+
+def test_sync_and_async_loads_of_a_cell_share_one_request(in_tmp_path):
+    cache, single_flight = ForecastCache(), SingleFlight()
+    with StubServer(latency=0.3) as server:
+        api = ApiSession(52.2297, 21.0122, forecast_cache=cache, base_url=server.url, single_flight=single_flight)
+        async_api = AsyncApiSession(52.2297, 21.0122, forecast_cache=cache, base_url=server.url, single_flight=single_flight)
+
+        async def load_everywhere():   # the alert check, the prefetch and the plot screen, at once
+            try:
+                return await asyncio.gather(
+                    async_api.get_hourly_forecast(),
+                    async_api.prefetch_many([(52.2297, 21.0122)], {"hourly": None}),
+                    asyncio.to_thread(api.get_hourly_forecast),
+                    asyncio.to_thread(api.revalidate_forecast, "hourly"),
+                )
+            finally:
+                await async_api.close()
+
+        hourly, _, sync_hourly, revalidated = asyncio.run(load_everywhere())
+    assert hourly is sync_hourly is revalidated
+    assert server.stats["requests"] == {"/v1/forecast": 1}
+    assert api.cache_stats["fetches"] == 1 and api.cache_stats["coalesced"] == 3
+
+def test_stale_forecast_from_http_cache(stub, in_tmp_path):
+    ApiSession(52.2297, 21.0122, base_url=stub.url).get_hourly_forecast()
+    restarted = ApiSession(52.2297, 21.0122, base_url=stub.url)  # nothing in memory
+    forecast, age = restarted.get_stale_forecast("hourly")
+    assert len(forecast.temperature_2m) == 7 * 24
+    assert 0 <= age < 60
+    assert stub.stats["requests"] == {"/v1/forecast": 1}
+    assert restarted.get_stale_forecast("hourly", 41.8919, 12.5113) is None     # never fetched
+
+def test_revalidation_fails_with_the_server_down(in_tmp_path, monkeypatch):
+    monkeypatch.setattr(api_session, "RETRIES", 0)
+    with StubServer() as server:
+        session = ApiSession(52.2297, 21.0122, base_url=server.url)
+        session.revalidate_forecast("hourly")
+    with pytest.raises(OpenMeteoRequestsError):     # not the cached one passed off as fresh
+        session.revalidate_forecast("hourly")
+
+def test_expired_response_served_on_error_keeps_its_age(in_tmp_path, monkeypatch):
+    monkeypatch.setattr(api_session, "RETRIES", 0)
+    monkeypatch.setattr(api_session, "FORECAST_TTL_SECONDS", 1)    # of the HTTP cache
+    with StubServer() as server:
+        ApiSession(52.2297, 21.0122, base_url=server.url).get_hourly_forecast()
+    time.sleep(1.1)
+    restarted = ApiSession(52.2297, 21.0122, forecast_cache=ForecastCache(ttl=1), base_url=server.url)
+    assert len(restarted.get_hourly_forecast().temperature_2m) == 7 * 24   # stale_if_error
+    forecast, age = restarted.get_stale_forecast("hourly")
+    assert age >= 1     # outdated in memory too, the next call tries the network again
+
+def test_recorded_fixtures_are_served(tmp_path, in_tmp_path):
+    recorded = encode_forecast(52.25, 21.0, hourly=["temperature_2m"], now=1_766_000_000)
+    fixture_path(tmp_path, 52.25, 21.0).write_bytes(recorded)
+    with StubServer(fixtures_dir=tmp_path) as server:
+        response = niquests.get(f"{server.url}/v1/forecast", params={"latitude": 52.25, "longitude": 21.0, "format": "flatbuffers"})
+    assert response.content == recorded
+
+def test_recorded_fixture_is_served_to_api_session(stub, tmp_path, in_tmp_path, monkeypatch):
+    record_fixture(52.2297, 21.0122, tmp_path / "fixtures", base_url=stub.url)     # recorded for Warsaw's cell
+    monkeypatch.setattr("stub_server.encode_forecast", lambda *args, **kwargs: pytest.fail("not the fixture"))
+    with StubServer(fixtures_dir=tmp_path / "fixtures") as server:
+        session = ApiSession(52.2297, 21.0122, base_url=server.url)
+        assert len(session.get_hourly_forecast().temperature_2m) == 7 * 24
+
+def test_stopped_server_is_unreachable():
+    session = niquests.Session()
+    with StubServer() as server:
+        assert session.get(f"{server.url}/search", params={"q": "Warszawa"}).status_code == 200
+    with pytest.raises(niquests.exceptions.ConnectionError):    # not even over the kept-alive connection
+        session.get(f"{server.url}/search", params={"q": "Warszawa"})
+    assert server.stats["requests"] == {"/search": 1}
+
+def test_geocoder_against_stub(stub):
+    geocoder = Geocoder(NoPersistentCache(), offline=False, scheduler=RequestScheduler(rate=1000.0), nominatim_url=stub.url)
+    latitude, longitude = geocoder.convert_city_name_to_coords("Kraków")
+    assert (latitude, longitude) == pytest.approx((50.06, 19.94), abs=0.01)
+    assert geocoder.convert_coords_to_city_name(50.06, 19.94) == "Kraków, Poland"
+    assert geocoder.convert_city_name_to_coords("Wólka Kosowska") is None   # not a city
+    assert stub.stats["requests"] == {"/search": 2, "/reverse": 1}
+
+def test_latency_errors_and_throttling(in_tmp_path):
+    with StubServer(latency=0.1) as server:
+        started_at = time.perf_counter()
+        assert niquests.get(f"{server.url}/search", params={"q": "Warszawa"}).status_code == 200
+        assert time.perf_counter() - started_at >= 0.1
+
+    with StubServer(error_rate=1.0) as server:
+        assert niquests.get(f"{server.url}/search", params={"q": "Warszawa"}).status_code == 500
+        assert server.stats["errors"] == 1
+
+    with StubServer(rate_limit=1) as server:
+        session = ApiSession(52.2297, 21.0122, base_url=server.url)
+        session.get_hourly_forecast()
+        with pytest.raises(OpenMeteoRequestsError, match="Too many"):
+            session.get_hourly_forecast(41.8919, 12.5113)
+        assert server.stats["throttled"] == 1
@@ -1,14 +1,20 @@
+import time
+
+STARTED_AT = time.perf_counter()    # before the imports, they are most of the start-up time
+
 import asyncio
 import logging
+from typing import TYPE_CHECKING
 
 logging.getLogger(__name__)
-import peewee as pw
 from textual import on, work
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Center, Grid, HorizontalGroup, VerticalScroll
 from textual.events import ScreenResume, ScreenSuspend
 from textual.screen import ModalScreen, Screen
+from textual.suggester import Suggester
+from textual.worker import WorkerCancelled, WorkerFailed
 from textual.widgets import (
     DataTable,
     Footer,
@@ -23,9 +29,19 @@ from textual.widgets import (
 )
 from textual_plotext import PlotextPlot
 
-from database_orm import DATABASE_FILENAME, Alert
-from geocoder import Location
-from my_weather_app import MyWeatherApp
+from alert_engine import AlertEngine, TemperatureAlert
+from database_orm import Alert, db, initialize_db
+from database_storage_manager import alert_to_location
+from geocoder import Geocoder, Location
+from forecast_cache import ForecastCache
+from tracing import TRACE_FILE, tracer
+
+if TYPE_CHECKING:   # pandas, openmeteo_requests, requests_cache... are imported in the background, after mount
+    from my_weather_app import MyWeatherApp, PreparedPlot
+
+# The main screen should be there well before that (seconds since the start of the imports)
+STARTUP_BUDGET_SECONDS = 0.8
+CANVAS_CACHE_MAX_ENTRIES = 16
 
 
 class MainScreen(Screen):
@@ -38,31 +54,74 @@ class MainScreen(Screen):
 
     @on(ScreenResume)
     def check_alert_on_resume(self):
-        self.screen.query_one("#alerts_label", Label).update("")
         self.check_alerts()
 
+    @on(ScreenSuspend)
+    def stop_prefetching(self):
+        """Whatever the user went to see must not wait behind the warm-up."""
+        self.prefetch_worker.cancel()
+
     def on_mount(self):
-        self.screen.query_one("#alert_triggered_label", Label).display = False
+        self.alert_engine = None
+        self.prefetch_worker = self.prefetch_forecasts()
         self.check_alerts()
 
-    def check_alerts(self):
-        for alert in list(Alert.select()):
-            self.check_alert_for_city(alert.city_name, alert.min_temp, alert.max_temp)
-
-    def check_alert_for_city(self, city: str, min_temp: float, max_temp: float):
-        location = Location(city_prompt=city)       # bottleneck to remove
-        current_weather = app.my_weather_app.get_current_weather(location)
-        current_temp = current_weather.temperature_2m
+    @work(exclusive=True, group="prefetch")
+    async def prefetch_forecasts(self):
+        """Favourites and alert cities (all in the `Alert` table) are fetched in batches, to be shown from memory."""
+        locations = list(map(alert_to_location, Alert.select()))
+        weather_app = await app.get_my_weather_app()
+        try:
+            prefetched = await weather_app.prefetch_forecasts(locations)
+        except Exception as e:  # only an optimization, every screen can fetch what it needs by itself
+            logging.warning(f"Couldn't prefetch forecasts: {e}")
+            return
+        logging.info(f"Prefetched forecasts for {prefetched} locations")
+
+    @work(exclusive=True, group="alerts")
+    async def check_alerts(self):
+        """Results are streamed into the label as soon as the weather for their city arrives."""
+        try:    # alert cities are prefetched in batches, let that finish instead of asking for them one by one
+            # shielded: cancelling this worker (e.g. the next check) would cancel the awaited one as well
+            await asyncio.shield(self.prefetch_worker.wait())
+        except (WorkerCancelled, WorkerFailed):
+            pass
+        if self.alert_engine is None:
+            self.alert_engine = AlertEngine((await app.get_my_weather_app()).async_api)
         alerts_label = self.screen.query_one("#alerts_label", Label)
         alert_triggered_label = self.screen.query_one("#alert_triggered_label", Label)
-        label_text = alerts_label.content
-        if current_temp < min_temp:
-            label_text += f"The temperature for {location.city_name} has dropped below {min_temp}°C\n"
-            alert_triggered_label.display = True
-        if current_temp > max_temp:
+        alerts_label.update("")
+        alert_triggered_label.display = False
+
+        alerts = [
+            TemperatureAlert(alert.city_name, alert.min_temp, alert.max_temp, alert.latitude, alert.longitude)
+            for alert in Alert.select()
+        ]
+        label_text = ""
+        async for result in self.alert_engine.evaluate(alerts):
+            if not result.alert.is_located:  # geocoded for the first (and last) time, store it
+                Alert.update(latitude=result.latitude, longitude=result.longitude).where(
+                    Alert.city_name == result.alert.city_name
+                ).execute()
+            if not result.triggered:
+                continue
+            label_text += "".join(f"{message}\n" for message in result.messages)
             alert_triggered_label.display = True
-            label_text += f"The temperature for {location.city_name} has raised above {max_temp}°C\n"
-        alerts_label.update(label_text)
+            alerts_label.update(label_text)
+
+
+def suggest_cities(prefix: str) -> list[str]:
+    """Off the event loop: the first call loads the gazetteer and builds its index."""
+    return Geocoder.shared().suggest(prefix)
+
+
+class CitySuggester(Suggester):
+    """Completes the name of a city from the bundled gazetteer, the most populous match first."""
+    async def get_suggestion(self, value: str) -> str | None:
+        for city_name in await asyncio.to_thread(suggest_cities, value):
+            if city_name.casefold().startswith(value):  # Input can only complete what was typed
+                return city_name
+        return None
 
 
 class AskForCityScreen(Screen):
@@ -73,13 +132,25 @@ class AskForCityScreen(Screen):
         with Center():
             yield Label(help_label, classes="help_label")
         with Center():
-            yield Input(placeholder="Enter location...", id="city_input")
+            yield Input(placeholder="Enter location...", id="city_input", suggester=CitySuggester())
         with Center():
             yield Pretty([])
         yield Footer()
 
+    def on_mount(self) -> None:
+        self.load_suggestions()
+
+    @work(thread=True, exclusive=True, group="suggestions")
+    def load_suggestions(self) -> None:
+        """Index of city names takes a moment to build, do it before the first keystroke."""
+        suggest_cities("a")
+
+    async def on_input_changed(self, event: Input.Changed) -> None:
+        self.query_one(Pretty).update(await asyncio.to_thread(suggest_cities, event.value))
+
     def get_city_prompt(self) -> str:
         app.city_prompt = self.query_one(Input).value
+        app.location = Location(city_prompt=app.city_prompt)
         return app.city_prompt
 
     def on_input_submitted(self):
@@ -98,18 +169,47 @@ class AskAlertDetailsScreen(ModalScreen):
             id="dialog",
         )
 
-    def add_alert(self):
+    async def add_alert(self):
         min_temp = self.screen.query_one("#min_temp_input").value
         max_temp = self.screen.query_one("#max_temp_input").value
-        row = Alert.update(min_temp=min_temp, max_temp=max_temp).where(
-            Alert.city_name == app.my_weather_app.current_location.city_name
-        ).execute()
-
-    def on_input_submitted(self):
-        self.add_alert()
+        location = (await app.get_my_weather_app()).current_location   # may still be starting in the background
+        # both may have to ask Nominatim, off the event loop
+        (latitude, longitude), city_name = await asyncio.to_thread(lambda: (location.coords, location.city_name))
+        row = Alert.update(
+            min_temp=min_temp, max_temp=max_temp, latitude=latitude, longitude=longitude, display_name=city_name
+        ).where(Alert.city_name == city_name).execute()
+
+    async def on_input_submitted(self):
+        await self.add_alert()
         app.pop_screen()
 
 
+class CachedPlotextPlot(PlotextPlot):
+    """
+    Keeps canvases of recently shown plots: going back to one of them doesn't run plotext at all.
+    `prepared_plot` must be set to what was drawn on `plt`.
+    """
+    prepared_plot: "PreparedPlot" = None
+
+    def on_mount(self) -> None:
+        super().on_mount()
+        self.canvases = ForecastCache(max_entries=CANVAS_CACHE_MAX_ENTRIES)
+
+    def render(self):
+        if self.prepared_plot is None:
+            return super().render()
+        key = (id(self.prepared_plot), self.size.width, self.size.height, self.app.theme, self.theme)
+        cached = self.canvases.get(key)
+        if cached is not None and cached[0] is self.prepared_plot:
+            tracer.count("canvas_cache.hit")
+            return cached[1]
+        tracer.count("canvas_cache.miss")
+        with tracer.span("plot.canvas"):
+            canvas = super().render()
+        self.canvases.put(key, (self.prepared_plot, canvas))
+        return canvas
+
+
 class PlotScreen(Screen):
     BINDINGS = [
         ("t", "toggle_precision_mode", "Toggle daily/hourly"),
@@ -119,7 +219,7 @@ class PlotScreen(Screen):
 
     def compose(self) -> ComposeResult:
         # yield Placeholder("PlotScreen")
-        yield PlotextPlot(id="plotext-plot")
+        yield CachedPlotextPlot(id="plotext-plot")
         yield Footer()
 
     def on_mount(self):
@@ -131,33 +231,43 @@ class PlotScreen(Screen):
         self.screen.loading = True
         self.draw_hourly()
 
-    @work
-    async def draw_hourly(self):
-        plt = self.query_one(PlotextPlot).plt
-        await app.my_weather_app.draw_hourly_plot(plt, app.city_prompt)
-        self.query_one(PlotextPlot).refresh()
-        self.screen.loading = False
-        self.displaying_daily = False
-        self.displaying_hourly = True
-
-    @work
-    async def draw_daily(self):
-        plt = self.query_one(PlotextPlot).plt
-        await app.my_weather_app.draw_daily_plot(plt, app.city_prompt)
-        self.query_one(PlotextPlot).refresh()
-        self.screen.loading = False
-        self.displaying_daily = True
-        self.displaying_hourly = False
+    def draw_hourly(self):
+        self.draw_forecast("hourly")
+
+    def draw_daily(self):
+        self.draw_forecast("daily")
+
+    @work(exclusive=True, group="plot")
+    async def draw_forecast(self, kind: str):
+        """The last known forecast is shown at once (with its age if outdated), then swapped for the fresh one."""
+        self.displaying_daily = kind == "daily"
+        self.displaying_hourly = kind == "hourly"
+        plot = self.query_one(CachedPlotextPlot)
+        weather_app = await app.get_my_weather_app()
+        from helpers import age_to_str  # numpy, loaded by now anyway
+
+        # before the first layout the size is not known yet, the terminal width will do then
+        async for prepared_plot, age in weather_app.draw_plot_stale_while_revalidate(
+            plot.plt, app.location, kind, width=plot.size.width or None, height=plot.size.height or None
+        ):
+            plot.prepared_plot = prepared_plot
+            plot.refresh()
+            self.screen.loading = False
+            if weather_app.is_outdated(age):
+                self.notify(f"Showing the forecast from {age_to_str(age)} ago, refreshing...", timeout=3)
 
     def action_ask_for_details(self):
         """Handles keybinding."""
         app.push_screen("ask_alert_details")
 
-    def action_save_to_favourties(self):
+    async def action_save_to_favourties(self):
         """Handles keybinding."""
-        if Alert.get_or_none(Alert.city_name == app.my_weather_app.current_location.city_name):
+        location = (await app.get_my_weather_app()).current_location   # may still be starting in the background
+        # both may have to ask Nominatim, off the event loop
+        (latitude, longitude), city_name = await asyncio.to_thread(lambda: (location.coords, location.city_name))
+        if Alert.get_or_none(Alert.city_name == city_name):
             return
-        Alert(city_name=app.my_weather_app.current_location.city_name).save()
+        Alert(city_name=city_name, latitude=latitude, longitude=longitude, display_name=city_name).save()
         # self.screen.styles.background = "lime"
         # self.screen.styles.animate("opacity", value=0.0, duration=1.0)
 
@@ -181,7 +291,8 @@ class FavouritesScreen(Screen):
 
     @on(ScreenResume)
     def on_mount(self):
-        favourites = list(map(lambda favourite: favourite.city_name, Alert.select(Alert.city_name)))
+        self.favourites = list(map(alert_to_location, Alert.select()))  # stored coords, no geocoding on click
+        favourites = [favourite.city_name for favourite in self.favourites]
         label = self.screen.query_one(Label)
         if not favourites:
             label.update("You haven't saved any cities yet.")
@@ -196,7 +307,8 @@ class FavouritesScreen(Screen):
     @on(ListView.Selected)
     def get_plot_for_city(self):
         highlighted_index = self.screen.query_one(ListView).index
-        app.city_prompt = Alert.select(Alert.city_name)[highlighted_index].city_name    # TODO: bottleneck to remove
+        app.location = self.favourites[highlighted_index]
+        app.city_prompt = app.location.city_name
         app.switch_screen("plot")
 
 
@@ -236,17 +348,64 @@ class AlertsScreen(Screen):
             data_table.display = True
 
 
+class PerformanceScreen(Screen):
+    """Live numbers of `tracer`: latency of every stage and hit ratios of the caches."""
+    BINDINGS = [
+        ("t", "toggle_tracing", "Toggle tracing"),
+        ("r", "reset_tracing", "Reset"),
+    ]
+    COLUMNS = ["Stage", "Count", "Failed", "p50 (ms)", "p95 (ms)", "Max (ms)"]
+    REFRESH_INTERVAL_SECONDS = 1.0
+
+    def compose(self) -> ComposeResult:
+        yield Label("", id="tracing_label", classes="help_label")
+        yield DataTable(id="performance_data_table")
+        yield Label("", id="hit_ratios_label")
+        yield Footer()
+
+    def on_mount(self):
+        self.query_one(DataTable).add_columns(*self.COLUMNS)
+        self.update_rows()
+        self.set_interval(self.REFRESH_INTERVAL_SECONDS, self.update_rows)
+
+    @on(ScreenResume)
+    def update_rows(self):
+        self.query_one("#tracing_label", Label).update(
+            "Tracing is on." if tracer.enabled else "Tracing is off, press t to turn it on."
+        )
+        data_table = self.query_one(DataTable)
+        data_table.clear()
+        data_table.add_rows(
+            (name, stage["count"], stage["failed"], *(f"{stage[key] * 1000:.1f}" for key in ("p50", "p95", "max")))
+            for name, stage in tracer.stages.items()
+        )
+        hit_ratios = ", ".join(f"{cache}: {ratio:.0%}" for cache, ratio in tracer.hit_ratios.items())
+        self.query_one("#hit_ratios_label", Label).update(f"Cache hit ratios: {hit_ratios or '-'}")
+
+    def action_toggle_tracing(self):
+        if tracer.enabled:
+            tracer.disable()
+        else:
+            tracer.enable(TRACE_FILE)   # the file set at start, if any
+        self.update_rows()
+
+    def action_reset_tracing(self):
+        tracer.reset()
+        self.update_rows()
+
+
 class TerminalUserInterface(App):
-    my_weather_app = MyWeatherApp()
-    db = pw.SqliteDatabase(DATABASE_FILENAME)
-    db.connect()
+    my_weather_app: "MyWeatherApp" = None  # built in the background after mount, see `get_my_weather_app()`
+    db = db     # the one connection of the models
     city_prompt = None  # to store the city name entered by user between screens
+    location = None     # Location to plot, either typed by user or picked from favourites
 
     CSS_PATH = "terminal_user_interface.tcss"
     BINDINGS = [
         ("w", "switch_to_screen('ask_for_city')", "Check weather"),
         ("f", "switch_to_screen('favourites')", "Favourites"),
         ("a", "switch_to_screen('alerts')", "Alerts"),
+        ("p", "switch_to_screen('performance')", "Performance"),
         Binding("m, escape", "switch_to_screen('main')", "Return to main", priority=True),
         ("d", "toggle_dark", "Toggle dark mode"),
     ]
@@ -257,6 +416,7 @@ class TerminalUserInterface(App):
         "ask_for_city": AskForCityScreen,
         "plot": PlotScreen,
         "ask_alert_details": AskAlertDetailsScreen,
+        "performance": PerformanceScreen,
     }
 
     def compose(self) -> ComposeResult:
@@ -267,7 +427,39 @@ class TerminalUserInterface(App):
     def on_mount(self) -> None:
         # self.install_screen("plot")
         # self.theme = "nord"
+        initialize_db()
+        self.first_frame_shown = asyncio.Event()
         self.push_screen("main")
+        self.call_after_refresh(self.on_first_frame)
+
+    def on_first_frame(self) -> None:
+        """Only now the heavy part starts, in a thread: it would hold the first frame back otherwise."""
+        self.startup_time = time.perf_counter() - STARTED_AT
+        log = logging.info if self.startup_time <= STARTUP_BUDGET_SECONDS else logging.warning
+        log(f"Main screen shown {self.startup_time:.3f}s after start (budget: {STARTUP_BUDGET_SECONDS}s)")
+        self.my_weather_app_worker = self.build_my_weather_app()
+        self.first_frame_shown.set()
+
+    async def on_unmount(self) -> None:
+        if self.my_weather_app is not None:     # not if the start-up hasn't finished
+            await self.my_weather_app.close()
+
+    @work(thread=True, exclusive=True, group="startup")
+    def build_my_weather_app(self) -> "MyWeatherApp":
+        from my_weather_app import MyWeatherApp     # the heavy imports
+
+        self.my_weather_app = MyWeatherApp()
+        return self.my_weather_app
+
+    async def get_my_weather_app(self) -> "MyWeatherApp":
+        """Waits for the background start-up if it hasn't finished yet."""
+        await self.first_frame_shown.wait()
+        if self.my_weather_app is None:
+            try:    # shielded, the caller may be cancelled, the start-up must go on
+                await asyncio.shield(self.my_weather_app_worker.wait())
+            except WorkerCancelled:     # the app is shutting down, so is the worker waiting for it
+                raise asyncio.CancelledError()
+        return self.my_weather_app
 
     def action_switch_to_screen(self, name):
         self.switch_screen(name)
@@ -289,6 +481,8 @@ class TerminalUserInterface(App):
                 return False
             if action == "switch_to_screen" and parameters[0] == "favourites":
                 return False
+            if action == "switch_to_screen" and parameters[0] == "performance":
+                return False
             if action == "toggle_dark":
                 return False
         if isinstance(self.screen, AskAlertDetailsScreen):
@@ -299,6 +493,9 @@ class TerminalUserInterface(App):
         if isinstance(self.screen, FavouritesScreen):
             if action == "switch_to_screen" and parameters[0] == "favourites":
                 return False
+        if isinstance(self.screen, PerformanceScreen):
+            if action == "switch_to_screen" and parameters[0] == "performance":
+                return False
         if isinstance(self.screen, AskForCityScreen):
             pass
         return True
@@ -308,4 +505,4 @@ if __name__ == "__main__":
     logging.basicConfig(filename='tui.log', level=logging.INFO)
     app = TerminalUserInterface()
     app.run()
-    app.db.close()
+    db.close()
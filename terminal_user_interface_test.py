@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).parent
+HEAVY_MODULES = ["pandas", "geopy", "niquests", "requests_cache", "openmeteo_requests", "my_weather_app", "numpy"]
+
+
+def test_import_is_lazy(tmp_path):
+    # fresh interpreter, in an empty directory: nothing imported before, no database around
+    script = (
+        "import sys, terminal_user_interface; "
+        f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env={"PYTHONPATH": str(REPO)}, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+    assert not (tmp_path / "user_settings.db").exists()
@@ -0,0 +1,168 @@
+# Opt-in instrumentation of the hot paths: timing spans and counters, e.g. `WEATHER_TRACE=1 python terminal_user_interface.py`.
+# `WEATHER_TRACE_FILE=trace.jsonl` also writes every span and count there, one JSON object per line.
+# Disabled, a span is a shared do-nothing context manager and a count returns at once.
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+TRACE_MAX_SAMPLES = 1000    # durations kept per span name, percentiles are over the recent ones
+TRACE_FILE = os.environ.get("WEATHER_TRACE_FILE") or None
+TRACE_ENABLED = bool(TRACE_FILE) or os.environ.get("WEATHER_TRACE", "") not in ("", "0")
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "started_at")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, time.perf_counter() - self.started_at, failed=exc_type is not None)
+        return False
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    """Nearest rank. Example: `[1, 2, 3, 4]`, 0.5 -> 2"""
+    return sorted_samples[max(0, math.ceil(fraction * len(sorted_samples)) - 1)] if sorted_samples else 0.0
+
+
+class Tracer:
+    """
+    Durations of named spans (`with tracer.span("http"): ...`) and counters (`tracer.count("forecast_cache.hit")`).
+    Counters named `<cache>.hit` and `<cache>.miss` make up the hit ratio of `<cache>`.
+    """
+    def __init__(self, enabled: bool = False, trace_file: str = None, max_samples: int = TRACE_MAX_SAMPLES):
+        if max_samples < 1:
+            raise ValueError("At least one sample per span must be kept.")
+        self.enabled = False
+        self.max_samples = max_samples
+        self.__lock = threading.Lock()
+        self.__samples: dict[str, deque] = {}
+        self.__totals: dict[str, int] = {}    # every span ever recorded, not only the kept samples
+        self.__failures: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+        self.__trace_file = None
+        if enabled:
+            self.enable(trace_file)
+
+    def enable(self, trace_file: str = None) -> None:
+        if trace_file is not None and self.__trace_file is None:
+            self.__trace_file = open(trace_file, "a", encoding="utf-8")
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        with self.__lock:
+            if self.__trace_file is not None:
+                self.__trace_file.close()
+                self.__trace_file = None
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__samples.clear()
+            self.__totals.clear()
+            self.__failures.clear()
+            self.counters.clear()
+
+    def span(self, name: str):
+        return Span(self, name) if self.enabled else NO_SPAN
+
+    def traced(self, name: str):
+        """Decorator: every call of the function is a span."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.__write({"type": "count", "name": name, "value": value, "time": time.time()})
+
+    def record(self, name: str, duration: float, failed: bool = False) -> None:
+        with self.__lock:
+            if name not in self.__samples:
+                self.__samples[name] = deque(maxlen=self.max_samples)
+            self.__samples[name].append(duration)
+            self.__totals[name] = self.__totals.get(name, 0) + 1
+            if failed:
+                self.__failures[name] = self.__failures.get(name, 0) + 1
+            self.__write({
+                "type": "span",
+                "name": name,
+                "start": time.time() - duration,
+                "duration": duration,
+                "thread": threading.current_thread().name,
+                "failed": failed,
+            })
+
+    def __write(self, event: dict) -> None:
+        if self.__trace_file is not None:
+            self.__trace_file.write(json.dumps(event) + "\n")
+            self.__trace_file.flush()
+
+    @property
+    def stages(self) -> dict[str, dict[str, float]]:
+        """
+        Per span name, over the recent samples (seconds).
+        Example: `{"http": {"count": 12, "failed": 0, "p50": 0.21, "p95": 0.48, "max": 0.51}}`
+        """
+        with self.__lock:
+            samples = {name: sorted(durations) for name, durations in self.__samples.items()}
+            totals, failures = dict(self.__totals), dict(self.__failures)
+        return {
+            name: {
+                "count": totals[name],
+                "failed": failures.get(name, 0),
+                "p50": percentile(durations, 0.50),
+                "p95": percentile(durations, 0.95),
+                "max": durations[-1],
+            }
+            for name, durations in sorted(samples.items())
+        }
+
+    @property
+    def hit_ratios(self) -> dict[str, float]:
+        """Example: `{"forecast_cache": 0.75}` from 3 `forecast_cache.hit` and 1 `forecast_cache.miss`"""
+        with self.__lock:
+            counters = dict(self.counters)
+        ratios = {}
+        for name in counters:
+            cache, _, outcome = name.rpartition(".")
+            if outcome == "hit" or outcome == "miss":
+                hits, misses = counters.get(f"{cache}.hit", 0), counters.get(f"{cache}.miss", 0)
+                ratios[cache] = hits / (hits + misses)
+        return dict(sorted(ratios.items()))
+
+
+# The one the app's modules report to
+tracer = Tracer(TRACE_ENABLED, TRACE_FILE)
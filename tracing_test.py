@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from tracing import NO_SPAN, Tracer, percentile
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    assert tracer.span("http") is NO_SPAN
+    with tracer.span("http"):
+        pass
+    tracer.count("forecast_cache.hit")
+    assert tracer.stages == {}
+    assert tracer.counters == {}
+
+def test_percentile():
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    assert percentile([1, 2, 3, 4], 0.95) == 4
+    assert percentile([], 0.5) == 0.0
+
+def test_spans_and_hit_ratios():
+    tracer = Tracer(enabled=True, max_samples=3)
+    for duration in (0.4, 0.1, 0.2, 0.3):
+        tracer.record("http", duration)
+    with pytest.raises(RuntimeError):
+        with tracer.span("parse"):
+            raise RuntimeError("broken response")
+    stages = tracer.stages
+    assert stages["http"]["count"] == 4    # only the last 3 durations are kept
+    assert stages["http"]["p50"] == 0.2 and stages["http"]["max"] == 0.3
+    assert stages["parse"]["failed"] == 1
+
+    for name in ("forecast_cache.hit", "forecast_cache.hit", "forecast_cache.hit", "forecast_cache.miss", "geocoder_cache.miss"):
+        tracer.count(name)
+    assert tracer.hit_ratios == {"forecast_cache": 0.75, "geocoder_cache": 0.0}
+    tracer.reset()
+    assert tracer.stages == {} and tracer.hit_ratios == {}
+
+def test_traced_decorator_and_trace_file(tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    tracer = Tracer(enabled=True, trace_file=trace_file)
+
+    @tracer.traced("geocoding.forward")
+    def geocode(city_name):
+        return (52.23, 21.01)
+
+    assert geocode("Warszawa") == (52.23, 21.01)
+    assert geocode.__name__ == "geocode"
+    tracer.count("geocoder_cache.miss")
+    tracer.disable()
+    assert geocode("Warszawa") == (52.23, 21.01)     # not recorded
+
+    events = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [(event["type"], event["name"]) for event in events] == [
+        ("span", "geocoding.forward"),
+        ("count", "geocoder_cache.miss"),
+    ]
+    assert events[0]["duration"] >= 0
+
+def test_validation():
+    with pytest.raises(ValueError):
+        Tracer(max_samples=0)